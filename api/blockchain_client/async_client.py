@@ -0,0 +1,266 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import APIException, ParseError, ValidationError
+
+from project.crypto_currencies import CryptoCurrency
+from .client import BlockchainClient, adaptive_timeout, balance_error, chunks_of_page
+from .exceptions import Saturated, UpstreamTimeout, UpstreamUnavailable
+from .handlers import BTCHandler, BCHHandler, ETHHandler
+from .ratelimit import in_background
+from .transport import AsyncTransport
+
+
+class AsyncHandler:
+    # Runs a CryptoHandler on an AsyncTransport. Its query_* methods then return awaitables,
+    # everything else (urls, transforms, response checks) is the same code as the sync path.
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def attempt(self, query):
+        # Same as CryptoHandler.attempt, sharing the rate limiter and circuit breaker with the sync path
+        breaker = self.handler.breaker
+        breaker.acquire()
+        try:
+            await self.handler.upstreams.limiter.acquire_async(self.handler.host)
+        except BaseException:
+            # Cancelled while waiting for a token as well
+            breaker.release()
+            raise
+        started = time.monotonic()
+        try:
+            response = await query()
+        except Saturated:
+            breaker.release()
+            raise
+        except BaseException:
+            breaker.record(True, time.monotonic() - started)
+            raise
+        breaker.record(self.handler.failed(response), time.monotonic() - started)
+        return response
+
+    async def call(self, query, hedge=False):
+        # Same as CryptoHandler.call
+        handler = self.handler
+        if handler.upstreams is None:
+            return await query()
+        policy = handler.upstreams.policy(handler.crypto)
+        deadline = time.monotonic() + policy.deadline
+        handler.retry_budget.deposit()
+        retry = 0
+        while True:
+            response = error = None
+            try:
+                response = await (self.hedged(query) if hedge else self.attempt(query))
+            except (UpstreamTimeout, UpstreamUnavailable) as e:
+                error = e
+            retry += 1
+            delay = handler.next_retry(policy, retry, deadline, response, error)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    async def hedged(self, query):
+        delay = self.handler.hedge_delay()
+        if delay is None:
+            return await self.attempt(query)
+        first = asyncio.ensure_future(self.attempt(query))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self.handler.retry_budget.withdraw():
+            return await first
+        pending = {first, asyncio.ensure_future(self.attempt(query))}
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not pending or (task.exception() is None and not self.handler.failed(task.result())):
+                    # The slower request is not needed anymore
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+
+    async def transactions_by_address(self, address, page, size):
+        response = await self.call(lambda: self.handler.query_transactions_by_address(address, page, size))
+        return self.handler.parse_transactions_by_address(address, response)
+
+    async def fetch_transaction(self, tx):
+        hedge = settings.BLOCKCHAIN_CLIENT_HEDGE_TRANSACTIONS
+        response = await self.call(lambda: self.handler.query_transaction(tx), hedge=hedge)
+        return self.handler.parse_transaction(tx, response)
+
+    async def address_balance(self, address):
+        response = await self.call(lambda: self.handler.query_address_balance(address))
+        return self.handler.parse_address_balance(address, response)
+
+    async def address_balances(self, addresses):
+        response = await self.call(lambda: self.handler.query_address_balances(addresses))
+        return self.handler.parse_address_balances(addresses, response)
+
+
+async def fan_out(fn, items):
+    # Runs fn for every item concurrently, at most BLOCKCHAIN_CLIENT_FAN_OUT at a time, results are in order of items
+    semaphore = asyncio.Semaphore(settings.BLOCKCHAIN_CLIENT_FAN_OUT)
+
+    async def bounded(item):
+        async with semaphore:
+            return await fn(item)
+    return await asyncio.gather(*[bounded(item) for item in items])
+
+
+async def chunk_balances(crypto, handler, addresses):
+    try:
+        return await handler.address_balances(addresses)
+    except ParseError:
+        # The batch was rejected because of some address in it, single lookups tell which one
+        pass
+    except APIException as e:
+        return [balance_error(crypto, address, e) for address in addresses]
+
+    async def single(address):
+        try:
+            with BlockchainClient.not_found.guard('balance', crypto, address):
+                return await handler.address_balance(address)
+        except APIException as e:
+            return balance_error(crypto, address, e)
+    return await fan_out(single, addresses)
+
+
+class AsyncBlockchainClient:
+    # Async counterpart of BlockchainClient, shares its caches
+    transport = AsyncTransport(
+        max_connections=settings.BLOCKCHAIN_CLIENT_ASYNC_MAX_CONNECTIONS,
+        keepalive_connections=settings.BLOCKCHAIN_CLIENT_POOL_SIZE,
+        connect_timeout=settings.BLOCKCHAIN_CLIENT_CONNECT_TIMEOUT,
+        read_timeout=settings.BLOCKCHAIN_CLIENT_READ_TIMEOUT,
+        adaptive_timeout=adaptive_timeout(),
+    )
+    handlers = {
+        CryptoCurrency.BTC.value: AsyncHandler(BTCHandler(transport, BlockchainClient.upstreams)),
+        CryptoCurrency.BCH.value: AsyncHandler(BCHHandler(transport, BlockchainClient.upstreams)),
+        CryptoCurrency.ETH.value: AsyncHandler(ETHHandler(transport, BlockchainClient.upstreams)),
+    }
+
+    @staticmethod
+    def handler(crypto):
+        if crypto in AsyncBlockchainClient.handlers:
+            return AsyncBlockchainClient.handlers[crypto]
+
+        raise ValidationError(f'Cryptocurrency \'{crypto}\' is not supported')
+
+    @staticmethod
+    async def transactions_for_address(crypto, address, page, size):
+        if page < 0:
+            raise ParseError('\'page\' cannot be negative')
+
+        if settings.BLOCKCHAIN_CLIENT_TX_INDEX:
+            # The index lives in the database, it is used through the sync client
+            return await sync_to_async(BlockchainClient.transactions_for_address)(crypto, address, page, size)
+
+        # Same chunks as BlockchainClient.transactions_for_address, sharing its page cache
+        handler = AsyncBlockchainClient.handler(crypto)
+        chunk = settings.BLOCKCHAIN_CLIENT_TX_CHUNK or size
+        indexes, skip = chunks_of_page(page, size, chunk)
+
+        async def fetch(index):
+            cached = BlockchainClient.page_cache.get(crypto, address, chunk, index)
+            if cached is not None:
+                return cached
+            with BlockchainClient.not_found.guard('transactions', crypto, address):
+                transactions = (await BlockchainClient.single_flight.do_async(
+                    ('transactions_by_address', crypto, address, index, chunk),
+                    lambda: handler.transactions_by_address(address, index, chunk)))['transactions']
+            BlockchainClient.page_cache.set(crypto, address, chunk, index, transactions)
+            return transactions
+        chunks = await fan_out(fetch, list(indexes))
+        return {'transactions': [tx for transactions in chunks for tx in transactions][skip:skip + size]}
+
+    @staticmethod
+    async def transaction(crypto, tx):
+        return (await AsyncBlockchainClient.transaction_entry(crypto, tx)).data
+
+    @staticmethod
+    async def transaction_entry(crypto, tx):
+        handler = AsyncBlockchainClient.handler(crypto)
+        cached = BlockchainClient.transaction_cache.get(crypto, tx)
+        if cached is not None:
+            return cached
+
+        if settings.BLOCKCHAIN_CLIENT_TX_INDEX:
+            # Looked up in and added to the index by the sync client, like transactions_for_address
+            return await sync_to_async(BlockchainClient.transaction_entry)(crypto, tx)
+
+        with BlockchainClient.not_found.guard('transaction', crypto, tx):
+            data, confirmed = await BlockchainClient.single_flight.do_async(
+                ('transaction', crypto, tx, None, None),
+                lambda: handler.fetch_transaction(tx))
+        return BlockchainClient.transaction_cache.set(crypto, tx, data, confirmed)
+
+    @staticmethod
+    async def address_balance(crypto, address):
+        handler = AsyncBlockchainClient.handler(crypto)
+        cached = BlockchainClient.balance_cache.get(crypto, address)
+        if cached is not None:
+            if not BlockchainClient.balance_cache.is_fresh(cached):
+                BlockchainClient.refresher.submit(
+                    ('address_balance', crypto, address),
+                    in_background(lambda: BlockchainClient.fetch_balance(crypto, address)))
+            return cached.data
+        with BlockchainClient.not_found.guard('balance', crypto, address):
+            balance = await BlockchainClient.single_flight.do_async(
+                ('address_balance', crypto, address, None, None),
+                lambda: handler.address_balance(address))
+        BlockchainClient.balance_cache.set(crypto, address, balance)
+        return balance
+
+    @staticmethod
+    async def address_balances(crypto, addresses):
+        # Serves cached balances like BlockchainClient.address_balances, stale ones are refreshed by its refresher
+        AsyncBlockchainClient.handler(crypto)
+        cache = BlockchainClient.balance_cache
+        cached = {address: cache.get(crypto, address) for address in addresses}
+        stale = [address for address, entry in cached.items() if entry is not None and not cache.is_fresh(entry)]
+        if stale:
+            BlockchainClient.refresher.submit(
+                ('address_balances', crypto, tuple(stale)),
+                in_background(lambda: BlockchainClient.fetch_balances(crypto, stale)))
+
+        missing = [address for address, entry in cached.items() if entry is None]
+        fetched = dict(zip(missing, await AsyncBlockchainClient.fetch_balances(crypto, missing)))
+        return [fetched[address] if cached[address] is None else cached[address].data for address in addresses]
+
+    @staticmethod
+    async def fetch_balances(crypto, addresses):
+        handler = AsyncBlockchainClient.handler(crypto)
+        size = settings.BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE
+        chunks = [addresses[i:i + size] for i in range(0, len(addresses), size)]
+        balances = [balance for chunk in await fan_out(lambda chunk: chunk_balances(crypto, handler, chunk), chunks)
+                    for balance in chunk]
+        for address, balance in zip(addresses, balances):
+            if 'error' not in balance:
+                BlockchainClient.balance_cache.set(crypto, address, balance)
+        return balances
+
+    @staticmethod
+    async def balances(addresses):
+        by_crypto = {}
+        for index, (crypto, address) in enumerate(addresses):
+            by_crypto.setdefault(crypto, []).append((index, address))
+
+        async def fetch(crypto):
+            requested = [address for _, address in by_crypto[crypto]]
+            try:
+                return await AsyncBlockchainClient.address_balances(crypto, requested)
+            except APIException as e:
+                return [balance_error(crypto, address, e) for address in requested]
+
+        result = [None] * len(addresses)
+        cryptos = list(by_crypto)
+        for crypto, balances in zip(cryptos, await asyncio.gather(*[fetch(crypto) for crypto in cryptos])):
+            for (index, _), balance in zip(by_crypto[crypto], balances):
+                result[index] = balance
+        return result
@@ -0,0 +1,255 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from rest_framework.exceptions import NotFound
+
+from .streaming import content_etag
+
+
+class LRUCache:
+    # Bounded, thread-safe in-process cache. Entries may expire after a ttl (in seconds), None never expires.
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Counters:
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = {name: 0 for name in names}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._values[name] += value
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class TieredCache:
+    # Bounded per worker LRU tier in front of an optional shared tier, any Django cache (e.g. file based)
+    # all workers can see. Expiry is tracked as wall clock time, so it survives the trip through the shared tier.
+
+    def __init__(self, max_size, shared_alias=None):
+        self.local = LRUCache(max_size)
+        self.shared_alias = shared_alias
+        self.counters = Counters('hits', 'shared_hits', 'misses')
+
+    @property
+    def shared(self):
+        return None if self.shared_alias is None else caches[self.shared_alias]
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.counters.increment('hits')
+            return value
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self.counters.increment('shared_hits')
+                    self.local.set(key, value, ttl=None if expires is None else expires - time.time())
+                    return value
+        self.counters.increment('misses')
+        return None
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl=ttl)
+        if self.shared is not None:
+            self.shared.set(key, (value, None if ttl is None else time.time() + ttl), timeout=ttl)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        return dict(self.counters.as_dict(), size=len(self.local))
+
+
+# 'expires' is a wall clock timestamp, None for confirmed transactions. 'etag' is the content hash of data,
+# None in entries written to the shared tier before it was added.
+TransactionEntry = namedtuple('TransactionEntry', ['data', 'confirmed', 'expires', 'etag'], defaults=(None,))
+
+
+class TransactionCache(TieredCache):
+    # Serialized transactions keyed by (crypto, hash). Confirmed transactions never change, so they never expire.
+
+    def __init__(self, max_size, unconfirmed_ttl, shared_alias=None):
+        super().__init__(max_size, shared_alias)
+        self.unconfirmed_ttl = unconfirmed_ttl
+
+    @staticmethod
+    def key(crypto, tx):
+        return f'blockchain-client:tx:{crypto}:{tx}'
+
+    def get(self, crypto, tx):
+        return super().get(self.key(crypto, tx))
+
+    def set(self, crypto, tx, data, confirmed):
+        ttl = None if confirmed else self.unconfirmed_ttl
+        entry = TransactionEntry(data=data, confirmed=confirmed, expires=None if ttl is None else time.time() + ttl,
+                                 etag=content_etag(data))
+        super().set(self.key(crypto, tx), entry, ttl=ttl)
+        return entry
+
+
+class TransactionPageCache(TieredCache):
+    # Upstream pages of address transactions keyed by (crypto, address, page size, page). New transactions
+    # shift every page of a history, so pages are only kept for ttl seconds (not at all with 0).
+
+    def __init__(self, max_size, ttl, shared_alias=None):
+        super().__init__(max_size, shared_alias)
+        self.ttl = ttl
+
+    @staticmethod
+    def key(crypto, address, size, page):
+        return f'blockchain-client:transactions:{crypto}:{address}:{size}:{page}'
+
+    def get(self, crypto, address, size, page):
+        return super().get(self.key(crypto, address, size, page))
+
+    def set(self, crypto, address, size, page, transactions):
+        if self.ttl:
+            super().set(self.key(crypto, address, size, page), transactions, ttl=self.ttl)
+
+
+class NotFoundCache:
+    # Lookups upstream answered with 404, keyed by (kind, crypto, key), so repeated lookups of what does not exist
+    # fail right away for ttl seconds (0 disables). Kept apart from the other caches and in this worker only,
+    # with its own bound: the shared tier culls all caches alike, where junk lookups could push out useful entries.
+
+    def __init__(self, max_size, ttl):
+        self.local = LRUCache(max_size)
+        self.ttl = ttl
+        self.counters = Counters('hits', 'misses')
+
+    @contextmanager
+    def guard(self, kind, crypto, key):
+        # Raises the remembered NotFound, or remembers the one raised in the block
+        if self.ttl:
+            detail = self.local.get((kind, crypto, key))
+            self.counters.increment('misses' if detail is None else 'hits')
+            if detail is not None:
+                raise NotFound(detail)
+        try:
+            yield
+        except NotFound as e:
+            if self.ttl:
+                self.local.set((kind, crypto, key), e.detail, ttl=self.ttl)
+            raise
+
+    def clear(self):
+        self.local.clear()
+        self.counters = Counters('hits', 'misses')
+
+    def stats(self):
+        return dict(self.counters.as_dict(), size=len(self.local))
+
+
+BalanceEntry = namedtuple('BalanceEntry', ['data', 'fetched'])
+
+
+class BalanceCache(TieredCache):
+    # Balances keyed by (crypto, address). Entries are fresh for fresh_ttl seconds and can be served stale
+    # for stale_ttl seconds after that, while they are refreshed in the background.
+
+    def __init__(self, max_size, fresh_ttl, stale_ttl, shared_alias=None):
+        super().__init__(max_size, shared_alias)
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+
+    @staticmethod
+    def key(crypto, address):
+        return f'blockchain-client:balance:{crypto}:{address}'
+
+    def get(self, crypto, address):
+        return super().get(self.key(crypto, address))
+
+    def set(self, crypto, address, data):
+        entry = BalanceEntry(data=data, fetched=time.time())
+        super().set(self.key(crypto, address), entry, ttl=self.fresh_ttl + self.stale_ttl)
+        return entry
+
+    def is_fresh(self, entry):
+        return entry.fetched + self.fresh_ttl > time.time()
+
+
+class Refresher:
+    # Runs refreshes on a small background pool, a key that is already being refreshed is not submitted again
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.counters = Counters('submitted', 'skipped', 'failed')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self._pid = None
+
+    def submit(self, key, fn):
+        with self._lock:
+            if key in self._pending:
+                self.counters.increment('skipped')
+                return False
+            # Pool threads do not survive a fork, every worker gets its own
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = set()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='refresher')
+            self._pending.add(key)
+        self.counters.increment('submitted')
+        self._executor.submit(self._run, key, fn)
+        return True
+
+    def _run(self, key, fn):
+        try:
+            fn()
+        except Exception:
+            self.counters.increment('failed')
+            logging.warning(f'Background refresh of {key} failed', exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        return self.counters.as_dict()
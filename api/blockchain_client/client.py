@@ -1,38 +1,389 @@
-from rest_framework.exceptions import ParseError, ValidationError
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from django.conf import settings
+from django.db import IntegrityError
+from rest_framework.exceptions import APIException, ParseError, ValidationError
 
 from project.crypto_currencies import CryptoCurrency
+from .cache import BalanceCache, NotFoundCache, Refresher, TransactionCache, TransactionPageCache
 from .handlers import BTCHandler, BCHHandler, ETHHandler
+from .index import TransactionIndex
+from .ratelimit import BACKGROUND, INTERACTIVE, RateLimiter, in_background
+from .resilience import AdaptiveTimeout, Upstreams
+from .singleflight import SingleFlight
+from .transport import Transport
+
+
+def fan_out(fn, items):
+    # Runs fn for every item on a bounded thread pool, results are in the order of items.
+    # Every call runs in a copy of the caller's context, so request scoped state (e.g. metrics) follows it.
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(settings.BLOCKCHAIN_CLIENT_FAN_OUT, len(items))) as executor:
+        futures = [executor.submit(copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def adaptive_timeout():
+    return AdaptiveTimeout(
+        max_read=settings.BLOCKCHAIN_CLIENT_READ_TIMEOUT,
+        min_read=settings.BLOCKCHAIN_CLIENT_MIN_READ_TIMEOUT,
+        percentile=settings.BLOCKCHAIN_CLIENT_TIMEOUT_PERCENTILE,
+        factor=settings.BLOCKCHAIN_CLIENT_TIMEOUT_FACTOR,
+        enabled=settings.BLOCKCHAIN_CLIENT_ADAPTIVE_TIMEOUT,
+    )
+
+
+def retry_policies():
+    # RetryPolicy options per crypto, on top of the defaults from settings
+    default = dict(
+        retries=settings.BLOCKCHAIN_CLIENT_RETRIES,
+        backoff=settings.BLOCKCHAIN_CLIENT_RETRY_BACKOFF,
+        max_backoff=settings.BLOCKCHAIN_CLIENT_RETRY_MAX_BACKOFF,
+        deadline=settings.BLOCKCHAIN_CLIENT_RETRY_DEADLINE,
+        retry_on=settings.BLOCKCHAIN_CLIENT_RETRY_ON,
+    )
+    return dict(settings.BLOCKCHAIN_CLIENT_RETRY_POLICIES, default=default)
+
+
+def chunks_of_page(page, size, chunk):
+    # Upstream pages of `chunk` transactions that hold a page, and where the page starts in the first of them
+    start = page * size
+    first = start // chunk
+    return range(first, (start + size - 1) // chunk + 1), start - first * chunk
+
+
+def balance_error(crypto, address, error):
+    return {'crypto': crypto, 'address': address, 'balance': None, 'error': str(error.detail)}
+
+
+def chunk_balances(crypto, handler, addresses):
+    try:
+        return handler.address_balances(addresses)
+    except ParseError:
+        # The batch was rejected because of some address in it, single lookups tell which one
+        pass
+    except APIException as e:
+        return [balance_error(crypto, address, e) for address in addresses]
+
+    def single(address):
+        try:
+            with BlockchainClient.not_found.guard('balance', crypto, address):
+                return handler.address_balance(address)
+        except APIException as e:
+            return balance_error(crypto, address, e)
+    return fan_out(single, addresses)
 
 
 class BlockchainClient:
     # In general, I'm not sure it's a very good solution, since most likely all currencies cannot be fit into one format
     # But for these 3 and limited requirements it seems to be possible. It's also simpler for the clients of the API.
+    transport = Transport(
+        pool_size=settings.BLOCKCHAIN_CLIENT_POOL_SIZE,
+        connect_timeout=settings.BLOCKCHAIN_CLIENT_CONNECT_TIMEOUT,
+        read_timeout=settings.BLOCKCHAIN_CLIENT_READ_TIMEOUT,
+        max_concurrency=settings.BLOCKCHAIN_CLIENT_MAX_CONCURRENCY,
+        adaptive_timeout=adaptive_timeout(),
+    )
+    upstreams = Upstreams(
+        breaker=dict(
+            window=settings.BLOCKCHAIN_CLIENT_BREAKER_WINDOW,
+            min_calls=settings.BLOCKCHAIN_CLIENT_BREAKER_MIN_CALLS,
+            failure_rate=settings.BLOCKCHAIN_CLIENT_BREAKER_FAILURE_RATE,
+            slow_call=settings.BLOCKCHAIN_CLIENT_BREAKER_SLOW_CALL,
+            slow_rate=settings.BLOCKCHAIN_CLIENT_BREAKER_SLOW_RATE,
+            open_seconds=settings.BLOCKCHAIN_CLIENT_BREAKER_OPEN_SECONDS,
+        ),
+        budget=dict(
+            ratio=settings.BLOCKCHAIN_CLIENT_RETRY_BUDGET_RATIO,
+            min_per_second=settings.BLOCKCHAIN_CLIENT_RETRY_BUDGET_MIN_PER_SECOND,
+        ),
+        policies=retry_policies,
+        limiter=RateLimiter(
+            rate=settings.BLOCKCHAIN_CLIENT_RATE_LIMIT,
+            burst=settings.BLOCKCHAIN_CLIENT_RATE_LIMIT_BURST,
+            reserve=settings.BLOCKCHAIN_CLIENT_RATE_LIMIT_RESERVE,
+            wait={
+                INTERACTIVE: settings.BLOCKCHAIN_CLIENT_RATE_LIMIT_WAIT,
+                BACKGROUND: settings.BLOCKCHAIN_CLIENT_RATE_LIMIT_BACKGROUND_WAIT,
+            },
+            state_dir=settings.BLOCKCHAIN_CLIENT_RATE_LIMIT_DIR,
+        ),
+    )
     handlers = {
-        CryptoCurrency.BTC.value: BTCHandler(),
-        CryptoCurrency.BCH.value: BCHHandler(),
-        CryptoCurrency.ETH.value: ETHHandler(),
+        CryptoCurrency.BTC.value: BTCHandler(transport, upstreams),
+        CryptoCurrency.BCH.value: BCHHandler(transport, upstreams),
+        CryptoCurrency.ETH.value: ETHHandler(transport, upstreams),
     }
+    transaction_cache = TransactionCache(
+        max_size=settings.BLOCKCHAIN_CLIENT_TX_CACHE_SIZE,
+        unconfirmed_ttl=settings.BLOCKCHAIN_CLIENT_UNCONFIRMED_TX_TTL,
+        shared_alias=settings.BLOCKCHAIN_CLIENT_SHARED_CACHE,
+    )
+    balance_cache = BalanceCache(
+        max_size=settings.BLOCKCHAIN_CLIENT_BALANCE_CACHE_SIZE,
+        fresh_ttl=settings.BLOCKCHAIN_CLIENT_BALANCE_FRESH_TTL,
+        stale_ttl=settings.BLOCKCHAIN_CLIENT_BALANCE_STALE_TTL,
+        shared_alias=settings.BLOCKCHAIN_CLIENT_SHARED_CACHE,
+    )
+    page_cache = TransactionPageCache(
+        max_size=settings.BLOCKCHAIN_CLIENT_TX_PAGE_CACHE_SIZE,
+        ttl=settings.BLOCKCHAIN_CLIENT_TX_PAGE_TTL,
+        shared_alias=settings.BLOCKCHAIN_CLIENT_SHARED_CACHE,
+    )
+    not_found = NotFoundCache(
+        max_size=settings.BLOCKCHAIN_CLIENT_NOT_FOUND_CACHE_SIZE,
+        ttl=settings.BLOCKCHAIN_CLIENT_NOT_FOUND_TTL,
+    )
+    refresher = Refresher(max_workers=settings.BLOCKCHAIN_CLIENT_REFRESH_WORKERS)
+    # Used with BLOCKCHAIN_CLIENT_TX_INDEX only
+    transaction_index = TransactionIndex(
+        chunk=settings.BLOCKCHAIN_CLIENT_TX_INDEX_CHUNK,
+        sync_ttl=settings.BLOCKCHAIN_CLIENT_TX_INDEX_SYNC_TTL,
+    )
+    # Identical concurrent upstream calls are keyed by (method, crypto, key, page, size)
+    single_flight = SingleFlight(
+        lock_dir=settings.BLOCKCHAIN_CLIENT_SINGLE_FLIGHT_LOCK_DIR,
+        shared_alias=settings.BLOCKCHAIN_CLIENT_SHARED_CACHE,
+    )
+
+    @staticmethod
+    def handler(crypto):
+        if crypto in BlockchainClient.handlers:
+            return BlockchainClient.handlers[crypto]
+
+        raise ValidationError(f'Cryptocurrency \'{crypto}\' is not supported')
 
     @staticmethod
     def transactions_for_address(crypto, address, page, size):
         if page < 0:
             raise ParseError('\'page\' cannot be negative')
 
-        if crypto in BlockchainClient.handlers:
-            return BlockchainClient.handlers[crypto].transactions_by_address(address, page, size)
+        handler = BlockchainClient.handler(crypto)
+        if settings.BLOCKCHAIN_CLIENT_TX_INDEX:
+            with BlockchainClient.not_found.guard('transactions', crypto, address):
+                return BlockchainClient.single_flight.do(
+                    ('transactions_by_address', crypto, address, page, size),
+                    lambda: BlockchainClient.indexed_transactions(handler, address, page, size))
 
-        raise ValidationError(f'Cryptocurrency \'{crypto}\' is not supported')
+        # Upstream is asked for whole chunks (pages of BLOCKCHAIN_CLIENT_TX_CHUNK transactions), a page is cut from them
+        chunk = settings.BLOCKCHAIN_CLIENT_TX_CHUNK or size
+        indexes, skip = chunks_of_page(page, size, chunk)
+        chunks = fan_out(lambda index: BlockchainClient.transactions_chunk(crypto, handler, address, index, chunk),
+                         list(indexes))
+        return {'transactions': [tx for transactions in chunks for tx in transactions][skip:skip + size]}
+
+    @staticmethod
+    def transactions_chunk(crypto, handler, address, index, chunk):
+        cached = BlockchainClient.page_cache.get(crypto, address, chunk, index)
+        if cached is not None:
+            return cached
+        with BlockchainClient.not_found.guard('transactions', crypto, address):
+            transactions = BlockchainClient.single_flight.do(
+                ('transactions_by_address', crypto, address, index, chunk),
+                lambda: handler.transactions_by_address(address, index, chunk)['transactions'])
+        BlockchainClient.page_cache.set(crypto, address, chunk, index, transactions)
+        return transactions
+
+    @staticmethod
+    def prefetch_transactions(crypto, address, page, size):
+        # Fetches a page into the page cache in the background, for clients paging through a history
+        if settings.BLOCKCHAIN_CLIENT_TX_INDEX or not BlockchainClient.page_cache.ttl:
+            return
+        BlockchainClient.refresher.submit(
+            ('transactions_for_address', crypto, address, page, size),
+            in_background(lambda: BlockchainClient.transactions_for_address(crypto, address, page, size)))
+
+    @staticmethod
+    def stream_transactions_for_address(crypto, address, page, size):
+        # Same page as transactions_for_address as an iterator of transactions, transformed while the upstream body
+        # is read. Pages are neither collapsed nor indexed this way.
+        if page < 0:
+            raise ParseError('\'page\' cannot be negative')
+
+        handler = BlockchainClient.handler(crypto)
+        with BlockchainClient.not_found.guard('transactions', crypto, address):
+            return handler.stream_transactions_by_address(address, page, size, settings.STREAM_CHUNK_SIZE)
+
+    @staticmethod
+    def indexed_transactions(handler, address, page, size):
+        try:
+            return BlockchainClient.transaction_index.transactions_for_address(handler, address, page, size)
+        except IntegrityError:
+            # Another worker indexed the same history at the same time, this page comes straight from upstream
+            return handler.transactions_by_address(address, page, size)
+
+    @staticmethod
+    def sync_address(crypto, address):
+        # Fetches the transactions of an address newer than the indexed ones, returns the newest transaction's hash
+        handler = BlockchainClient.handler(crypto)
+        try:
+            return BlockchainClient.transaction_index.sync_address(handler, address)
+        except IntegrityError:
+            # A web worker indexed the same transactions at the same time, the index has them now
+            return BlockchainClient.transaction_index.newest(crypto, address)
+
+    @staticmethod
+    def newest_transactions(addresses):
+        # {(crypto, address): hash} of the newest indexed transaction of many addresses
+        return BlockchainClient.transaction_index.newest_of(addresses)
+
+    @staticmethod
+    def new_transactions(addresses, limit):
+        # {(crypto, address): transactions} of the indexed transactions newer than the `since` hash of many
+        # (crypto, address, since), see sync_address. Addresses without any are left out.
+        return {key: [dict(data, hash=hash) for hash, data in newer]
+                for key, newer in BlockchainClient.transaction_index.newer_of(addresses, limit).items()}
 
     @staticmethod
     def transaction(crypto, tx):
-        if crypto in BlockchainClient.handlers:
-            return BlockchainClient.handlers[crypto].transaction(tx)
+        return BlockchainClient.transaction_entry(crypto, tx).data
 
-        raise ValidationError(f'Cryptocurrency \'{crypto}\' is not supported')
+    @staticmethod
+    def transaction_entry(crypto, tx):
+        # The transaction with whether it is confirmed and its ETag, see TransactionEntry
+        handler = BlockchainClient.handler(crypto)
+        cached = BlockchainClient.transaction_cache.get(crypto, tx)
+        if cached is not None:
+            return cached
+
+        index = BlockchainClient.transaction_index if settings.BLOCKCHAIN_CLIENT_TX_INDEX else None
+        data = None if index is None else index.transaction(crypto, tx)
+        if data is not None:
+            return BlockchainClient.transaction_cache.set(crypto, tx, data, True)
+
+        with BlockchainClient.not_found.guard('transaction', crypto, tx):
+            data, confirmed = BlockchainClient.single_flight.do(
+                ('transaction', crypto, tx, None, None),
+                lambda: handler.fetch_transaction(tx))
+        entry = BlockchainClient.transaction_cache.set(crypto, tx, data, confirmed)
+        if index is not None:
+            index.add_transaction(crypto, tx, data, confirmed)
+        return entry
 
     @staticmethod
     def address_balance(crypto, address):
-        if crypto in BlockchainClient.handlers:
-            return BlockchainClient.handlers[crypto].address_balance(address)
+        # Stale while revalidate: a stale balance is served as is and refreshed in the background
+        BlockchainClient.handler(crypto)
+        cache = BlockchainClient.balance_cache
+        cached = cache.get(crypto, address)
+        if cached is not None:
+            if not cache.is_fresh(cached):
+                BlockchainClient.refresher.submit(
+                    ('address_balance', crypto, address),
+                    in_background(lambda: BlockchainClient.fetch_balance(crypto, address)))
+            return cached.data
+        return BlockchainClient.fetch_balance(crypto, address)
 
-        raise ValidationError(f'Cryptocurrency \'{crypto}\' is not supported')
+    @staticmethod
+    def fetch_balance(crypto, address):
+        handler = BlockchainClient.handler(crypto)
+        with BlockchainClient.not_found.guard('balance', crypto, address):
+            balance = BlockchainClient.single_flight.do(
+                ('address_balance', crypto, address, None, None),
+                lambda: handler.address_balance(address))
+        BlockchainClient.balance_cache.set(crypto, address, balance)
+        return balance
+
+    @staticmethod
+    def address_balances(crypto, addresses):
+        # Balances of many addresses, returned in the given order. Cached balances are served the same way
+        # as in address_balance, only the missing ones are fetched before returning.
+        BlockchainClient.handler(crypto)
+        cache = BlockchainClient.balance_cache
+        cached = {address: cache.get(crypto, address) for address in addresses}
+        stale = [address for address, entry in cached.items() if entry is not None and not cache.is_fresh(entry)]
+        if stale:
+            BlockchainClient.refresher.submit(
+                ('address_balances', crypto, tuple(stale)),
+                in_background(lambda: BlockchainClient.fetch_balances(crypto, stale)))
+
+        missing = [address for address, entry in cached.items() if entry is None]
+        fetched = dict(zip(missing, BlockchainClient.fetch_balances(crypto, missing)))
+        return [fetched[address] if cached[address] is None else cached[address].data for address in addresses]
+
+    @staticmethod
+    def fetch_balances(crypto, addresses):
+        # Balances of many addresses using upstream batch queries, fetched concurrently but returned in the given order.
+        # A failing address is reported with an error instead of failing the whole result, and is not cached.
+        handler = BlockchainClient.handler(crypto)
+        size = settings.BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE
+        chunks = [addresses[i:i + size] for i in range(0, len(addresses), size)]
+        balances = [balance for chunk in fan_out(lambda chunk: chunk_balances(crypto, handler, chunk), chunks)
+                    for balance in chunk]
+        for address, balance in zip(addresses, balances):
+            if 'error' not in balance:
+                BlockchainClient.balance_cache.set(crypto, address, balance)
+        return balances
+
+    @staticmethod
+    def balances(addresses):
+        # Same as address_balances, but for (crypto, address) pairs of mixed cryptocurrencies
+        by_crypto = {}
+        for index, (crypto, address) in enumerate(addresses):
+            by_crypto.setdefault(crypto, []).append((index, address))
+
+        def fetch(crypto):
+            requested = [address for _, address in by_crypto[crypto]]
+            try:
+                return BlockchainClient.address_balances(crypto, requested)
+            except APIException as e:
+                return [balance_error(crypto, address, e) for address in requested]
+
+        result = [None] * len(addresses)
+        cryptos = list(by_crypto)
+        for crypto, balances in zip(cryptos, fan_out(fetch, cryptos)):
+            for (index, _), balance in zip(by_crypto[crypto], balances):
+                result[index] = balance
+        return result
+
+    @staticmethod
+    def transport_stats():
+        return BlockchainClient.transport.stats()
+
+    @staticmethod
+    def cache_stats():
+        return {
+            'transactions': BlockchainClient.transaction_cache.stats(),
+            'balances': BlockchainClient.balance_cache.stats(),
+            'transaction_pages': BlockchainClient.page_cache.stats(),
+            'not_found': BlockchainClient.not_found.stats(),
+            'refresher': BlockchainClient.refresher.stats(),
+            'transaction_index': BlockchainClient.transaction_index.stats(),
+        }
+
+    @staticmethod
+    def single_flight_stats():
+        return BlockchainClient.single_flight.stats()
+
+    @staticmethod
+    def breaker_stats():
+        return BlockchainClient.upstreams.breakers.stats()
+
+    @staticmethod
+    def retry_budget_stats():
+        return BlockchainClient.upstreams.budgets.stats()
+
+    @staticmethod
+    def rate_limit_stats():
+        return BlockchainClient.upstreams.limiter.stats()
+
+    @staticmethod
+    def timeout_stats():
+        return BlockchainClient.transport.timeouts.stats()
+
+    @staticmethod
+    def reset():
+        # Forgets everything learned about upstreams: caches, breaker states, retry budgets,
+        # rate limit buckets and latencies
+        BlockchainClient.clear_caches()
+        BlockchainClient.upstreams.reset()
+        BlockchainClient.transport.timeouts.clear()
+
+    @staticmethod
+    def clear_caches():
+        BlockchainClient.transaction_cache.clear()
+        BlockchainClient.balance_cache.clear()
+        BlockchainClient.page_cache.clear()
+        BlockchainClient.not_found.clear()
@@ -0,0 +1,30 @@
+from rest_framework.exceptions import APIException
+from rest_framework.status import HTTP_503_SERVICE_UNAVAILABLE, HTTP_504_GATEWAY_TIMEOUT
+
+
+class UpstreamUnavailable(APIException):
+    status_code = HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Upstream service is unavailable, try again later.'
+    default_code = 'upstream_unavailable'
+
+
+class UpstreamTimeout(APIException):
+    status_code = HTTP_504_GATEWAY_TIMEOUT
+    default_detail = 'Upstream service did not respond in time.'
+    default_code = 'upstream_timeout'
+
+
+class CircuitOpen(UpstreamUnavailable):
+    default_detail = 'Upstream service is failing, requests to it are paused. Try again later.'
+    default_code = 'upstream_circuit_open'
+
+
+class RateLimited(UpstreamUnavailable):
+    default_detail = 'Upstream request quota is used up, try again later.'
+    default_code = 'upstream_rate_limited'
+
+
+class Saturated(UpstreamUnavailable):
+    # No local request slot (connection) to the upstream freed up in time, says nothing about the upstream itself
+    default_detail = 'Too many concurrent requests to upstream service, try again later.'
+    default_code = 'upstream_saturated'
@@ -1,16 +1,31 @@
-import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextvars import copy_context
 from datetime import datetime
 
-import requests
-from rest_framework.exceptions import NotFound, APIException
-from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND
+from django.conf import settings
+from rest_framework.exceptions import NotFound, APIException, ParseError
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
 
+from api.metrics.registry import span
 from project.crypto_currencies import CryptoCurrency
-from .serializers import TransactionsSerializer, TransactionSerializer, AddressWithBalance
+from .exceptions import CircuitOpen, RateLimited, Saturated, UpstreamTimeout, UpstreamUnavailable
+from .serializers import AddressWithBalance
+from .streaming import iter_items
+from .transformers import serialize_transaction, serialize_transactions
+from .transport import host_of
 
-BLOCKCHAIN_INFO_BASE = 'https://api.blockchain.info'
-HASKOIN_BASE = 'https://api.blockchain.info/haskoin-store'
-V2_BASE = 'https://api.blockchain.info/v2'
+BLOCKCHAIN_INFO_BASE = settings.BLOCKCHAIN_INFO_URL.rstrip('/')
+HASKOIN_BASE = f'{BLOCKCHAIN_INFO_BASE}/haskoin-store'
+V2_BASE = f'{BLOCKCHAIN_INFO_BASE}/v2'
+
+
+# Hedged requests are started from here, so the caller can wait for whichever answers first
+hedge_executor = ThreadPoolExecutor(max_workers=settings.BLOCKCHAIN_CLIENT_HEDGE_WORKERS, thread_name_prefix='hedge')
+
+
+# Calls that failed before reaching the upstream, retrying them right away would fail the same way
+LOCAL_FAILURES = (CircuitOpen, RateLimited, Saturated)
 
 
 def page_to_offset(page, size):
@@ -18,79 +33,294 @@ def page_to_offset(page, size):
 
 
 class CryptoHandler:
+    crypto = None
+    # All handlers call blockchain.info for now, circuit breakers are per (upstream host, crypto)
+    host = host_of(BLOCKCHAIN_INFO_BASE)
+
+    def __init__(self, transport, upstreams=None):
+        self.transport = transport
+        self.upstreams = upstreams
+        self.breaker = None if upstreams is None else upstreams.breakers.get(self.host, self.crypto)
+        self.retry_budget = None if upstreams is None else upstreams.budgets.get(self.host, self.crypto)
+
     def transform_address_balance(self, data):
         raise NotImplementedError('Not implemented')
 
+    def transform_address_balances(self, addresses, data):
+        raise NotImplementedError('Not implemented')
+
     def transform_transaction(self, tx):
         raise NotImplementedError('Not implemented')
 
     def transform_transactions(self, data):
         raise NotImplementedError('Not implemented')
 
+    def is_confirmed(self, tx):
+        raise NotImplementedError('Not implemented')
+
     def query_transaction(self, tx):
         raise NotImplementedError('Not implemented')
 
     def query_address_balance(self, address):
         raise NotImplementedError('Not implemented')
 
-    def query_transactions_by_address(self, address, page, size):
+    def query_address_balances(self, addresses):
         raise NotImplementedError('Not implemented')
 
+    def transactions_request(self, address, page, size):
+        # (url, params) of a page of transactions of an address
+        raise NotImplementedError('Not implemented')
+
+    def query_transactions_by_address(self, address, page, size, stream=False):
+        url, params = self.transactions_request(address, page, size)
+        if stream:
+            return self.transport.get(url, params=params, stream=True)
+        return self.transport.get(url, params=params)
+
+    def iter_transaction_list(self, chunks):
+        # Same as transaction_list, decoding upstream transactions one at a time from the chunks of the body
+        return iter_items(chunks)
+
+    def transaction_list(self, data):
+        # Upstream transactions of a query_transactions_by_address response
+        raise NotImplementedError('Not implemented')
+
+    def transaction_hash(self, tx):
+        raise NotImplementedError('Not implemented')
+
+    @staticmethod
+    def failed(response):
+        # Responses that count against the upstream's circuit breaker, 404s and 400s are answers
+        return response.status_code >= 500 or response.status_code == 429
+
+    def attempt(self, query):
+        # A single upstream request through the circuit breaker and the rate limiter, failing fast while the breaker
+        # is open (before taking a rate limit token). Retries and hedges are attempts as well, so they pay from the
+        # same budgets. A request that never left the worker (Saturated) is not an outcome of the upstream.
+        self.breaker.acquire()
+        try:
+            self.upstreams.limiter.acquire(self.host)
+        except BaseException:
+            self.breaker.release()
+            raise
+        started = time.monotonic()
+        try:
+            response = query()
+        except Saturated:
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.breaker.record(True, time.monotonic() - started)
+            raise
+        self.breaker.record(self.failed(response), time.monotonic() - started)
+        return response
+
+    def next_retry(self, policy, retry, deadline, response=None, error=None):
+        # Seconds to wait before retrying, None when the outcome stands. Every retry is paid from the retry budget.
+        if isinstance(error, LOCAL_FAILURES) or not policy.retryable(response, error) or retry > policy.retries:
+            return None
+        delay = policy.delay(retry)
+        if time.monotonic() + delay >= deadline or not self.retry_budget.withdraw():
+            return None
+        return delay
+
+    def hedge_delay(self):
+        # Seconds after which a request is hedged, None until enough latencies are known
+        latencies = self.transport.timeouts.latencies(self.host)
+        return latencies.percentile(settings.BLOCKCHAIN_CLIENT_HEDGE_PERCENTILE, min_samples=20)
+
+    def call(self, query, hedge=False):
+        # Runs an upstream query with the retry policy of the crypto. With hedge, a second request is sent
+        # once the first one is slower than usual (see hedge_delay), the first good response wins.
+        if self.upstreams is None:
+            return query()
+        policy = self.upstreams.policy(self.crypto)
+        deadline = time.monotonic() + policy.deadline
+        self.retry_budget.deposit()
+        retry = 0
+        while True:
+            response = error = None
+            try:
+                response = self.hedged(query) if hedge else self.attempt(query)
+            except (UpstreamTimeout, UpstreamUnavailable) as e:
+                error = e
+            retry += 1
+            delay = self.next_retry(policy, retry, deadline, response, error)
+            if delay is None:
+                break
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    def hedged(self, query):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.attempt(query)
+        first = hedge_executor.submit(copy_context().run, self.attempt, query)
+        if wait([first], timeout=delay).done or not self.retry_budget.withdraw():
+            return first.result()
+        second = hedge_executor.submit(copy_context().run, self.attempt, query)
+        for future in as_completed([first, second]):
+            if future.exception() is None and not self.failed(future.result()):
+                break
+        # The slower request is left to finish in the background
+        return future.result()
+
+    @staticmethod
+    def decode(response):
+        with span('json_decode'):
+            return response.json()
+
+    # The parse_* methods turn upstream responses into results, independent of how the response was fetched
+    # (they are shared with the async path, where query_* return awaitables)
+
     def transactions_by_address(self, address, page, size):
-        response = self.query_transactions_by_address(address, page, size)
+        return self.parse_transactions_by_address(
+            address, self.call(lambda: self.query_transactions_by_address(address, page, size)))
+
+    def check_transactions_response(self, address, response):
         if response.status_code == HTTP_404_NOT_FOUND:
-            # TODO: This doesn't work too well with ETH, since that API returns empty list with 404
             raise NotFound(f'Address \'{address}\' does not exist.')
         elif response.status_code != HTTP_200_OK:
             # TODO: ideally, would have more granular checks here.
             #       Most likely in a method so that specific handlers could override the logic.
             raise APIException(f'Failed to retrieve data for address \'{address}\'')
-        transformed = self.transform_transactions(response.json())
-        serializer = TransactionsSerializer(data={'transactions': transformed})
-        serializer.is_valid(raise_exception=True)
-        return serializer.data
+
+    def transactions_data(self, address, response):
+        self.check_transactions_response(address, response)
+        return self.decode(response)
+
+    def parse_transactions_by_address(self, address, response):
+        data = self.transactions_data(address, response)
+        with span('transform'):
+            transformed = self.transform_transactions(data)
+        with span('serialize'):
+            return serialize_transactions(transformed)
+
+    def stream_transactions_by_address(self, address, page, size, chunk_size):
+        # Serialized transactions of a page, transformed one at a time while the upstream body is read.
+        # Upstream errors are raised right away, transactions are produced as the result is iterated.
+        response = self.call(lambda: self.query_transactions_by_address(address, page, size, stream=True))
+        try:
+            self.check_transactions_response(address, response)
+        except APIException:
+            response.close()
+            raise
+        return self.iter_serialized(response, chunk_size)
+
+    def iter_serialized(self, response, chunk_size):
+        try:
+            for tx in self.iter_transaction_list(response.iter_content(chunk_size)):
+                yield serialize_transaction(self.transform_transaction(tx))
+        finally:
+            response.close()
+
+    def indexed_transactions_by_address(self, address, page, size):
+        return self.parse_indexed_transactions(
+            address, self.call(lambda: self.query_transactions_by_address(address, page, size)))
+
+    def parse_indexed_transactions(self, address, response):
+        # (hash, serialized transaction, confirmed) of every transaction of the page, for the transaction index
+        txs = self.transaction_list(self.transactions_data(address, response))
+        with span('transform'):
+            transformed = [self.transform_transaction(tx) for tx in txs]
+        with span('serialize'):
+            serialized = serialize_transactions(transformed)['transactions']
+        return [(self.transaction_hash(tx), data, self.is_confirmed(tx)) for tx, data in zip(txs, serialized)]
 
     def transaction(self, tx):
-        response = self.query_transaction(tx)
+        return self.fetch_transaction(tx)[0]
+
+    def fetch_transaction(self, tx):
+        hedge = settings.BLOCKCHAIN_CLIENT_HEDGE_TRANSACTIONS
+        return self.parse_transaction(tx, self.call(lambda: self.query_transaction(tx), hedge=hedge))
+
+    def parse_transaction(self, tx, response):
         if response.status_code == HTTP_404_NOT_FOUND:
             raise NotFound(f'Transaction \'{tx}\' does not exist.')
         elif response.status_code != HTTP_200_OK:
             # TODO: ideally, would have more granular checks here.
             #       Most likely in a method so that specific handlers could override the logic.
             raise APIException(f'Failed to retrieve data for transaction \'{tx}\'')
-        transformed = self.transform_transaction(response.json())
-        serializer = TransactionSerializer(data=transformed)
-        serializer.is_valid(raise_exception=True)
-        return serializer.data
+        data = self.decode(response)
+        with span('transform'):
+            transformed = self.transform_transaction(data)
+        with span('serialize'):
+            return serialize_transaction(transformed), self.is_confirmed(data)
 
     def address_balance(self, address):
-        response = self.query_address_balance(address)
+        return self.parse_address_balance(address, self.call(lambda: self.query_address_balance(address)))
+
+    def parse_address_balance(self, address, response):
         if response.status_code == HTTP_404_NOT_FOUND:
             raise NotFound(f'Address \'{address}\' does not exist.')
         elif response.status_code != HTTP_200_OK:
             # TODO: ideally, would have more granular checks here.
             #       Most likely in a method so that specific handlers could override the logic.
             raise APIException(f'Failed to retrieve balance for address \'{address}\'')
-        transformed = self.transform_address_balance(response.json())
-        serializer = AddressWithBalance(data=transformed)
-        serializer.is_valid(raise_exception=True)
-        return serializer.data
+        data = self.decode(response)
+        with span('transform'):
+            transformed = self.transform_address_balance(data)
+        with span('serialize'):
+            serializer = AddressWithBalance(data=transformed)
+            serializer.is_valid(raise_exception=True)
+            return serializer.data
+
+    def address_balances(self, addresses):
+        return self.parse_address_balances(addresses, self.call(lambda: self.query_address_balances(addresses)))
+
+    def parse_address_balances(self, addresses, response):
+        if response.status_code == HTTP_400_BAD_REQUEST:
+            # Upstream rejects the whole batch if a single address is malformed
+            raise ParseError(f'Failed to retrieve balances, batch of {len(addresses)} addresses was rejected')
+        elif response.status_code != HTTP_200_OK:
+            raise APIException(f'Failed to retrieve balances for {len(addresses)} addresses')
+        data = self.decode(response)
+        with span('transform'):
+            transformed = self.transform_address_balances(addresses, data)
+        if len(transformed) != len(addresses):
+            raise APIException(f'Failed to retrieve balances for {len(addresses)} addresses')
+        with span('serialize'):
+            serializer = AddressWithBalance(data=transformed, many=True)
+            serializer.is_valid(raise_exception=True)
+            return serializer.data
 
 
 class ETHHandler(CryptoHandler):
+    crypto = CryptoCurrency.ETH.value
+
     def query_transaction(self, tx):
-        return requests.get(f'{V2_BASE}/eth/data/transaction/{tx}')
+        return self.transport.get(f'{V2_BASE}/eth/data/transaction/{tx}')
 
     def query_address_balance(self, address):
-        return requests.get(f'{BLOCKCHAIN_INFO_BASE}/eth/account/{address}/balance')
+        return self.transport.get(f'{BLOCKCHAIN_INFO_BASE}/eth/account/{address}/balance')
+
+    def query_address_balances(self, addresses):
+        return self.transport.get(f'{BLOCKCHAIN_INFO_BASE}/eth/account/{",".join(addresses)}/balance')
+
+    def transactions_request(self, address, page, size):
+        return f'{V2_BASE}/eth/data/account/{address}/transactions', {'page': page, 'size': size}
+
+    # The API answers 404 with an empty list when it has no transactions to list, which is an empty page
+    # rather than a missing address
+
+    def check_transactions_response(self, address, response):
+        if response.status_code != HTTP_404_NOT_FOUND:
+            super().check_transactions_response(address, response)
+
+    def transactions_data(self, address, response):
+        if response.status_code == HTTP_404_NOT_FOUND:
+            return {'transactions': []}
+        return super().transactions_data(address, response)
 
-    def query_transactions_by_address(self, address, page, size):
-        return requests.get(f'{V2_BASE}/eth/data/account/{address}/transactions',
-                            params={'page': page, 'size': size})
+    def iter_serialized(self, response, chunk_size):
+        if response.status_code == HTTP_404_NOT_FOUND:
+            response.close()
+            return iter([])
+        return super().iter_serialized(response, chunk_size)
 
     def transform_address_balance(self, data):
-        logging.info(data)
-        logging.info(data.items())
         address = list(data.keys())[0]
         return {
             'address': address,
@@ -98,6 +328,12 @@ class ETHHandler(CryptoHandler):
             'crypto': CryptoCurrency.ETH.value
         }
 
+    def transform_address_balances(self, addresses, data):
+        # Keys are not guaranteed to keep the requested checksum casing
+        by_address = {key.lower(): value for key, value in data.items()}
+        return [self.transform_address_balance({address: by_address[address.lower()]})
+                for address in addresses if address.lower() in by_address]
+
     def transform_transaction(self, tx):
         return {
             'inputs': [{'address': tx['from'], 'value': tx['value']}],
@@ -105,6 +341,18 @@ class ETHHandler(CryptoHandler):
             'timestamp': datetime.fromtimestamp(int(tx['timestamp']))
         }
 
+    def is_confirmed(self, tx):
+        return tx.get('state') == 'CONFIRMED'
+
+    def transaction_list(self, data):
+        return data['transactions']
+
+    def iter_transaction_list(self, chunks):
+        return iter_items(chunks, key='transactions')
+
+    def transaction_hash(self, tx):
+        return tx['hash']
+
     def transform_transactions(self, data):
         transformed = []
         for tx in data['transactions']:
@@ -115,18 +363,20 @@ class ETHHandler(CryptoHandler):
 class BCHHandler(CryptoHandler):
     # TODO: BTC & BCH handlers could be cleaned up since they use the same API.
     #       APIs should be implemented separately. And then for crypto you should select the API.
+    crypto = CryptoCurrency.BCH.value
 
     def query_address_balance(self, address):
-        return requests.get(f'{HASKOIN_BASE}/bch/address/{address}/balance')
+        return self.transport.get(f'{HASKOIN_BASE}/bch/address/{address}/balance')
+
+    def query_address_balances(self, addresses):
+        return self.transport.get(f'{HASKOIN_BASE}/bch/address/balances', params={'addresses': ','.join(addresses)})
 
     def query_transaction(self, tx):
-        return requests.get(f'{HASKOIN_BASE}/bch/transaction/{tx}')
+        return self.transport.get(f'{HASKOIN_BASE}/bch/transaction/{tx}')
 
-    def query_transactions_by_address(self, address, page, size):
+    def transactions_request(self, address, page, size):
         offset = page_to_offset(page, size)
-        return requests.get(
-            f'{HASKOIN_BASE}/bch/address/{address}/transactions/full',
-            params={'limit': size, 'offset': offset})
+        return f'{HASKOIN_BASE}/bch/address/{address}/transactions/full', {'limit': size, 'offset': offset}
 
     def transform_address_balance(self, data):
         return {
@@ -135,6 +385,10 @@ class BCHHandler(CryptoHandler):
             'balance': data['confirmed']
         }
 
+    def transform_address_balances(self, addresses, data):
+        # Haskoin answers in the order addresses were requested
+        return [self.transform_address_balance(balance) for balance in data]
+
     def transform_transaction(self, tx):
         return {
             'inputs': tx['inputs'],
@@ -142,22 +396,35 @@ class BCHHandler(CryptoHandler):
             'timestamp': datetime.fromtimestamp(tx['time'])
         }
 
+    def is_confirmed(self, tx):
+        # Haskoin marks mempool transactions with {'mempool': <time>} instead of a block height
+        return 'height' in (tx.get('block') or {})
+
+    def transaction_list(self, data):
+        return data
+
+    def transaction_hash(self, tx):
+        return tx['txid']
+
     def transform_transactions(self, data):
         return [self.transform_transaction(tx) for tx in data]
 
 
 class BTCHandler(CryptoHandler):
+    crypto = CryptoCurrency.BTC.value
+
     def query_address_balance(self, address):
-        return requests.get(f'{HASKOIN_BASE}/btc/address/{address}/balance')
+        return self.transport.get(f'{HASKOIN_BASE}/btc/address/{address}/balance')
+
+    def query_address_balances(self, addresses):
+        return self.transport.get(f'{HASKOIN_BASE}/btc/address/balances', params={'addresses': ','.join(addresses)})
 
     def query_transaction(self, tx):
-        return requests.get(f'{HASKOIN_BASE}/btc/transaction/{tx}')
+        return self.transport.get(f'{HASKOIN_BASE}/btc/transaction/{tx}')
 
-    def query_transactions_by_address(self, address, page, size):
+    def transactions_request(self, address, page, size):
         offset = page_to_offset(page, size)
-        return requests.get(
-            f'{HASKOIN_BASE}/btc/address/{address}/transactions/full',
-            params={'limit': size, 'offset': offset})
+        return f'{HASKOIN_BASE}/btc/address/{address}/transactions/full', {'limit': size, 'offset': offset}
 
     def transform_address_balance(self, data):
         return {
@@ -166,6 +433,10 @@ class BTCHandler(CryptoHandler):
             'balance': data['confirmed']
         }
 
+    def transform_address_balances(self, addresses, data):
+        # Haskoin answers in the order addresses were requested
+        return [self.transform_address_balance(balance) for balance in data]
+
     def transform_transaction(self, tx):
         return {
             'inputs': tx['inputs'],
@@ -173,5 +444,15 @@ class BTCHandler(CryptoHandler):
             'timestamp': datetime.fromtimestamp(tx['time'])
         }
 
+    def is_confirmed(self, tx):
+        # Haskoin marks mempool transactions with {'mempool': <time>} instead of a block height
+        return 'height' in (tx.get('block') or {})
+
+    def transaction_list(self, data):
+        return data
+
+    def transaction_hash(self, tx):
+        return tx['txid']
+
     def transform_transactions(self, data):
         return [self.transform_transaction(tx) for tx in data]
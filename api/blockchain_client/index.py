@@ -0,0 +1,189 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from api.crypto.models import AddressTransaction, IndexedAddress, IndexedTransaction
+from .cache import Counters
+
+
+class TransactionIndex:
+    # Local, persistent copy of address histories (see IndexedAddress), filled as a side effect of lookups.
+    # A page is served from the index once it holds that far into the history. Before that, only the newest
+    # transactions since the last sync (at most every sync_ttl seconds) and the missing older ones are fetched,
+    # in upstream pages of chunk transactions.
+    # Unconfirmed transactions are always the newest of a history, they are dropped and fetched again on every sync.
+
+    # Addresses looked up per query by newest_of and newer_of (two parameters each, within SQLite's 999)
+    batch_size = 400
+
+    def __init__(self, chunk=100, sync_ttl=30, max_sync_pages=5):
+        self.chunk = chunk
+        self.sync_ttl = sync_ttl
+        # Upstream pages a sync looks through for the newest indexed transaction before starting over
+        self.max_sync_pages = max_sync_pages
+        self.counters = Counters('pages', 'local_pages', 'upstream_pages', 'resets')
+
+    def transactions_for_address(self, handler, address, page, size):
+        self.counters.increment('pages')
+        indexed, _ = IndexedAddress.objects.get_or_create(crypto=handler.crypto, address=address)
+        end = (page + 1) * size
+        fetched = False
+        if indexed.synced is None or indexed.synced <= timezone.now() - timedelta(seconds=self.sync_ttl):
+            fetched = self.sync(handler, indexed)
+        fetched = self.extend(handler, indexed, end) or fetched
+        if not fetched:
+            self.counters.increment('local_pages')
+        rows = indexed.transactions.order_by('position').select_related('transaction')[page * size:end]
+        return {'transactions': [row.transaction.data for row in rows]}
+
+    def sync_address(self, handler, address):
+        # Brings the newest transactions of an address into the index, stopping at the newest one it already has
+        # (a first chunk for addresses it has none of). Returns the newest transaction's hash, the high-water mark.
+        indexed, _ = IndexedAddress.objects.get_or_create(crypto=handler.crypto, address=address)
+        self.sync(handler, indexed)
+        self.extend(handler, indexed, self.chunk)
+        return self.newest(handler.crypto, address)
+
+    def newest(self, crypto, address):
+        return AddressTransaction.objects.filter(
+            indexed_address__crypto=crypto, indexed_address__address=address
+        ).order_by('position').values_list('transaction__hash', flat=True).first()
+
+    def newest_of(self, addresses):
+        # {(crypto, address): newest()} of many addresses, one query per batch_size of them
+        newest = AddressTransaction.objects.filter(
+            indexed_address=OuterRef('pk')
+        ).order_by('position').values('transaction__hash')[:1]
+        result = {}
+        for start in range(0, len(addresses), self.batch_size):
+            batch = set(addresses[start:start + self.batch_size])
+            rows = IndexedAddress.objects.filter(
+                address__in={address for _, address in batch}
+            ).annotate(newest=Subquery(newest)).values_list('crypto', 'address', 'newest')
+            result.update(((crypto, address), hash) for crypto, address, hash in rows
+                          if (crypto, address) in batch and hash is not None)
+        return result
+
+    def newer_of(self, addresses, limit):
+        # {(crypto, address): [(hash, transaction), ...]} of up to `limit` indexed transactions newer than `since`
+        # for many (crypto, address, since), newest first. When `since` is no longer indexed (the history was indexed
+        # again) all of them are newer. Positions of a history are contiguous, so these are a range of positions
+        # from the newest one: three queries per batch_size addresses.
+        result = {}
+        for start in range(0, len(addresses), self.batch_size):
+            since = {(crypto, address): hash for crypto, address, hash in addresses[start:start + self.batch_size]}
+            indexed, first = {}, {}
+            for pk, crypto, address, position in IndexedAddress.objects.filter(
+                address__in={address for _, address in since}
+            ).annotate(first=Min('transactions__position')).values_list('pk', 'crypto', 'address', 'first'):
+                if (crypto, address) in since and position is not None:
+                    indexed[pk] = (crypto, address)
+                    first[pk] = position
+            if not indexed:
+                continue
+            seen = {pk: position for pk, hash, position in AddressTransaction.objects.filter(
+                indexed_address__in=list(indexed), transaction__hash__in=set(since.values())
+            ).values_list('indexed_address', 'transaction__hash', 'position') if since[indexed[pk]] == hash}
+            ranges = Q()
+            for pk, position in first.items():
+                ranges |= Q(indexed_address=pk, position__lt=min(seen.get(pk, position + limit), position + limit))
+            for pk, hash, data in AddressTransaction.objects.filter(ranges).order_by(
+                'indexed_address', 'position'
+            ).values_list('indexed_address', 'transaction__hash', 'transaction__data'):
+                result.setdefault(indexed[pk], []).append((hash, data))
+        return result
+
+    def fetch(self, handler, address, page):
+        self.counters.increment('upstream_pages')
+        return handler.indexed_transactions_by_address(address, page, self.chunk)
+
+    def sync(self, handler, indexed):
+        # Puts the transactions newer than the newest indexed one on top of the history, True if upstream was asked
+        indexed.transactions.filter(transaction__confirmed=False).delete()
+        newest = indexed.transactions.order_by('position').select_related('transaction').first()
+        if newest is None:
+            # Nothing indexed yet (or only unconfirmed transactions), extend starts from the top
+            self.mark(indexed, synced=timezone.now(), complete=False)
+            return False
+
+        newer = []
+        for page in range(self.max_sync_pages):
+            items = self.fetch(handler, indexed.address, page)
+            for item in items:
+                if item[0] == newest.transaction.hash:
+                    self.store(indexed, newer, newest.position - len(newer))
+                    self.mark(indexed, synced=timezone.now())
+                    return True
+                newer.append(item)
+            if len(items) < self.chunk:
+                break
+        # Too many new transactions (or the history changed), the history is indexed again as it is requested
+        self.reset(indexed)
+        return True
+
+    def extend(self, handler, indexed, end):
+        # Fetches older transactions until the index holds `end` transactions or the whole history
+        count = indexed.transactions.count()
+        fetched = False
+        while count < end and not indexed.complete:
+            items = self.fetch(handler, indexed.address, count // self.chunk)
+            fetched = True
+            # Pages are aligned to chunks, the part that is already indexed is skipped
+            known = set(indexed.transactions.filter(
+                transaction__hash__in=[hash for hash, _, _ in items]
+            ).values_list('transaction__hash', flat=True))
+            older = [item for item in items if item[0] not in known]
+            last = indexed.transactions.aggregate(last=Max('position'))['last']
+            self.store(indexed, older, 0 if last is None else last + 1)
+            count += len(older)
+            if len(items) < self.chunk:
+                self.mark(indexed, complete=True)
+            elif not older:
+                break
+        return fetched
+
+    def store(self, indexed, items, first):
+        # Items (newest first) get positions from `first` on
+        if not items:
+            return
+        crypto = indexed.crypto
+        with transaction.atomic():
+            for hash, data, confirmed in items:
+                IndexedTransaction.objects.update_or_create(
+                    crypto=crypto, hash=hash, defaults={'data': data, 'confirmed': confirmed})
+            ids = dict(IndexedTransaction.objects.filter(
+                crypto=crypto, hash__in=[hash for hash, _, _ in items]
+            ).values_list('hash', 'id'))
+            AddressTransaction.objects.bulk_create([
+                AddressTransaction(indexed_address=indexed, transaction_id=ids[hash], position=first + i)
+                for i, (hash, _, _) in enumerate(items)
+            ])
+
+    def mark(self, indexed, **fields):
+        for name, value in fields.items():
+            setattr(indexed, name, value)
+        IndexedAddress.objects.filter(pk=indexed.pk).update(**fields)
+
+    def reset(self, indexed):
+        self.counters.increment('resets')
+        indexed.transactions.all().delete()
+        self.mark(indexed, synced=timezone.now(), complete=False)
+
+    def transaction(self, crypto, tx):
+        # Confirmed transactions never change, so they are served from the index
+        return IndexedTransaction.objects.filter(crypto=crypto, hash=tx, confirmed=True).values_list(
+            'data', flat=True).first()
+
+    def add_transaction(self, crypto, tx, data, confirmed):
+        if confirmed:
+            try:
+                IndexedTransaction.objects.update_or_create(
+                    crypto=crypto, hash=tx, defaults={'data': data, 'confirmed': confirmed})
+            except IntegrityError:
+                # Stored by someone else in the meantime
+                pass
+
+    def stats(self):
+        return self.counters.as_dict()
@@ -0,0 +1,169 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .cache import Counters
+from .exceptions import RateLimited
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# Priority of the upstream calls made in the current context, copied into fan out and hedge threads
+priority = ContextVar('upstream_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    # Upstream calls made inside are background work (e.g. balance refreshes) and yield to interactive ones
+    token = priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+def in_background(fn):
+    def run():
+        with background():
+            return fn()
+    return run
+
+
+class LocalBuckets:
+    # Token bucket states of this process only
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @contextmanager
+    def state(self, host, initial):
+        with self._lock:
+            state = self._states.setdefault(host, list(initial))
+            yield state
+
+    def clear(self):
+        with self._lock:
+            self._states = {}
+
+
+class FileBuckets:
+    # Token bucket states in one file per upstream host, every update holds a lock on the file,
+    # so all workers (and the refresh_balances command) on the machine share the same budget
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+
+    def path(self, host):
+        return os.path.join(self.state_dir, f'{hashlib.sha1(host.encode()).hexdigest()}.bucket')
+
+    @contextmanager
+    def state(self, host, initial):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.path(host), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read().split()
+                state = [float(value) for value in content] if len(content) == 2 else list(initial)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(f'{state[0]} {state[1]}')
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def clear(self):
+        if os.path.isdir(self.state_dir):
+            for name in os.listdir(self.state_dir):
+                if name.endswith('.bucket'):
+                    os.remove(os.path.join(self.state_dir, name))
+
+
+class RateLimiter:
+    # Token bucket per upstream host: `rate` requests per second with bursts of up to `burst` requests.
+    # A call without a token queues until one is due, unless that is later than the wait of its priority,
+    # then it fails with RateLimited. Background calls leave `reserve` tokens (a share of the burst, at most all
+    # but one token) to interactive ones, so refreshes never take the requests a user is waiting for.
+    # Buckets are per process, or shared by all processes through files in state_dir.
+
+    def __init__(self, rate=None, burst=None, reserve=0.5, wait=None, state_dir=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate or 0)
+        # A bucket never holds more than burst tokens, background calls need one on top of the reserve
+        self.reserve = min(reserve * self.burst, self.burst - 1)
+        self.wait = dict({INTERACTIVE: 2, BACKGROUND: 30}, **(wait or {}))
+        self.buckets = LocalBuckets() if state_dir is None else FileBuckets(state_dir)
+        self.counters = Counters('acquired', 'queued', 'rejected')
+
+    @property
+    def enabled(self):
+        return bool(self.rate)
+
+    def _take(self, host, kind):
+        # Takes a token if there is one to spare for the priority, otherwise returns seconds until there is
+        # (wall clock time, so it means the same in every process)
+        floor = self.reserve if kind == BACKGROUND else 0
+        now = time.time()
+        with self.buckets.state(host, (self.burst, now)) as state:
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[:] = [tokens, now]
+            if tokens - floor >= 1:
+                state[0] = tokens - 1
+                return 0
+            return (floor + 1 - tokens) / self.rate
+
+    def _deadline(self, kind):
+        return time.monotonic() + self.wait[kind]
+
+    def _queue(self, delay, deadline, queued):
+        if time.monotonic() + delay > deadline:
+            self.counters.increment('rejected')
+            raise RateLimited()
+        if not queued:
+            self.counters.increment('queued')
+
+    def acquire(self, host):
+        if not self.enabled:
+            return
+        kind = priority.get()
+        deadline = self._deadline(kind)
+        queued = False
+        while True:
+            delay = self._take(host, kind)
+            if not delay:
+                self.counters.increment('acquired')
+                return
+            self._queue(delay, deadline, queued)
+            queued = True
+            time.sleep(delay)
+
+    async def acquire_async(self, host):
+        # Same as acquire, waiting on the event loop
+        if not self.enabled:
+            return
+        kind = priority.get()
+        deadline = self._deadline(kind)
+        queued = False
+        while True:
+            delay = self._take(host, kind)
+            if not delay:
+                self.counters.increment('acquired')
+                return
+            self._queue(delay, deadline, queued)
+            queued = True
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return self.counters.as_dict()
+
+    def reset(self):
+        self.buckets.clear()
+        self.counters = Counters('acquired', 'queued', 'rejected')
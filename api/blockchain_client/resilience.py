@@ -0,0 +1,277 @@
+import random
+import threading
+import time
+from collections import deque
+
+from .cache import Counters
+from .exceptions import CircuitOpen, UpstreamTimeout
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class LatencyWindow:
+    # The last `size` latencies (in seconds) of an upstream, thread-safe
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._values = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, p, min_samples=1):
+        # None until there are min_samples latencies
+        with self._lock:
+            if len(self._values) < max(1, min_samples):
+                return None
+            ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class CircuitBreaker:
+    # Closed: calls go through, outcomes of the last `window` calls are kept. Once there are at least min_calls
+    # of them and the share of failures reaches failure_rate (or of calls slower than slow_call seconds reaches
+    # slow_rate) the breaker opens and calls fail fast with CircuitOpen for open_seconds.
+    # Half open: up to half_open_probes calls go through, the first outcome closes or reopens the breaker.
+
+    def __init__(self, window=20, min_calls=10, failure_rate=0.5, slow_call=5, slow_rate=0.8, open_seconds=30,
+                 half_open_probes=1):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.counters = Counters('opened', 'rejected')
+        self._lock = threading.Lock()
+        self._reset(CLOSED)
+
+    def _reset(self, state):
+        self._state = state
+        self._outcomes = deque(maxlen=self.window)
+        self._opened_at = time.monotonic() if state == OPEN else None
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._reset(HALF_OPEN)
+            return self._state
+
+    def acquire(self):
+        # Called before a call, raises CircuitOpen instead of letting it through
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+        self.counters.increment('rejected')
+        raise CircuitOpen()
+
+    def release(self):
+        # Called instead of record when a call acquire let through was not made after all
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record(self, failed, seconds):
+        # Called after every call that acquire let through
+        slow = seconds >= self.slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self._reset(CLOSED)
+                return
+            if self._state != CLOSED:
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            if failures >= self.failure_rate * len(self._outcomes) or slow_calls >= self.slow_rate * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self._reset(OPEN)
+        self.counters.increment('opened')
+
+    def stats(self):
+        return dict(self.counters.as_dict(), state=self.state)
+
+    def reset(self):
+        with self._lock:
+            self._reset(CLOSED)
+            self.counters = Counters('opened', 'rejected')
+
+
+class RetryPolicy:
+    # Which failures are retried and how long to wait before each retry. retry_on holds status classes:
+    # '5xx', '429', 'timeout' (no answer in time) and 'connection' (upstream unreachable).
+    # Waits are exponential with full jitter, no retry starts later than deadline seconds after the first attempt.
+
+    def __init__(self, retries=2, backoff=0.1, max_backoff=2, deadline=8, retry_on=('5xx', '429', 'timeout', 'connection')):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.retry_on = frozenset(retry_on)
+
+    def retryable(self, response=None, error=None):
+        if error is not None:
+            return ('timeout' if isinstance(error, UpstreamTimeout) else 'connection') in self.retry_on
+        if response.status_code == 429:
+            return '429' in self.retry_on
+        return response.status_code >= 500 and '5xx' in self.retry_on
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (retry - 1)))
+
+
+class RetryBudget:
+    # Caps retries and hedges of an upstream at `ratio` extra requests per call, plus min_per_second,
+    # so they do not multiply the load on an upstream that is already failing
+
+    def __init__(self, ratio=0.1, min_per_second=1, capacity=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.counters = Counters('calls', 'withdrawn', 'exhausted')
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        self.counters.increment('calls')
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                withdrawn = True
+            else:
+                withdrawn = False
+        self.counters.increment('withdrawn' if withdrawn else 'exhausted')
+        return withdrawn
+
+    def stats(self):
+        return self.counters.as_dict()
+
+    def reset(self):
+        with self._lock:
+            self._tokens = self.capacity
+            self._updated = time.monotonic()
+            self.counters = Counters('calls', 'withdrawn', 'exhausted')
+
+
+class PerUpstream:
+    # One object per (upstream host, crypto), created on first use
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._objects = {}
+
+    def get(self, host, crypto):
+        with self._lock:
+            if (host, crypto) not in self._objects:
+                self._objects[(host, crypto)] = self.factory()
+            return self._objects[(host, crypto)]
+
+    def stats(self):
+        with self._lock:
+            objects = dict(self._objects)
+        return {key: value.stats() for key, value in objects.items()}
+
+    def reset(self):
+        # Handlers keep their objects, so they are reset in place
+        with self._lock:
+            objects = list(self._objects.values())
+        for value in objects:
+            value.reset()
+
+
+class Upstreams:
+    # Resilience state of the upstreams of a worker, shared by the sync and async handlers:
+    # circuit breakers and retry budgets per (upstream host, crypto), retry policies per crypto
+    # (read from settings on every call, so they can be changed in tests) and the rate limiter of all hosts
+
+    def __init__(self, breaker, budget, policies, limiter):
+        self.breakers = PerUpstream(lambda: CircuitBreaker(**breaker))
+        self.budgets = PerUpstream(lambda: RetryBudget(**budget))
+        self.policies = policies
+        self.limiter = limiter
+
+    def policy(self, crypto):
+        options = self.policies()
+        return RetryPolicy(**dict(options.get('default', {}), **options.get(crypto, {})))
+
+    def reset(self):
+        self.breakers.reset()
+        self.budgets.reset()
+        self.limiter.reset()
+
+
+class AdaptiveTimeout:
+    # Read timeouts per upstream host that follow its observed latency: factor times the latency percentile,
+    # between min_read and max_read seconds. Timeouts are recorded as latencies of their full length, so a
+    # timeout that turned out too short grows again instead of failing everything.
+
+    def __init__(self, max_read, min_read=1, percentile=99, factor=3, min_samples=50, enabled=True):
+        self.max_read = max_read
+        self.min_read = min(min_read, max_read)
+        self.percentile = percentile
+        self.factor = factor
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._latencies = {}
+
+    def latencies(self, host):
+        with self._lock:
+            if host not in self._latencies:
+                self._latencies[host] = LatencyWindow()
+            return self._latencies[host]
+
+    def read(self, host):
+        if not self.enabled:
+            return self.max_read
+        latency = self.latencies(host).percentile(self.percentile, self.min_samples)
+        if latency is None:
+            return self.max_read
+        return min(self.max_read, max(self.min_read, latency * self.factor))
+
+    def record(self, host, seconds):
+        self.latencies(host).add(seconds)
+
+    def stats(self):
+        with self._lock:
+            hosts = list(self._latencies)
+        return {host: self.read(host) for host in hosts}
+
+    def clear(self):
+        with self._lock:
+            self._latencies = {}
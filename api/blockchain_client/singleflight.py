@@ -0,0 +1,105 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+import weakref
+
+from django.core.cache import caches
+
+from .cache import Counters
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Collapses concurrent identical calls into one: the first caller of a key runs it, everyone arriving while
+    # it runs waits and gets the same result (or error).
+    # With a lock directory and a shared cache the same happens across workers: a worker fetching a key holds
+    # a file lock, workers waiting on it pick the result up from the shared cache for shared_ttl seconds.
+
+    # Lock files are striped, so their number stays bounded no matter how many keys there are
+    lock_stripes = 256
+
+    def __init__(self, lock_dir=None, shared_alias=None, shared_ttl=2):
+        self.lock_dir = lock_dir
+        self.shared_alias = shared_alias
+        self.shared_ttl = shared_ttl
+        self.counters = Counters('calls', 'executed', 'coalesced', 'shared_coalesced')
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Calls of the async path per event loop, their tasks belong to the loop
+        self._async_calls = weakref.WeakKeyDictionary()
+
+    def do(self, key, fn):
+        self.counters.increment('calls')
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+
+        if not leader:
+            self.counters.increment('coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._execute(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        # Same as do for coroutine functions, callers wait on the event loop instead of blocking a thread. Calls are
+        # collapsed within the loop only, a cancelled caller does not cancel the call of the others.
+        self.counters.increment('calls')
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            self.counters.increment('executed')
+            task = calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        else:
+            self.counters.increment('coalesced')
+        return await asyncio.shield(task)
+
+    def _execute(self, key, fn):
+        if self.lock_dir is None or self.shared_alias is None:
+            self.counters.increment('executed')
+            return fn()
+
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        shared = caches[self.shared_alias]
+        shared_key = f'blockchain-client:single-flight:{digest}'
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with open(os.path.join(self.lock_dir, f'{int(digest, 16) % self.lock_stripes}.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                result = shared.get(shared_key)
+                if result is not None:
+                    self.counters.increment('shared_coalesced')
+                    return result
+                self.counters.increment('executed')
+                result = fn()
+                shared.set(shared_key, result, timeout=self.shared_ttl)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def stats(self):
+        return self.counters.as_dict()
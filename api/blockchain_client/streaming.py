@@ -0,0 +1,118 @@
+import codecs
+import hashlib
+import json
+
+from rest_framework.exceptions import APIException
+from rest_framework.utils import encoders
+
+# Incremental reading of upstream JSON: the items of a (possibly nested) array are decoded one at a time from the
+# body's chunks, so only the item being decoded and the unread part of its chunk are held in memory.
+
+WHITESPACE = ' \t\r\n'
+_decoder = json.JSONDecoder()
+
+
+class Reader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+
+    def fill(self):
+        # Appends the next chunk to the unread part of the buffer, False at the end of the body
+        chunk = next(self.chunks, None)
+        text = self.utf8.decode(b'' if chunk is None else chunk, final=chunk is None)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return chunk is not None
+
+    def peek(self):
+        # Next non-whitespace character, None at the end of the body
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise APIException('Failed to parse upstream response')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        more = True
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not more:
+                    raise APIException('Failed to parse upstream response')
+                end = None
+            # A value running up to the end of the buffer (e.g. a number) may go on in the next chunk
+            if end is not None and (end < len(self.buffer) or not more):
+                self.pos = end
+                return value
+            # Decoding starts over, so the buffer at least doubles for every retry of a large value
+            wanted = max(1, 2 * (len(self.buffer) - self.pos))
+            while more and len(self.buffer) - self.pos < wanted:
+                more = self.fill()
+
+
+def iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() != ',':
+            reader.expect(']')
+            return
+        reader.pos += 1
+
+
+def iter_items(chunks, key=None):
+    # Items of the top level array of a JSON body, or of the array under `key` of its top level object
+    # (other values of the object are decoded and dropped, everything after the array is not read)
+    reader = Reader(chunks)
+    if key is None:
+        yield from iter_array(reader)
+        return
+    reader.expect('{')
+    while reader.peek() == '"':
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            yield from iter_array(reader)
+            return
+        reader.value()
+        if reader.peek() == ',':
+            reader.pos += 1
+    raise APIException('Failed to parse upstream response')
+
+
+def dumps(data):
+    # Same output as DRF's JSONRenderer
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def content_etag(data):
+    # Strong ETag of the rendered data, the same for equal data in every worker
+    return rendered_etag(dumps(data).encode())
+
+
+def rendered_etag(content):
+    # Strong ETag of an already rendered body
+    return '"' + hashlib.sha1(content).hexdigest() + '"'
+
+
+def render_transactions(transactions):
+    # {"transactions": [...]} rendered one transaction at a time
+    yield '{"transactions":['
+    for i, transaction in enumerate(transactions):
+        yield dumps(transaction) if i == 0 else ',' + dumps(transaction)
+    yield ']}'
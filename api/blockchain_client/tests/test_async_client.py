@@ -0,0 +1,78 @@
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import NotFound
+
+from api.blockchain_client.async_client import AsyncBlockchainClient
+from api.blockchain_client.client import BlockchainClient
+from .test_blockchain_client import StubResponse
+
+ASYNC_TRANSPORT_GET = 'api.blockchain_client.transport.AsyncTransport.get'
+
+
+@override_settings(BLOCKCHAIN_CLIENT_STRICT_TRANSFORM=True)
+class TestAsyncBlockchainClient(TestCase):
+    def setUp(self):
+        BlockchainClient.reset()
+
+    @patch(ASYNC_TRANSPORT_GET)
+    def test_should_parse_address_transactions_like_sync_client(self, mock):
+        mock.return_value = StubResponse([{
+            "inputs": [{"address": "bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d", "value": 135974}],
+            "outputs": [{"address": "1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv", "value": 202992}],
+            "time": 1620513287
+        }])
+        result = async_to_sync(AsyncBlockchainClient.transactions_for_address)(
+            'btc', 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 2, 20)
+        mock.assert_awaited_once_with(
+            'https://api.blockchain.info/haskoin-store/btc/address/bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d' +
+            '/transactions/full', params={'limit': 20, 'offset': 40})
+        self.assertDictEqual(result, {'transactions': [{
+            'inputs': [{'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'value': 135974}],
+            'outputs': [{'address': '1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv', 'value': 202992}],
+            'timestamp': '2021-05-08T22:34:47Z'}]})
+
+    @patch(ASYNC_TRANSPORT_GET)
+    def test_transaction_should_share_cache_with_sync_client(self, mock):
+        mock.return_value = StubResponse({
+            "to": "0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4",
+            "from": "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e",
+            "value": "15000000000000000000",
+            "state": "CONFIRMED",
+            "timestamp": "1620562387"
+        })
+        hash = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
+        result = async_to_sync(AsyncBlockchainClient.transaction)('eth', hash)
+        self.assertDictEqual(BlockchainClient.transaction('eth', hash), result)
+        mock.assert_awaited_once_with(f'https://api.blockchain.info/v2/eth/data/transaction/{hash}')
+
+    @patch(ASYNC_TRANSPORT_GET)
+    def test_should_raise_404_when_downstream_returns_404(self, mock):
+        mock.return_value = StubResponse({}, 404)
+        self.assertRaises(NotFound, async_to_sync(AsyncBlockchainClient.address_balance), 'btc', 'address')
+
+    @override_settings(BLOCKCHAIN_CLIENT_RETRIES=0)
+    @patch(ASYNC_TRANSPORT_GET)
+    def test_balances_should_keep_order_and_mark_failures(self, mock):
+        async def balances(url, params=None):
+            if '/eth/' in url:
+                return StubResponse({}, 500)
+            return StubResponse([{'address': address, 'confirmed': 1} for address in params['addresses'].split(',')])
+
+        mock.side_effect = balances
+        result = async_to_sync(AsyncBlockchainClient.balances)([('btc', 'a'), ('eth', 'b'), ('btc', 'c')])
+        self.assertListEqual(result, [
+            {'crypto': 'btc', 'address': 'a', 'balance': 1},
+            {'crypto': 'eth', 'address': 'b', 'balance': None, 'error': 'Failed to retrieve balances for 1 addresses'},
+            {'crypto': 'btc', 'address': 'c', 'balance': 1},
+        ])
+        self.assertEqual(mock.await_count, 2)
+
+    @patch('asyncio.sleep')
+    @patch(ASYNC_TRANSPORT_GET)
+    def test_should_retry_transient_failures(self, mock, sleep):
+        mock.side_effect = [StubResponse({}, 502), StubResponse({'address': 'a', 'confirmed': 10})]
+        self.assertEqual(async_to_sync(AsyncBlockchainClient.address_balance)('btc', 'a')['balance'], 10)
+        self.assertEqual(mock.await_count, 2)
+        sleep.assert_awaited_once()
@@ -1,10 +1,18 @@
+import threading
+import time
 from collections import OrderedDict
+from types import SimpleNamespace
 from unittest.mock import patch
 
-from django.test import TestCase
-from rest_framework.exceptions import NotFound
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import APIException, NotFound
 
 from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.exceptions import CircuitOpen, Saturated
+from api.blockchain_client.transport import host_of
+
+TRANSPORT_GET = 'api.blockchain_client.transport.Transport.get'
 
 
 class StubResponse:
@@ -16,8 +24,12 @@ class StubResponse:
         return self.data
 
 
+@override_settings(BLOCKCHAIN_CLIENT_STRICT_TRANSFORM=True)
 class TestBlockchainClient(TestCase):
-    @patch('requests.get')
+    def setUp(self):
+        BlockchainClient.reset()
+
+    @patch(TRANSPORT_GET)
     def test_eth_should_parse_address_balance_into_common_format(self, mock):
         mock.return_value = StubResponse({
           "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e": {
@@ -35,7 +47,7 @@ class TestBlockchainClient(TestCase):
         }
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_eth_should_parse_transaction_into_common_format(self, mock):
         mock.return_value = StubResponse({
             "hash": "0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b",
@@ -59,7 +71,7 @@ class TestBlockchainClient(TestCase):
             ('timestamp', '2021-05-09T12:13:07Z')])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_eth_should_parse_address_transactions_into_common_format(self, mock):
         mock.return_value = StubResponse({'transactions': [
             {
@@ -105,7 +117,7 @@ class TestBlockchainClient(TestCase):
         ])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_bch_should_parse_address_balance_into_common_format(self, mock):
         mock.return_value = StubResponse({
           "address": "bitcoincash:qzh0095g66csxg04ms7zhcrg2tludgt3duksgjndts",
@@ -125,7 +137,7 @@ class TestBlockchainClient(TestCase):
         }
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_bch_should_parse_transaction_into_common_format(self, mock):
         response = {
             "txid": "12e5d4e3091e5f3b7a1729398e084fb9971efbaf082983069427fd180d2d50c5",
@@ -157,7 +169,7 @@ class TestBlockchainClient(TestCase):
         ])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_bch_should_parse_address_transactions_into_common_format(self, mock):
         response = [
             {
@@ -225,7 +237,7 @@ class TestBlockchainClient(TestCase):
         ])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_btc_should_parse_address_balance_into_common_format(self, mock):
         mock.return_value = StubResponse({
           "address": "bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d",
@@ -245,7 +257,7 @@ class TestBlockchainClient(TestCase):
         }
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_btc_should_parse_address_transactions_into_common_format(self, mock):
         response = [{
             "inputs": [
@@ -284,7 +296,7 @@ class TestBlockchainClient(TestCase):
         ])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_btc_should_parse_transaction_into_common_format(self, mock):
         response = {
             "inputs": [
@@ -320,7 +332,7 @@ class TestBlockchainClient(TestCase):
             ('timestamp', '2021-05-08T22:34:47Z')])
         self.assertDictEqual(result, expected)
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_address_balance_should_return_404_when_downstream_returns_404(self, mock):
         mock.return_value = StubResponse({}, 404)
         self.assertRaises(
@@ -328,7 +340,7 @@ class TestBlockchainClient(TestCase):
             BlockchainClient.address_balance,
             'btc', 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d')
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_transaction_should_return_404_when_downstream_returns_404(self, mock):
         mock.return_value = StubResponse({}, 404)
         self.assertRaises(
@@ -336,9 +348,274 @@ class TestBlockchainClient(TestCase):
             BlockchainClient.transaction,
             'bch', '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef')
 
-    @patch('requests.get')
+    @patch(TRANSPORT_GET)
     def test_address_transactions_should_return_404_when_downstream_returns_404(self, mock):
         mock.return_value = StubResponse({}, 404)
         self.assertRaises(NotFound,
                           BlockchainClient.transactions_for_address,
                           'btc', 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 2, 20)
+
+    @patch(TRANSPORT_GET)
+    def test_transaction_should_be_served_from_cache_once_confirmed(self, mock):
+        mock.return_value = StubResponse({
+            "to": "0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4",
+            "from": "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e",
+            "value": "15000000000000000000",
+            "state": "CONFIRMED",
+            "timestamp": "1620562387"
+        })
+        hash = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
+        first = BlockchainClient.transaction('eth', hash)
+        second = BlockchainClient.transaction('eth', hash)
+        mock.assert_called_once()
+        self.assertDictEqual(first, second)
+        self.assertIsNone(BlockchainClient.transaction_cache.get('eth', hash).expires)
+
+    @patch(TRANSPORT_GET)
+    def test_unconfirmed_transaction_should_expire(self, mock):
+        mock.return_value = StubResponse({
+            "to": "0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4",
+            "from": "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e",
+            "value": "15000000000000000000",
+            "state": "PENDING",
+            "timestamp": "1620562387"
+        })
+        hash = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
+        with patch.object(BlockchainClient.transaction_cache, 'unconfirmed_ttl', 0):
+            BlockchainClient.transaction('eth', hash)
+            BlockchainClient.transaction('eth', hash)
+        self.assertEqual(mock.call_count, 2)
+
+    @patch(TRANSPORT_GET)
+    def test_transaction_cache_should_not_store_failures(self, mock):
+        mock.return_value = StubResponse({}, 404)
+        hash = '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'
+        # Failures are remembered by the not found cache only
+        with patch.object(BlockchainClient.not_found, 'ttl', 0):
+            self.assertRaises(NotFound, BlockchainClient.transaction, 'btc', hash)
+            self.assertRaises(NotFound, BlockchainClient.transaction, 'btc', hash)
+        self.assertEqual(mock.call_count, 2)
+
+    @patch(TRANSPORT_GET)
+    def test_not_found_should_be_remembered(self, mock):
+        mock.return_value = StubResponse({}, 404)
+        hash = '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'
+        for _ in range(2):
+            self.assertRaises(NotFound, BlockchainClient.transaction, 'btc', hash)
+            self.assertRaises(NotFound, BlockchainClient.transactions_for_address, 'btc', 'a', 0, 10)
+            self.assertRaises(NotFound, BlockchainClient.address_balance, 'btc', 'a')
+        self.assertEqual(mock.call_count, 3)
+        self.assertDictEqual(BlockchainClient.cache_stats()['not_found'], {'hits': 3, 'misses': 3, 'size': 3})
+        # Other kinds of failures are not
+        mock.return_value = StubResponse({}, 400)
+        with override_settings(BLOCKCHAIN_CLIENT_RETRIES=0):
+            self.assertRaises(APIException, BlockchainClient.transaction, 'btc', 'other')
+            self.assertRaises(APIException, BlockchainClient.transaction, 'btc', 'other')
+        self.assertEqual(mock.call_count, 5)
+
+    @patch(TRANSPORT_GET)
+    def test_eth_404_should_be_an_empty_page(self, mock):
+        mock.return_value = StubResponse({'transactions': []}, 404)
+        result = BlockchainClient.transactions_for_address('eth', '0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e', 0, 10)
+        self.assertDictEqual(result, {'transactions': []})
+        self.assertEqual(BlockchainClient.cache_stats()['not_found']['size'], 0)
+
+    @override_settings(BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE=2)
+    @patch(TRANSPORT_GET)
+    def test_btc_address_balances_should_be_queried_in_batches(self, mock):
+        def balances(url, params=None):
+            return StubResponse([{'address': address, 'confirmed': 10} for address in params['addresses'].split(',')])
+
+        mock.side_effect = balances
+        result = BlockchainClient.address_balances('btc', ['a', 'b', 'c'])
+        self.assertEqual(mock.call_count, 2)
+        mock.assert_any_call('https://api.blockchain.info/haskoin-store/btc/address/balances', params={'addresses': 'a,b'})
+        mock.assert_any_call('https://api.blockchain.info/haskoin-store/btc/address/balances', params={'addresses': 'c'})
+        self.assertListEqual(result, [
+            {'crypto': 'btc', 'address': 'a', 'balance': 10},
+            {'crypto': 'btc', 'address': 'b', 'balance': 10},
+            {'crypto': 'btc', 'address': 'c', 'balance': 10},
+        ])
+
+    @patch(TRANSPORT_GET)
+    def test_eth_address_balances_should_parse_balances_keyed_by_address(self, mock):
+        mock.return_value = StubResponse({
+            '0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e': {'balance': '5838070680000000000', 'nonce': 5},
+            '0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4': {'balance': '0', 'nonce': 0},
+        })
+        addresses = ['0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4', '0xAA62dc6cd0123d5bb1e080e61f5fe508b7c8744e']
+        result = BlockchainClient.address_balances('eth', addresses)
+        mock.assert_called_once_with(f'https://api.blockchain.info/eth/account/{",".join(addresses)}/balance')
+        self.assertListEqual(result, [
+            {'crypto': 'eth', 'address': '0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4', 'balance': 0},
+            {'crypto': 'eth', 'address': '0xAA62dc6cd0123d5bb1e080e61f5fe508b7c8744e', 'balance': 5838070680000000000},
+        ])
+
+    @patch(TRANSPORT_GET)
+    def test_address_balances_should_isolate_rejected_addresses(self, mock):
+        def balances(url, params=None):
+            if params is not None:
+                return StubResponse({}, 400)
+            if '/bad/' in url:
+                return StubResponse({}, 404)
+            return StubResponse({'address': 'good', 'confirmed': 10})
+
+        mock.side_effect = balances
+        result = BlockchainClient.address_balances('btc', ['good', 'bad'])
+        self.assertListEqual(result, [
+            {'crypto': 'btc', 'address': 'good', 'balance': 10},
+            {'crypto': 'btc', 'address': 'bad', 'balance': None, 'error': 'Address \'bad\' does not exist.'},
+        ])
+
+    @override_settings(BLOCKCHAIN_CLIENT_RETRIES=0)
+    @patch(TRANSPORT_GET)
+    def test_address_balances_should_mark_batch_as_failed_when_upstream_fails(self, mock):
+        mock.return_value = StubResponse({}, 500)
+        result = BlockchainClient.address_balances('bch', ['a', 'b'])
+        mock.assert_called_once()
+        self.assertListEqual([balance['error'] for balance in result],
+                             ['Failed to retrieve balances for 2 addresses'] * 2)
+
+    @patch(TRANSPORT_GET)
+    def test_address_balances_should_only_fetch_addresses_missing_from_cache(self, mock):
+        def balances(url, params=None):
+            return StubResponse([{'address': address, 'confirmed': 10} for address in params['addresses'].split(',')])
+
+        mock.side_effect = balances
+        BlockchainClient.address_balances('btc', ['a', 'b'])
+        result = BlockchainClient.address_balances('btc', ['b', 'c', 'a'])
+        self.assertEqual(mock.call_count, 2)
+        mock.assert_called_with('https://api.blockchain.info/haskoin-store/btc/address/balances', params={'addresses': 'c'})
+        self.assertListEqual([balance['address'] for balance in result], ['b', 'c', 'a'])
+
+    @override_settings(BLOCKCHAIN_CLIENT_RETRIES=0)
+    @patch(TRANSPORT_GET)
+    def test_address_balances_should_not_cache_failures(self, mock):
+        mock.return_value = StubResponse({}, 500)
+        BlockchainClient.address_balances('bch', ['a'])
+        BlockchainClient.address_balances('bch', ['a'])
+        self.assertEqual(mock.call_count, 2)
+
+    @patch(TRANSPORT_GET)
+    def test_stale_balance_should_be_served_and_refreshed_in_background(self, mock):
+        mock.return_value = StubResponse({'address': 'a', 'confirmed': 10})
+        BlockchainClient.address_balance('btc', 'a')
+        mock.return_value = StubResponse({'address': 'a', 'confirmed': 20})
+        with patch.object(BlockchainClient.balance_cache, 'fresh_ttl', 0), \
+                patch.object(BlockchainClient.refresher, 'submit') as submit:
+            self.assertEqual(BlockchainClient.address_balance('btc', 'a')['balance'], 10)
+            submit.assert_called_once()
+            key, refresh = submit.call_args.args
+            self.assertEqual(key, ('address_balance', 'btc', 'a'))
+            refresh()
+        self.assertEqual(BlockchainClient.address_balance('btc', 'a')['balance'], 20)
+        self.assertEqual(mock.call_count, 2)
+
+    @override_settings(BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE=1, BLOCKCHAIN_CLIENT_RETRIES=0)
+    @patch(TRANSPORT_GET)
+    def test_open_circuit_should_fail_fast_and_keep_serving_cache(self, mock):
+        hash = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
+        mock.return_value = StubResponse({
+            "to": "0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4",
+            "from": "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e",
+            "value": "15000000000000000000",
+            "state": "CONFIRMED",
+            "timestamp": "1620562387"
+        })
+        BlockchainClient.transaction('eth', hash)
+        mock.return_value = StubResponse({}, 503)
+        breaker = BlockchainClient.handler('eth').breaker
+        while breaker.state == 'closed':
+            self.assertRaises(APIException, BlockchainClient.address_balance, 'eth', f'0x{mock.call_count}')
+        calls = mock.call_count
+        self.assertRaises(CircuitOpen, BlockchainClient.address_balance, 'eth', '0xnew')
+        self.assertEqual(mock.call_count, calls)
+        self.assertEqual(BlockchainClient.transaction('eth', hash)['inputs'][0]['value'], 15000000000000000000)
+        # Other cryptos have their own breaker
+        mock.return_value = StubResponse({'address': 'a', 'confirmed': 10})
+        self.assertEqual(BlockchainClient.address_balance('btc', 'a')['balance'], 10)
+
+    @patch('time.sleep')
+    @patch(TRANSPORT_GET)
+    def test_should_retry_transient_failures(self, mock, sleep):
+        mock.side_effect = [StubResponse({}, 503), StubResponse({}, 429), StubResponse({'address': 'a', 'confirmed': 10})]
+        self.assertEqual(BlockchainClient.address_balance('btc', 'a')['balance'], 10)
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch('time.sleep')
+    @patch(TRANSPORT_GET)
+    def test_should_not_retry_answers(self, mock, sleep):
+        mock.return_value = StubResponse({}, 404)
+        self.assertRaises(NotFound, BlockchainClient.address_balance, 'btc', 'a')
+        self.assertEqual(mock.call_count, 1)
+
+    @patch('time.sleep')
+    @patch(TRANSPORT_GET)
+    def test_local_saturation_should_neither_open_the_circuit_nor_be_retried(self, mock, sleep):
+        mock.side_effect = Saturated()
+        breaker = BlockchainClient.handler('btc').breaker
+        for i in range(2 * breaker.min_calls):
+            self.assertRaises(Saturated, BlockchainClient.address_balance, 'btc', f'a{i}')
+        self.assertEqual(mock.call_count, 2 * breaker.min_calls)
+        self.assertEqual(breaker.state, 'closed')
+        sleep.assert_not_called()
+
+    @override_settings(BLOCKCHAIN_CLIENT_RETRY_POLICIES={'eth': {'retries': 0}})
+    @patch('time.sleep')
+    @patch(TRANSPORT_GET)
+    def test_should_use_retry_policy_of_crypto(self, mock, sleep):
+        mock.return_value = StubResponse({}, 503)
+        self.assertRaises(APIException, BlockchainClient.address_balance, 'eth', '0xa')
+        self.assertEqual(mock.call_count, 1)
+        self.assertRaises(APIException, BlockchainClient.address_balance, 'btc', 'a')
+        self.assertEqual(mock.call_count, 4)
+
+    @patch('time.sleep')
+    @patch(TRANSPORT_GET)
+    def test_retries_should_stop_when_budget_is_exhausted(self, mock, sleep):
+        mock.return_value = StubResponse({}, 503)
+        handler = BlockchainClient.handler('btc')
+        # The breaker is kept closed, an open one fails calls before they get to the budget. Calls do not add to
+        # the budget and the clock stands still, so nothing refills it.
+        with patch.object(handler.breaker, 'min_calls', float('inf')), patch.object(handler.retry_budget, 'ratio', 0), \
+                patch('time.monotonic', return_value=time.monotonic()):
+            for i in range(50):
+                self.assertRaises(APIException, BlockchainClient.address_balance, 'btc', f'a{i}')
+                if handler.retry_budget.stats()['exhausted']:
+                    break
+            self.assertGreater(handler.retry_budget.stats()['exhausted'], 0)
+            calls = mock.call_count
+            self.assertRaises(APIException, BlockchainClient.address_balance, 'btc', 'new')
+        self.assertEqual(mock.call_count, calls + 1)
+
+    @override_settings(BLOCKCHAIN_CLIENT_HEDGE_TRANSACTIONS=True)
+    @patch(TRANSPORT_GET)
+    def test_slow_transaction_lookup_should_be_hedged(self, mock):
+        for _ in range(20):
+            BlockchainClient.transport.timeouts.record(BlockchainClient.handler('eth').host, 0.01)
+        hedged = threading.Event()
+        transaction = StubResponse({
+            "to": "0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4",
+            "from": "0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e",
+            "value": "15000000000000000000",
+            "state": "CONFIRMED",
+            "timestamp": "1620562387"
+        })
+
+        def get(url):
+            if mock.call_count == 1:
+                # The first request hangs until the hedged one is done
+                hedged.wait(5)
+                return StubResponse({}, 503)
+            hedged.set()
+            return transaction
+
+        mock.side_effect = get
+        hash = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
+        # The hedge delay passes right away instead of in real time
+        with patch('api.blockchain_client.handlers.wait', lambda futures, timeout: SimpleNamespace(done=set())):
+            self.assertEqual(BlockchainClient.transaction('eth', hash)['inputs'][0]['value'], 15000000000000000000)
+        self.assertEqual(mock.call_count, 2)
+        key = (host_of(settings.BLOCKCHAIN_INFO_URL), 'eth')
+        self.assertEqual(BlockchainClient.retry_budget_stats()[key]['withdrawn'], 1)
@@ -0,0 +1,97 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from api.blockchain_client.cache import BalanceCache, LRUCache, Refresher, TransactionCache
+
+
+class TestLRUCache(TestCase):
+    def test_should_evict_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_should_expire_entries_after_ttl(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1, ttl=10)
+        self.assertEqual(cache.get('a'), 1)
+        with patch('time.monotonic', return_value=time.monotonic() + 11):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class TestTransactionCache(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_should_count_hits_and_misses(self):
+        cache = TransactionCache(max_size=10, unconfirmed_ttl=5)
+        self.assertIsNone(cache.get('btc', 'tx'))
+        cache.set('btc', 'tx', {'inputs': []}, confirmed=True)
+        self.assertDictEqual(cache.get('btc', 'tx').data, {'inputs': []})
+        self.assertDictEqual(cache.stats(), {'hits': 1, 'shared_hits': 0, 'misses': 1, 'size': 1})
+
+    def test_should_share_entries_between_workers(self):
+        worker = TransactionCache(max_size=10, unconfirmed_ttl=5, shared_alias='default')
+        another_worker = TransactionCache(max_size=10, unconfirmed_ttl=5, shared_alias='default')
+        worker.set('eth', 'tx', {'inputs': []}, confirmed=True)
+        self.assertDictEqual(another_worker.get('eth', 'tx').data, {'inputs': []})
+        self.assertEqual(another_worker.stats()['shared_hits'], 1)
+        another_worker.get('eth', 'tx')
+        self.assertEqual(another_worker.stats()['hits'], 1)
+
+    def test_should_not_serve_expired_unconfirmed_entries_from_shared_tier(self):
+        worker = TransactionCache(max_size=10, unconfirmed_ttl=5, shared_alias='default')
+        another_worker = TransactionCache(max_size=10, unconfirmed_ttl=5, shared_alias='default')
+        worker.set('eth', 'tx', {'inputs': []}, confirmed=False)
+        with patch('time.time', return_value=time.time() + 6):
+            self.assertIsNone(another_worker.get('eth', 'tx'))
+
+
+class TestBalanceCache(TestCase):
+    def test_should_tell_fresh_from_stale_entries(self):
+        cache = BalanceCache(max_size=10, fresh_ttl=5, stale_ttl=10)
+        cache.set('btc', 'address', {'balance': 1})
+        entry = cache.get('btc', 'address')
+        self.assertTrue(cache.is_fresh(entry))
+        with patch('time.time', return_value=time.time() + 6):
+            self.assertFalse(cache.is_fresh(entry))
+
+    def test_should_drop_entries_after_stale_window(self):
+        cache = BalanceCache(max_size=10, fresh_ttl=5, stale_ttl=10)
+        cache.set('btc', 'address', {'balance': 1})
+        with patch('time.monotonic', return_value=time.monotonic() + 16):
+            self.assertIsNone(cache.get('btc', 'address'))
+
+
+class TestRefresher(TestCase):
+    def test_should_not_submit_key_being_refreshed(self):
+        refresher = Refresher(max_workers=1)
+        started, release = threading.Event(), threading.Event()
+
+        def refresh():
+            started.set()
+            release.wait(5)
+
+        self.assertTrue(refresher.submit('key', refresh))
+        started.wait(5)
+        self.assertFalse(refresher.submit('key', refresh))
+        release.set()
+        refresher._executor.shutdown(wait=True)
+        self.assertDictEqual(refresher.stats(), {'submitted': 1, 'skipped': 1, 'failed': 0})
+
+    def test_should_count_failed_refreshes(self):
+        refresher = Refresher(max_workers=1)
+        with self.assertLogs(level='WARNING'):
+            refresher.submit('key', lambda: 1 / 0)
+            refresher._executor.shutdown(wait=True)
+        self.assertEqual(refresher.stats()['failed'], 1)
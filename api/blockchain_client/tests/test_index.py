@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.index import TransactionIndex
+from api.crypto.models import IndexedTransaction
+from .test_blockchain_client import StubResponse, TRANSPORT_GET
+
+
+def haskoin_transaction(txid, confirmed=True):
+    return {
+        'txid': txid,
+        'inputs': [{'address': 'a', 'value': 1}],
+        # Tells the transactions apart in results
+        'outputs': [{'address': txid, 'value': 1}],
+        'time': 1620513287,
+        'block': {'height': 1} if confirmed else {'mempool': 1620513287},
+    }
+
+
+class UpstreamHistory:
+    # Haskoin address history, newest first, answering limit/offset queries
+    def __init__(self, txids):
+        self.transactions = [haskoin_transaction(txid) for txid in txids]
+
+    def __call__(self, url, params=None):
+        return StubResponse(self.transactions[params['offset']:params['offset'] + params['limit']])
+
+
+@override_settings(BLOCKCHAIN_CLIENT_TX_INDEX=True)
+class TestTransactionIndex(TestCase):
+    def setUp(self):
+        BlockchainClient.reset()
+        self.index = TransactionIndex(chunk=4, sync_ttl=60)
+        patcher = patch.object(BlockchainClient, 'transaction_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def page(self, page, size=2):
+        result = BlockchainClient.transactions_for_address('btc', 'address', page, size)
+        return [tx['outputs'][0]['address'] for tx in result['transactions']]
+
+    @patch(TRANSPORT_GET)
+    def test_repeated_pages_should_be_served_from_the_index(self, mock):
+        mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(10)])
+        self.assertListEqual(self.page(0), ['tx0', 'tx1'])
+        mock.assert_called_once_with(
+            'https://api.blockchain.info/haskoin-store/btc/address/address/transactions/full',
+            params={'limit': 4, 'offset': 0})
+        # The first chunk holds the second page as well
+        self.assertListEqual(self.page(1), ['tx2', 'tx3'])
+        self.assertListEqual(self.page(0), ['tx0', 'tx1'])
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(self.index.stats()['local_pages'], 2)
+        self.assertListEqual(list(IndexedTransaction.objects.order_by('hash').values_list('hash', flat=True)),
+                             ['tx0', 'tx1', 'tx2', 'tx3'])
+
+    @patch(TRANSPORT_GET)
+    def test_deep_pages_should_only_fetch_missing_chunks(self, mock):
+        mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(6)])
+        self.page(0)
+        self.assertListEqual(self.page(2), ['tx4', 'tx5'])
+        self.assertEqual(mock.call_count, 2)
+        mock.assert_called_with('https://api.blockchain.info/haskoin-store/btc/address/address/transactions/full',
+                                params={'limit': 4, 'offset': 4})
+        # The whole history is indexed now
+        self.assertListEqual(self.page(5), [])
+        self.assertEqual(mock.call_count, 2)
+
+    @patch(TRANSPORT_GET)
+    def test_sync_should_only_add_new_transactions_on_top(self, mock):
+        history = mock.side_effect = UpstreamHistory(['tx2', 'tx1', 'tx0'])
+        self.page(0, size=3)
+        history.transactions.insert(0, haskoin_transaction('tx3', confirmed=False))
+        self.index.sync_ttl = 0
+        self.assertListEqual(self.page(0, size=3), ['tx3', 'tx2', 'tx1'])
+        self.assertEqual(mock.call_count, 2)
+        # The unconfirmed transaction is replaced on the next sync
+        history.transactions[0] = haskoin_transaction('tx3')
+        history.transactions.insert(0, haskoin_transaction('tx4'))
+        self.assertListEqual(self.page(1, size=3), ['tx1', 'tx0'])
+        self.assertDictEqual(self.index.stats(), {'pages': 3, 'local_pages': 0, 'upstream_pages': 3, 'resets': 0})
+        indexed = list(IndexedTransaction.objects.filter(
+            addresstransaction__indexed_address__address='address'
+        ).order_by('addresstransaction__position').values_list('hash', 'confirmed'))
+        self.assertListEqual(indexed, [('tx4', True), ('tx3', True), ('tx2', True), ('tx1', True), ('tx0', True)])
+
+    @patch(TRANSPORT_GET)
+    def test_sync_should_start_over_when_newest_transaction_is_gone(self, mock):
+        history = mock.side_effect = UpstreamHistory(['tx1', 'tx0'])
+        self.page(0)
+        history.transactions = [haskoin_transaction('other')]
+        self.index.sync_ttl = 0
+        self.assertListEqual(self.page(0), ['other'])
+        self.assertEqual(self.index.stats()['resets'], 1)
+
+    @patch(TRANSPORT_GET)
+    def test_indexed_transaction_should_be_served_without_upstream(self, mock):
+        mock.side_effect = UpstreamHistory(['tx1', 'tx0'])
+        page = BlockchainClient.transactions_for_address('btc', 'address', 0, 2)
+        BlockchainClient.transaction_cache.clear()
+        self.assertEqual(BlockchainClient.transaction('btc', 'tx1'), page['transactions'][0])
+        self.assertEqual(mock.call_count, 1)
+
+    @patch(TRANSPORT_GET)
+    def test_newer_should_take_the_newest_up_to_since(self, mock):
+        mock.side_effect = UpstreamHistory(['tx3', 'tx2', 'tx1', 'tx0'])
+        self.page(0)
+        newer = self.index.newer_of([('btc', 'address', 'tx1'), ('btc', 'unknown', 'tx1')], limit=10)
+        self.assertListEqual([hash for hash, _ in newer[('btc', 'address')]], ['tx3', 'tx2'])
+        self.assertNotIn(('btc', 'unknown'), newer)
+        # A `since` that is not indexed (anymore) leaves all of them newer, up to the limit
+        newer = self.index.newer_of([('btc', 'address', 'gone')], limit=3)
+        self.assertListEqual([hash for hash, _ in newer[('btc', 'address')]], ['tx3', 'tx2', 'tx1'])
+        self.assertDictEqual(self.index.newest_of([('btc', 'address'), ('eth', 'address')]), {('btc', 'address'): 'tx3'})
@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from api.blockchain_client.client import BlockchainClient, chunks_of_page
+from .test_blockchain_client import TRANSPORT_GET
+from .test_index import UpstreamHistory
+
+URL = 'https://api.blockchain.info/haskoin-store/btc/address/address/transactions/full'
+
+
+class TestTransactionPages(TestCase):
+    def setUp(self):
+        BlockchainClient.reset()
+
+    def page(self, page, size):
+        result = BlockchainClient.transactions_for_address('btc', 'address', page, size)
+        return [tx['outputs'][0]['address'] for tx in result['transactions']]
+
+    def test_chunks_of_page(self):
+        self.assertEqual(chunks_of_page(0, 10, 10), (range(0, 1), 0))
+        self.assertEqual(chunks_of_page(1, 3, 4), (range(0, 2), 3))
+        self.assertEqual(chunks_of_page(2, 25, 100), (range(0, 1), 50))
+
+    @override_settings(BLOCKCHAIN_CLIENT_TX_CHUNK=4)
+    @patch(TRANSPORT_GET)
+    def test_page_across_chunks_should_be_cut_from_aligned_upstream_pages(self, mock):
+        mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(10)])
+        self.assertListEqual(self.page(1, 3), ['tx3', 'tx4', 'tx5'])
+        self.assertListEqual(sorted(call.kwargs['params']['offset'] for call in mock.call_args_list), [0, 4])
+        # The next page starts in a chunk that was already fetched
+        self.assertListEqual(self.page(2, 3), ['tx6', 'tx7', 'tx8'])
+        self.assertEqual(mock.call_count, 3)
+        mock.assert_called_with(URL, params={'limit': 4, 'offset': 8})
+
+    @patch(TRANSPORT_GET)
+    def test_repeated_page_should_be_served_from_the_page_cache(self, mock):
+        mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(10)])
+        self.assertListEqual(self.page(1, 2), ['tx2', 'tx3'])
+        self.assertListEqual(self.page(1, 2), ['tx2', 'tx3'])
+        mock.assert_called_once_with(URL, params={'limit': 2, 'offset': 2})
+
+    @patch(TRANSPORT_GET)
+    def test_prefetched_page_should_be_served_from_the_page_cache(self, mock):
+        mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(10)])
+        with patch.object(BlockchainClient.refresher, 'submit', lambda key, fn: fn()):
+            BlockchainClient.prefetch_transactions('btc', 'address', 3, 2)
+        self.assertListEqual(self.page(3, 2), ['tx6', 'tx7'])
+        self.assertEqual(mock.call_count, 1)
@@ -0,0 +1,132 @@
+import tempfile
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.exceptions import CircuitOpen, RateLimited
+from api.blockchain_client.ratelimit import BACKGROUND, INTERACTIVE, RateLimiter, background, priority
+from .test_blockchain_client import StubResponse, TRANSPORT_GET
+
+HOST = 'https://api.blockchain.info'
+
+
+class Clock:
+    # Stands in for both clocks, sleeping moves time forward
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        for target in ('time.time', 'time.monotonic'):
+            patcher = patch(target, self.clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch('time.sleep', side_effect=self.clock.sleep)
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_queue_calls_over_the_rate(self):
+        limiter = RateLimiter(rate=2, burst=2)
+        for _ in range(3):
+            limiter.acquire(HOST)
+        self.sleep.assert_called_once_with(0.5)
+        self.assertDictEqual(limiter.stats(), {'acquired': 3, 'queued': 1, 'rejected': 0})
+
+    def test_should_reject_calls_that_would_wait_past_the_deadline(self):
+        limiter = RateLimiter(rate=1, burst=1, wait={INTERACTIVE: 0.5})
+        limiter.acquire(HOST)
+        self.assertRaises(RateLimited, limiter.acquire, HOST)
+        self.sleep.assert_not_called()
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_background_calls_should_leave_reserve_to_interactive_ones(self):
+        limiter = RateLimiter(rate=1, burst=4, reserve=0.5, wait={BACKGROUND: 0})
+        with background():
+            limiter.acquire(HOST)
+            limiter.acquire(HOST)
+            self.assertRaises(RateLimited, limiter.acquire, HOST)
+        limiter.acquire(HOST)
+        limiter.acquire(HOST)
+        self.assertEqual(limiter.stats()['acquired'], 4)
+
+    def test_background_calls_should_get_through_at_low_rates(self):
+        # The default burst of rate 1 is a single token, there is none to reserve
+        limiter = RateLimiter(rate=1)
+        with background():
+            limiter.acquire(HOST)
+            limiter.acquire(HOST)
+        self.sleep.assert_called_once_with(1)
+        self.assertDictEqual(limiter.stats(), {'acquired': 2, 'queued': 1, 'rejected': 0})
+
+    def test_priority_should_be_restored_after_background(self):
+        with background():
+            self.assertEqual(priority.get(), BACKGROUND)
+        self.assertEqual(priority.get(), INTERACTIVE)
+
+    def test_should_share_budget_through_state_dir(self):
+        with tempfile.TemporaryDirectory() as state_dir:
+            worker = RateLimiter(rate=1, burst=2, wait={INTERACTIVE: 0}, state_dir=state_dir)
+            another_worker = RateLimiter(rate=1, burst=2, wait={INTERACTIVE: 0}, state_dir=state_dir)
+            worker.acquire(HOST)
+            another_worker.acquire(HOST)
+            self.assertRaises(RateLimited, worker.acquire, HOST)
+            self.assertRaises(RateLimited, another_worker.acquire, HOST)
+            # Other hosts have their own bucket
+            worker.acquire('http://localhost:8001')
+
+    def test_async_acquire_should_queue_on_the_event_loop(self):
+        limiter = RateLimiter(rate=2, burst=1)
+        with patch('asyncio.sleep', side_effect=self.clock.sleep) as sleep:
+            async_to_sync(limiter.acquire_async)(HOST)
+            async_to_sync(limiter.acquire_async)(HOST)
+        sleep.assert_awaited_once_with(0.5)
+
+    def test_should_not_limit_without_rate(self):
+        limiter = RateLimiter()
+        for _ in range(100):
+            limiter.acquire(HOST)
+        self.assertEqual(limiter.stats()['acquired'], 0)
+
+
+class TestClientRateLimit(TestCase):
+    def setUp(self):
+        self.limiter = BlockchainClient.upstreams.limiter
+        self.addCleanup(setattr, BlockchainClient.upstreams, 'limiter', self.limiter)
+        BlockchainClient.upstreams.limiter = RateLimiter(rate=0.001, burst=1, wait={INTERACTIVE: 0})
+        BlockchainClient.reset()
+
+    @override_settings(BLOCKCHAIN_CLIENT_RETRIES=2)
+    @patch(TRANSPORT_GET)
+    def test_retries_should_pay_from_the_rate_limit(self, mock):
+        mock.return_value = StubResponse({}, 503)
+        with patch('time.sleep'):
+            self.assertRaises(RateLimited, BlockchainClient.address_balance, 'btc', 'a')
+        self.assertEqual(mock.call_count, 1)
+
+    @patch(TRANSPORT_GET)
+    def test_limited_call_should_fail_with_503(self, mock):
+        mock.return_value = StubResponse({'address': 'a', 'confirmed': 10})
+        self.assertEqual(BlockchainClient.address_balance('btc', 'a')['balance'], 10)
+        with self.assertRaises(RateLimited) as raised:
+            BlockchainClient.address_balance('btc', 'b')
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(mock.call_count, 1)
+
+    @patch(TRANSPORT_GET)
+    def test_open_circuit_should_not_take_tokens(self, mock):
+        breaker = BlockchainClient.handler('btc').breaker
+        for _ in range(breaker.min_calls):
+            breaker.record(True, 0)
+        self.assertRaises(CircuitOpen, BlockchainClient.address_balance, 'btc', 'a')
+        self.assertEqual(BlockchainClient.upstreams.limiter.stats()['acquired'], 0)
+        mock.assert_not_called()
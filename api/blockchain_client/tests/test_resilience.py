@@ -0,0 +1,125 @@
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from api.blockchain_client.exceptions import CircuitOpen, UpstreamTimeout, UpstreamUnavailable
+from api.blockchain_client.resilience import (
+    CLOSED, HALF_OPEN, OPEN, AdaptiveTimeout, CircuitBreaker, LatencyWindow, RetryBudget, RetryPolicy
+)
+from .test_blockchain_client import StubResponse
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, slow_call=1, slow_rate=1,
+                                      open_seconds=30)
+
+    def test_should_open_when_failure_rate_is_reached(self):
+        for failed in [False, False, True]:
+            self.breaker.acquire()
+            self.breaker.record(failed, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.acquire()
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertRaises(CircuitOpen, self.breaker.acquire)
+        self.assertDictEqual(self.breaker.stats(), {'opened': 1, 'rejected': 1, 'state': OPEN})
+
+    def test_should_open_when_calls_are_slow(self):
+        for _ in range(4):
+            self.breaker.record(False, 2)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_should_let_one_probe_through_when_half_open(self):
+        for _ in range(4):
+            self.breaker.record(True, 0.1)
+        with patch('time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            self.breaker.acquire()
+            self.assertRaises(CircuitOpen, self.breaker.acquire)
+            self.breaker.record(False, 0.1)
+            self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_released_probe_should_let_another_one_through(self):
+        for _ in range(4):
+            self.breaker.record(True, 0.1)
+        with patch('time.monotonic', return_value=time.monotonic() + 31):
+            self.breaker.acquire()
+            self.breaker.release()
+            self.breaker.acquire()
+            self.assertRaises(CircuitOpen, self.breaker.acquire)
+
+    def test_failed_probe_should_reopen(self):
+        for _ in range(4):
+            self.breaker.record(True, 0.1)
+        with patch('time.monotonic', return_value=time.monotonic() + 31):
+            self.breaker.acquire()
+            self.breaker.record(True, 0.1)
+            self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+
+
+class TestRetryPolicy(TestCase):
+    def test_should_retry_configured_failures(self):
+        policy = RetryPolicy(retry_on=['5xx', 'timeout'])
+        self.assertTrue(policy.retryable(StubResponse({}, 503)))
+        self.assertFalse(policy.retryable(StubResponse({}, 429)))
+        self.assertFalse(policy.retryable(StubResponse({}, 404)))
+        self.assertTrue(policy.retryable(error=UpstreamTimeout()))
+        self.assertFalse(policy.retryable(error=UpstreamUnavailable()))
+
+    def test_delay_should_be_jittered_exponential_backoff(self):
+        policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+        with patch('random.uniform', side_effect=lambda low, high: high):
+            self.assertListEqual([policy.delay(retry) for retry in (1, 2, 3)], [0.1, 0.2, 0.3])
+
+
+class TestRetryBudget(TestCase):
+    def test_should_allow_ratio_of_calls_after_capacity(self):
+        now = time.monotonic()
+        budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+        with patch('time.monotonic', return_value=now):
+            self.assertTrue(budget.withdraw())
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+            budget.deposit()
+            budget.deposit()
+            self.assertTrue(budget.withdraw())
+        self.assertDictEqual(budget.stats(), {'calls': 2, 'withdrawn': 3, 'exhausted': 1})
+
+    def test_should_refill_over_time(self):
+        now = time.monotonic()
+        with patch('time.monotonic', return_value=now):
+            # Built on the patched clock, the refill is counted from there
+            budget = RetryBudget(ratio=0, min_per_second=1, capacity=1)
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+        with patch('time.monotonic', return_value=now + 1):
+            self.assertTrue(budget.withdraw())
+
+
+class TestAdaptiveTimeout(TestCase):
+    def test_should_use_max_read_timeout_until_there_are_enough_samples(self):
+        timeouts = AdaptiveTimeout(max_read=10, min_samples=3)
+        timeouts.record('host', 0.1)
+        self.assertEqual(timeouts.read('host'), 10)
+
+    def test_should_follow_latency_within_bounds(self):
+        timeouts = AdaptiveTimeout(max_read=10, min_read=1, percentile=99, factor=3, min_samples=3)
+        for latency in [0.5, 0.6, 0.7]:
+            timeouts.record('host', latency)
+        self.assertAlmostEqual(timeouts.read('host'), 2.1)
+        for _ in range(3):
+            timeouts.record('fast', 0.01)
+        self.assertEqual(timeouts.read('fast'), 1)
+        for _ in range(3):
+            timeouts.record('slow', 20)
+        self.assertEqual(timeouts.read('slow'), 10)
+
+    def test_latency_window_should_keep_last_values(self):
+        window = LatencyWindow(size=2)
+        for latency in [5, 1, 2]:
+            window.add(latency)
+        self.assertEqual(window.percentile(100), 2)
+        self.assertIsNone(window.percentile(50, min_samples=3))
@@ -0,0 +1,109 @@
+import asyncio
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.test import TestCase
+from rest_framework.exceptions import APIException
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.singleflight import SingleFlight
+from .test_blockchain_client import StubResponse, TRANSPORT_GET
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class TestSingleFlight(TestCase):
+    def run_concurrently(self, single_flight, fn, callers=5):
+        release = threading.Event()
+
+        def blocking():
+            release.wait(5)
+            return fn()
+
+        def call(_):
+            try:
+                return single_flight.do(('transaction', 'btc', 'tx', None, None), blocking)
+            except APIException as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=callers) as executor:
+            futures = [executor.submit(call, i) for i in range(callers)]
+            wait_for(lambda: single_flight.stats()['coalesced'] == callers - 1)
+            release.set()
+            return [future.result() for future in futures]
+
+    def test_should_collapse_concurrent_identical_calls(self):
+        single_flight = SingleFlight()
+        calls = []
+        results = self.run_concurrently(single_flight, lambda: calls.append(1) or {'inputs': []})
+        self.assertEqual(len(calls), 1)
+        self.assertListEqual(results, [{'inputs': []}] * 5)
+        self.assertDictEqual(single_flight.stats(), {'calls': 5, 'executed': 1, 'coalesced': 4, 'shared_coalesced': 0})
+
+    def test_should_share_errors_with_waiters(self):
+        error = APIException('Failed to retrieve data for transaction \'tx\'')
+
+        def failing():
+            raise error
+
+        results = self.run_concurrently(SingleFlight(), failing, callers=3)
+        self.assertListEqual(results, [error] * 3)
+
+    def test_should_not_collapse_sequential_calls(self):
+        single_flight = SingleFlight()
+        single_flight.do('key', lambda: 1)
+        single_flight.do('key', lambda: 2)
+        self.assertEqual(single_flight.stats()['executed'], 2)
+
+    def test_should_collapse_concurrent_identical_coroutines(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return {'inputs': []}
+
+        async def concurrently():
+            return await asyncio.gather(*[single_flight.do_async('key', fetch) for _ in range(3)])
+
+        self.assertListEqual(async_to_sync(concurrently)(), [{'inputs': []}] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertDictEqual(single_flight.stats(), {'calls': 3, 'executed': 1, 'coalesced': 2, 'shared_coalesced': 0})
+
+    def test_should_collapse_calls_across_workers_with_lock_dir(self):
+        caches['default'].clear()
+        with tempfile.TemporaryDirectory() as lock_dir:
+            worker = SingleFlight(lock_dir=lock_dir, shared_alias='default')
+            another_worker = SingleFlight(lock_dir=lock_dir, shared_alias='default')
+            self.assertEqual(worker.do('key', lambda: 'upstream'), 'upstream')
+            self.assertEqual(another_worker.do('key', lambda: 'again'), 'upstream')
+        self.assertEqual(another_worker.stats()['shared_coalesced'], 1)
+
+    @patch(TRANSPORT_GET)
+    def test_client_should_collapse_identical_address_transactions_queries(self, mock):
+        release = threading.Event()
+
+        def slow(url, params=None):
+            release.wait(5)
+            return StubResponse([])
+
+        mock.side_effect = slow
+        coalesced = BlockchainClient.single_flight_stats()['coalesced']
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(BlockchainClient.transactions_for_address, 'btc', 'address', 0, 50)
+                       for _ in range(3)]
+            wait_for(lambda: BlockchainClient.single_flight_stats()['coalesced'] == coalesced + 2)
+            release.set()
+            results = [future.result() for future in futures]
+        mock.assert_called_once()
+        self.assertListEqual(results, [{'transactions': []}] * 3)
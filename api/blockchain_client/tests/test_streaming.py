@@ -0,0 +1,101 @@
+import json
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.test import APIClient
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.streaming import iter_items, render_transactions
+from api.crypto.tests.test_search_views import ADDRESS
+from .test_blockchain_client import TRANSPORT_GET
+from .test_index import haskoin_transaction
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class StreamResponse:
+    def __init__(self, data, status=200):
+        self.body = json.dumps(data).encode()
+        self.status_code = status
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        return iter(chunked(self.body, chunk_size))
+
+    def close(self):
+        self.closed = True
+
+
+class TestIterItems(TestCase):
+    def test_should_decode_items_across_chunks(self):
+        items = [{'txid': 'ü' * i, 'value': 10 ** 20, 'inputs': list(range(i))} for i in range(10)]
+        for size in (1, 3, 1000):
+            self.assertListEqual(list(iter_items(chunked(json.dumps(items).encode(), size))), items)
+        self.assertListEqual(list(iter_items(chunked(b'[1, 22, 333]', 1))), [1, 22, 333])
+        self.assertListEqual(list(iter_items([b' [ ] '])), [])
+
+    def test_should_decode_items_under_key(self):
+        body = json.dumps({'page': {'number': 1}, 'transactions': [{'hash': 'a'}, {'hash': 'b'}], 'size': 2})
+        self.assertListEqual(list(iter_items(chunked(body.encode(), 4), key='transactions')),
+                             [{'hash': 'a'}, {'hash': 'b'}])
+
+    def test_should_fail_on_truncated_body(self):
+        self.assertRaises(APIException, list, iter_items([b'[{"a": 1}, {"b"']))
+        self.assertRaises(APIException, list, iter_items([b'{"page": 1}'], key='transactions'))
+
+    def test_should_render_like_json_renderer(self):
+        rendered = ''.join(render_transactions(iter([{'timestamp': '2021-05-08T22:34:47Z'}, {'value': 1}])))
+        self.assertEqual(rendered, '{"transactions":[{"timestamp":"2021-05-08T22:34:47Z"},{"value":1}]}')
+
+
+@override_settings(BLOCKCHAIN_CLIENT_STRICT_TRANSFORM=True, STREAM_CHUNK_SIZE=16)
+class TestStreamTransactions(TestCase):
+    def setUp(self):
+        BlockchainClient.reset()
+
+    @patch(TRANSPORT_GET)
+    def test_should_produce_the_same_transactions(self, mock):
+        upstream = [haskoin_transaction('tx1'), haskoin_transaction('tx0')]
+        mock.return_value = StreamResponse(upstream)
+        streamed = list(BlockchainClient.stream_transactions_for_address('btc', 'address', 0, 2))
+        mock.assert_called_once_with('https://api.blockchain.info/haskoin-store/btc/address/address/transactions/full',
+                                     params={'limit': 2, 'offset': 0}, stream=True)
+        self.assertTrue(mock.return_value.closed)
+
+        mock.return_value = StreamResponse(upstream)
+        self.assertListEqual(streamed, BlockchainClient.transactions_for_address('btc', 'address', 0, 2)['transactions'])
+
+    @patch(TRANSPORT_GET)
+    def test_eth_should_stream_transactions_under_key(self, mock):
+        mock.return_value = StreamResponse({'transactions': [{
+            'hash': '0x1', 'from': '0xa', 'to': '0xb', 'value': '15000000000000000000', 'timestamp': '1620562387'}]})
+        streamed = list(BlockchainClient.stream_transactions_for_address('eth', '0xa', 0, 1))
+        self.assertEqual(streamed[0]['inputs'][0]['value'], 15000000000000000000)
+
+    @patch(TRANSPORT_GET)
+    def test_upstream_errors_should_be_raised_before_streaming(self, mock):
+        mock.return_value = StreamResponse({}, 404)
+        self.assertRaises(NotFound, BlockchainClient.stream_transactions_for_address, 'btc', 'address', 0, 2)
+        self.assertTrue(mock.return_value.closed)
+
+    @override_settings(STREAM_ADDRESS_TRANSACTIONS=True)
+    @patch(TRANSPORT_GET)
+    def test_view_should_stream_the_page(self, mock):
+        user = get_user_model().objects.create(username='stream', password='pass')
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        mock.return_value = StreamResponse([haskoin_transaction('tx0')])
+        response = client.get(reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS}))
+        self.assertTrue(response.streaming)
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body['transactions'][0]['outputs'][0]['address'], 'tx0')
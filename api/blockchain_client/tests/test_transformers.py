@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+
+from api.blockchain_client.serializers import TransactionSerializer
+from api.blockchain_client.transformers import serialize_transaction, serialize_transactions
+
+
+def transaction(**overrides):
+    tx = {
+        'inputs': [{'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'value': 135974, 'txid': 'ab'}],
+        'outputs': [{'address': None, 'value': '735'}, {'address': ' 1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv ', 'value': 2.0}],
+        'timestamp': datetime.fromtimestamp(1620513287),
+    }
+    tx.update(overrides)
+    return tx
+
+
+class TestTransformers(TestCase):
+    def test_should_match_serializer_output(self):
+        for tx in [transaction(),
+                   transaction(inputs=[]),
+                   transaction(timestamp=datetime.fromtimestamp(1620513287, tz=timezone.utc)),
+                   transaction(outputs=[{'address': 12, 'value': '15000000000000000000'}])]:
+            serializer = TransactionSerializer(data=tx)
+            serializer.is_valid(raise_exception=True)
+            self.assertEqual(serialize_transaction(tx, strict=True), serializer.data)
+
+    def test_should_raise_serializer_errors_for_invalid_transactions(self):
+        for tx in [transaction(inputs=[{'address': 'a', 'value': 1.5}]),
+                   transaction(inputs=[{'address': '', 'value': 1}]),
+                   transaction(inputs=[{'address': True, 'value': 1}]),
+                   transaction(outputs=[{'value': 1}]),
+                   transaction(outputs={'address': 'a', 'value': 1}),
+                   transaction(timestamp=None)]:
+            serializer = TransactionSerializer(data=tx)
+            self.assertFalse(serializer.is_valid())
+            with self.assertRaises(ValidationError) as error:
+                serialize_transaction(tx)
+            self.assertEqual(error.exception.detail, serializer.errors)
+
+    def test_should_nest_errors_of_transaction_lists(self):
+        with self.assertRaises(ValidationError) as error:
+            serialize_transactions([transaction(), transaction(inputs=[{'address': 'a', 'value': 'x'}])])
+        self.assertEqual(error.exception.detail,
+                         {'transactions': [{}, {'inputs': [{'value': ['A valid integer is required.']}]}]})
+
+    def test_strict_mode_should_detect_mismatches(self):
+        with patch('api.blockchain_client.transformers.transaction', return_value={'inputs': []}):
+            self.assertRaises(AssertionError, serialize_transaction, transaction(), strict=True)
+            self.assertDictEqual(serialize_transaction(transaction(), strict=False), {'inputs': []})
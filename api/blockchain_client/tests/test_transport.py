@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from api.blockchain_client.exceptions import Saturated, UpstreamTimeout, UpstreamUnavailable
+from api.blockchain_client.transport import AsyncTransport, Transport, host_of
+
+
+class TestTransport(TestCase):
+    def setUp(self):
+        self.transport = Transport(pool_size=4, connect_timeout=1.5, read_timeout=7)
+
+    @patch('requests.Session.get')
+    def test_should_pass_connect_and_read_timeouts(self, mock):
+        self.transport.get('https://api.blockchain.info/haskoin-store/btc/transaction/abc', params={'limit': 1})
+        mock.assert_called_once_with(
+            'https://api.blockchain.info/haskoin-store/btc/transaction/abc',
+            params={'limit': 1},
+            timeout=(1.5, 7),
+            stream=False)
+
+    def test_should_reuse_session_per_host(self):
+        first = self.transport.session('https://api.blockchain.info')
+        second = self.transport.session('https://api.blockchain.info')
+        other = self.transport.session('https://example.com')
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(first.get_adapter('https://api.blockchain.info/').poolmanager.connection_pool_kw['maxsize'], 4)
+
+    @patch('os.getpid')
+    def test_should_rebuild_sessions_after_fork(self, mock):
+        mock.return_value = 1
+        parent = self.transport.session('https://api.blockchain.info')
+        mock.return_value = 2
+        child = self.transport.session('https://api.blockchain.info')
+        self.assertIsNot(parent, child)
+
+    @patch('requests.Session.get')
+    def test_should_raise_timeout_when_upstream_is_slow(self, mock):
+        mock.side_effect = requests.ReadTimeout()
+        self.assertRaises(UpstreamTimeout, self.transport.get, 'https://api.blockchain.info/eth/account/a/balance')
+
+    @patch('requests.Session.get')
+    def test_should_raise_unavailable_when_upstream_is_unreachable(self, mock):
+        mock.side_effect = requests.ConnectionError()
+        self.assertRaises(UpstreamUnavailable, self.transport.get, 'https://api.blockchain.info/eth/account/a/balance')
+
+    @patch('requests.Session.get')
+    def test_should_fail_fast_when_host_concurrency_is_exhausted(self, mock):
+        transport = Transport(pool_size=1, read_timeout=0.01, max_concurrency=1)
+        transport.slots('https://api.blockchain.info').acquire()
+        self.assertRaises(Saturated, transport.get, 'https://api.blockchain.info/eth/account/a/balance')
+        mock.assert_not_called()
+
+    def test_stats_should_report_pool_reuse(self):
+        session = self.transport.session('https://api.blockchain.info')
+        pool = session.get_adapter('https://api.blockchain.info/').poolmanager.connection_from_url(
+            'https://api.blockchain.info/')
+        pool.num_requests = 5
+        pool.num_connections = 2
+        self.assertDictEqual(self.transport.stats(), {
+            'https://api.blockchain.info': {'requests': 5, 'connections': 2, 'reused': 3}
+        })
+
+    def test_host_of_should_keep_scheme_and_port(self):
+        self.assertEqual(host_of('http://localhost:8080/btc/address/a/balance?x=1'), 'http://localhost:8080')
+
+    def test_async_clients_should_be_reused_within_and_closed_with_their_loop(self):
+        transport = AsyncTransport()
+
+        async def clients():
+            return [await transport.client('https://api.blockchain.info') for _ in range(2)]
+
+        first, again = async_to_sync(clients)()
+        self.assertIs(first, again)
+        self.assertTrue(first.is_closed)
+        self.assertIsNot(async_to_sync(clients)()[0], first)
+
+    @patch('httpx.AsyncClient.get')
+    def test_async_wait_for_a_connection_should_be_saturation(self, mock):
+        mock.side_effect = httpx.PoolTimeout('No connection available')
+        get = AsyncTransport().get
+        self.assertRaises(Saturated, async_to_sync(get), 'https://api.blockchain.info/eth/account/a/balance')
+        mock.side_effect = httpx.ReadTimeout('Slow upstream')
+        self.assertRaises(UpstreamTimeout, async_to_sync(get), 'https://api.blockchain.info/eth/account/a/balance')
@@ -0,0 +1,109 @@
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.fields import IntegerField
+
+from .serializers import TransactionSerializer, TransactionsSerializer
+
+# Fast path for the common transaction format. Validates and normalizes a transformed upstream transaction
+# in one pass, producing the same output as TransactionSerializer(data=...).data without the DRF field machinery.
+# Anything the fast path does not accept is handed to TransactionSerializer, so errors are still DRF errors.
+
+
+class Invalid(Exception):
+    pass
+
+
+_trailing_zeros = re.compile(r'\.0*\s*$')
+
+
+def integer(value):
+    # Same rules as IntegerField: ints, numeric strings and floats without a fraction
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and len(value) > IntegerField.MAX_STRING_LENGTH:
+        raise Invalid()
+    try:
+        return int(_trailing_zeros.sub('', str(value)))
+    except (TypeError, ValueError):
+        raise Invalid()
+
+
+def nullable_string(value):
+    # Same rules as CharField(allow_null=True): trimmed, not blank, no booleans or containers
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise Invalid()
+    text = str(value).strip()
+    if not text:
+        raise Invalid()
+    return text
+
+
+def timestamp(value):
+    # Same rules as DateTimeField for datetime input: naive values are in the current timezone, UTC is rendered as Z
+    if not isinstance(value, datetime):
+        raise Invalid()
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    else:
+        value = timezone.localtime(value)
+    text = value.isoformat()
+    return text[:-6] + 'Z' if text.endswith('+00:00') else text
+
+
+def many(convert):
+    def convert_many(values):
+        if type(values) not in (list, tuple):
+            raise Invalid()
+        return [convert(value) for value in values]
+    return convert_many
+
+
+def record(**fields):
+    compiled = tuple(fields.items())
+
+    def convert_record(data):
+        if type(data) is not dict:
+            raise Invalid()
+        try:
+            return {name: convert(data[name]) for name, convert in compiled}
+        except KeyError:
+            raise Invalid()
+    return convert_record
+
+
+transaction_input = record(address=nullable_string, value=integer)
+transaction_output = record(address=nullable_string, value=integer)
+transaction = record(inputs=many(transaction_input), outputs=many(transaction_output), timestamp=timestamp)
+transactions = record(transactions=many(transaction))
+
+
+def checked(convert, serializer, data, strict):
+    # strict cross-checks every fast path result against the serializer, meant for tests
+    strict = settings.BLOCKCHAIN_CLIENT_STRICT_TRANSFORM if strict is None else strict
+    try:
+        result = convert(data)
+    except Invalid:
+        result = None
+    if result is not None and not strict:
+        return result
+
+    if result is None:
+        serializer.is_valid(raise_exception=True)
+        return serializer.data
+    if not serializer.is_valid() or serializer.data != result:
+        raise AssertionError(f'Fast path output {result} does not match serializer output {serializer.data}')
+    return result
+
+
+def serialize_transaction(data, strict=None):
+    return checked(transaction, TransactionSerializer(data=data), data, strict)
+
+
+def serialize_transactions(data, strict=None):
+    serializer = TransactionsSerializer(data={'transactions': data})
+    return checked(transactions, serializer, {'transactions': data}, strict)
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from api.metrics.registry import span
+from .exceptions import Saturated, UpstreamTimeout, UpstreamUnavailable
+from .resilience import AdaptiveTimeout
+
+
+def host_of(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+class Transport:
+    # Keep-alive HTTP layer shared by all handlers. Every upstream host gets its own pooled session,
+    # so TCP/TLS handshakes are paid once per connection instead of once per request.
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, max_concurrency=None,
+                 adaptive_timeout=None):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # read_timeout is the upper bound of adaptive read timeouts
+        self.timeouts = adaptive_timeout or AdaptiveTimeout(max_read=read_timeout, enabled=False)
+        # Global cap of in-flight requests per host within the worker, shared by all threads
+        self.max_concurrency = max_concurrency or pool_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sessions = {}
+        self._slots = {}
+
+    def session(self, host):
+        with self._lock:
+            # Connections must never be shared with a forked parent (e.g. gunicorn master), so pools are per process
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._sessions = {}
+                self._slots = {}
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(f'{host}/', adapter)
+                self._sessions[host] = session
+                self._slots[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._sessions[host]
+
+    def slots(self, host):
+        self.session(host)
+        with self._lock:
+            return self._slots[host]
+
+    def get(self, url, params=None, stream=False):
+        # With stream, the body is read as it is consumed (response.iter_content), after the request slot is released
+        host = host_of(url)
+        session = self.session(host)
+        slots = self.slots(host)
+        if not slots.acquire(timeout=self.read_timeout):
+            raise Saturated()
+        read_timeout = self.timeouts.read(host)
+        started = time.monotonic()
+        try:
+            with span('upstream'):
+                response = session.get(url, params=params, timeout=(self.connect_timeout, read_timeout), stream=stream)
+            self.timeouts.record(host, time.monotonic() - started)
+            return response
+        except requests.Timeout:
+            self.timeouts.record(host, read_timeout)
+            raise UpstreamTimeout()
+        except requests.ConnectionError:
+            raise UpstreamUnavailable()
+        finally:
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            sessions = dict(self._sessions) if self._pid == os.getpid() else {}
+        result = {}
+        for host, session in sessions.items():
+            pools = session.get_adapter(f'{host}/').poolmanager.pools
+            connection_pools = [pools[key] for key in pools.keys()]
+            requests_made = sum(pool.num_requests for pool in connection_pools)
+            connections = sum(pool.num_connections for pool in connection_pools)
+            result[host] = {
+                'requests': requests_made,
+                'connections': connections,
+                'reused': requests_made - connections,
+            }
+        return result
+
+
+class AsyncTransport:
+    # Same as Transport for the async (ASGI) path. One client per upstream host and event loop, a single worker
+    # can keep up to max_connections requests per host in flight while waiting on the loop instead of on threads.
+    # Clients belong to their loop and are closed with it (see loop_clients).
+
+    def __init__(self, max_connections=100, keepalive_connections=10, connect_timeout=3.05, read_timeout=10,
+                 adaptive_timeout=None):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=keepalive_connections)
+        self.connect_timeout = connect_timeout
+        self.timeouts = adaptive_timeout or AdaptiveTimeout(max_read=read_timeout, enabled=False)
+        self._lock = threading.Lock()
+        self._loops = weakref.WeakKeyDictionary()
+
+    def timeout(self, host):
+        # Waiting for a free connection counts as 'pool' time and is bounded like a read
+        return httpx.Timeout(self.timeouts.read(host), connect=self.connect_timeout)
+
+    async def loop_clients(self):
+        # Clients of the running loop, held by an async generator of that loop: loops are shut down with
+        # shutdown_asyncgens (asyncio.run, asgiref's async_to_sync, ASGI servers), which closes their clients
+        clients = {}
+        try:
+            while True:
+                yield clients
+        finally:
+            for client in clients.values():
+                await client.aclose()
+
+    async def client(self, host):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._loops.get(loop)
+            # Loops closed without shutting down their generators cannot close their clients anymore
+            for closed in [other for other in self._loops.keys() if other.is_closed()]:
+                del self._loops[closed]
+        if entry is None:
+            generator = self.loop_clients()
+            entry = (generator, await generator.__anext__())
+            with self._lock:
+                self._loops[loop] = entry
+        clients = entry[1]
+        if host not in clients:
+            clients[host] = httpx.AsyncClient(limits=self.limits)
+        return clients[host]
+
+    async def aclose(self):
+        # Closes the clients of the running loop
+        with self._lock:
+            entry = self._loops.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+    async def get(self, url, params=None):
+        host = host_of(url)
+        timeout = self.timeout(host)
+        client = await self.client(host)
+        started = time.monotonic()
+        try:
+            with span('upstream'):
+                response = await client.get(url, params=params, timeout=timeout)
+            self.timeouts.record(host, time.monotonic() - started)
+            return response
+        except httpx.PoolTimeout:
+            # Waited for one of this worker's connections, not for the upstream
+            raise Saturated()
+        except httpx.TimeoutException:
+            self.timeouts.record(host, timeout.read)
+            raise UpstreamTimeout()
+        except httpx.TransportError:
+            raise UpstreamUnavailable()
@@ -0,0 +1,79 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.http.response import HttpResponseBase
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotAuthenticated
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from api.blockchain_client.async_client import AsyncBlockchainClient
+from api.blockchain_client.client import BlockchainClient
+from .conditional import conditional_response, transaction_cache_control, transactions_page_cache_control
+from .models import AddressSearch, TransactionSearch
+from .search_log import sink
+from .validation import validate_address, validate_tx_hash
+from .views import AddressTransactionsView, scanning_sequentially
+
+# Async (ASGI) variants of the upstream bound views, selected with ASYNC_VIEWS.
+# DRF views are sync only, so authentication and error rendering follow the DRF defaults by hand.
+
+
+def authenticate(request):
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    if not IsAuthenticated().has_permission(drf_request, None):
+        raise NotAuthenticated()
+    return drf_request.user
+
+
+def render(data, content=None, status=200):
+    # content is data already rendered, e.g. for its ETag
+    return HttpResponse(JSONRenderer().render(data) if content is None else content, status=status,
+                        content_type='application/json')
+
+
+def async_api_view(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method != 'GET':
+                raise MethodNotAllowed(request.method)
+            request.user = await sync_to_async(authenticate)(request)
+            result = await view(request, *args, **kwargs)
+            return result if isinstance(result, HttpResponseBase) else render(result)
+        except APIException as e:
+            return render(e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail}, status=e.status_code)
+    return wrapper
+
+
+@async_api_view
+async def address_transactions(request, crypto, address):
+    validate_address(crypto, address)
+    page = AddressTransactionsView.get_page(request.GET)
+    size = AddressTransactionsView.get_page_size(request.GET)
+    transactions = await AsyncBlockchainClient.transactions_for_address(
+        crypto=crypto,
+        address=address,
+        page=page,
+        size=size
+    )
+    if scanning_sequentially(request.user, crypto, address, page, size):
+        BlockchainClient.prefetch_transactions(crypto, address, page + 1, size)
+    await sync_to_async(sink.record)(AddressSearch(
+        crypto=crypto,
+        address=address,
+        page=page,
+        size=size,
+        creator=request.user
+    ))
+    return conditional_response(request, transactions, render, cache_control=transactions_page_cache_control())
+
+
+@async_api_view
+async def transaction(request, crypto, tx):
+    validate_tx_hash(crypto, tx)
+    await sync_to_async(sink.record)(TransactionSearch(crypto=crypto, transaction=tx, creator=request.user))
+    entry = await AsyncBlockchainClient.transaction_entry(crypto=crypto, tx=tx)
+    return conditional_response(request, entry.data, render, etag=entry.etag, cache_control=transaction_cache_control(entry))
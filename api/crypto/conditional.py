@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from api.blockchain_client.streaming import rendered_etag
+
+# Conditional GET: responses carry the content hash of their data as ETag, a request whose If-None-Match holds it
+# is answered with an empty 304 instead of rendering the data again. Every response is for an authenticated user,
+# so they are all private: shared caches must not keep them. Without an ETag at hand (e.g. from the cache)
+# the data is rendered once, the hash is taken of the body that is sent.
+
+REVALIDATE = 'private, no-cache'
+
+
+def weak(etag):
+    # Compression middleware weakens ETags, If-None-Match uses the weak comparison anyway
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def not_modified(request, etag):
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return '*' in etags or weak(etag) in {weak(e) for e in etags}
+
+
+class RenderedResponse(Response):
+    # DRF response whose JSON rendering is already made, other renderers (the browsable API) still render data
+
+    def __init__(self, data, content=None, **kwargs):
+        super().__init__(data, **kwargs)
+        self.content_json = content
+
+    @property
+    def rendered_content(self):
+        if self.content_json is None or self.accepted_media_type != JSONRenderer.media_type:
+            return super().rendered_content
+        self['Content-Type'] = self.content_type or JSONRenderer.media_type
+        return self.content_json
+
+
+def conditional_response(request, data, render, etag=None, cache_control=REVALIDATE):
+    # render(data, content) builds the full response, content is the JSON rendering of data when it was made
+    # for the content hash (etag not given), None otherwise
+    content = None
+    if etag is None:
+        content = JSONRenderer().render(data)
+        etag = rendered_etag(content)
+    response = HttpResponseNotModified() if not_modified(request, etag) else render(data, content)
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def transaction_cache_control(entry):
+    # Confirmed transactions never change
+    if entry.confirmed:
+        return f'private, max-age={settings.CONFIRMED_TRANSACTION_MAX_AGE}, immutable'
+    return f'private, max-age={settings.BLOCKCHAIN_CLIENT_UNCONFIRMED_TX_TTL}'
+
+
+def transactions_page_cache_control():
+    # Pages shift as new transactions come in, they are as fresh as the page cache
+    ttl = settings.BLOCKCHAIN_CLIENT_TX_PAGE_TTL
+    return f'private, max-age={ttl}' if ttl else REVALIDATE
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.10 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crypto', '0002_address'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='addresssearch',
+            index=models.Index(fields=['creator', '-created', '-id'], name='addresssearch_creator_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionsearch',
+            index=models.Index(fields=['creator', '-created', '-id'], name='txsearch_creator_created'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.10 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crypto', '0003_search_creator_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='balance_queried',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.10 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crypto', '0004_address_balance_queried'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexedAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('crypto', models.CharField(choices=[('btc', 'btc'), ('eth', 'eth'), ('bch', 'bch')], max_length=10)),
+                ('address', models.CharField(max_length=200)),
+                ('synced', models.DateTimeField(blank=True, null=True)),
+                ('complete', models.BooleanField(default=False)),
+            ],
+            options={
+                'unique_together': {('crypto', 'address')},
+            },
+        ),
+        migrations.CreateModel(
+            name='IndexedTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('crypto', models.CharField(choices=[('btc', 'btc'), ('eth', 'eth'), ('bch', 'bch')], max_length=10)),
+                ('hash', models.CharField(max_length=200)),
+                ('data', models.JSONField()),
+                ('confirmed', models.BooleanField(default=False)),
+            ],
+            options={
+                'unique_together': {('crypto', 'hash')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AddressTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('indexed_address', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='crypto.indexedaddress')),
+                ('transaction', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to='crypto.indexedtransaction')),
+            ],
+            options={
+                'unique_together': {('indexed_address', 'position'), ('indexed_address', 'transaction')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.10 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crypto', '0005_transaction_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='seen_hash',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+    ]
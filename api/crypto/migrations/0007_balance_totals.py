@@ -0,0 +1,37 @@
+# Generated by Django 3.1.10 on 2026-10-18 21:05
+
+import api.crypto.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crypto', '0006_address_seen_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='balance',
+            field=api.crypto.models.IntegerStringField(blank=True, max_length=80, null=True),
+        ),
+        migrations.CreateModel(
+            name='BalanceTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('crypto', models.CharField(choices=[('btc', 'btc'), ('eth', 'eth'), ('bch', 'bch')], max_length=10)),
+                ('balance', api.crypto.models.IntegerStringField(default=0, max_length=80)),
+                ('addresses', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('owner', 'crypto')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.10 on 2026-10-18 22:40
+
+import api.crypto.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crypto', '0007_balance_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('balance', api.crypto.models.IntegerStringField(max_length=80)),
+                ('address', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                              related_name='snapshots', to='crypto.address')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['address', 'timestamp'], name='balancesnapshot_address_time'),
+        ),
+    ]
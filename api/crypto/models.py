@@ -8,10 +8,29 @@ from project.crypto_currencies import CryptoCurrency
 UserModel = get_user_model()
 
 
+class IntegerStringField(models.CharField):
+    # Integers of any size (balances in wei do not fit a bigint) stored as their decimal digits. Decimal columns
+    # are not exact on every database (SQLite rounds them past int64), text is.
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else int(value)
+
+    def to_python(self, value):
+        return None if value is None else int(value)
+
+    def get_prep_value(self, value):
+        return None if value is None else str(int(value))
+
+
 class Address(models.Model):
     crypto = models.CharField(max_length=10, choices=[(v.value, v.value) for v in CryptoCurrency])
     address = models.CharField(max_length=200)
     owner = models.ForeignKey(to=get_user_model(), on_delete=models.deletion.CASCADE)
+    # Last time the owner asked for the balance (within BALANCE_QUERIED_RESOLUTION), refresh_balances goes by it
+    balance_queried = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Newest transaction the owner has seen (see /my/transactions/new/), set to the newest one on the first sync
+    seen_hash = models.CharField(max_length=200, null=True, blank=True)
+    # Last balance fetched for the address (in the smallest unit), see BalanceTotal
+    balance = IntegerStringField(max_length=80, null=True, blank=True)
 
     class Meta:
         # Technically, one address should have one owner, but since this is
@@ -27,9 +46,78 @@ class AddressSearch(models.Model):
     creator = models.ForeignKey(to=UserModel, on_delete=models.deletion.CASCADE)
     created = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # Search history is always listed per creator, newest first
+        indexes = [models.Index(fields=['creator', '-created', '-id'], name='addresssearch_creator_created')]
+
 
 class TransactionSearch(models.Model):
     transaction = models.CharField(max_length=200)  # TODO: random number, would need to look into hash lengths
     crypto = models.CharField(max_length=10, choices=[(v.value, v.value) for v in CryptoCurrency])
     creator = models.ForeignKey(to=UserModel, on_delete=models.deletion.CASCADE)
     created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['creator', '-created', '-id'], name='txsearch_creator_created')]
+
+
+class IndexedTransaction(models.Model):
+    # Serialized transactions (the common format) kept by the blockchain client's transaction index
+    crypto = models.CharField(max_length=10, choices=[(v.value, v.value) for v in CryptoCurrency])
+    hash = models.CharField(max_length=200)
+    data = models.JSONField()
+    confirmed = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (('crypto', 'hash'),)
+
+
+class IndexedAddress(models.Model):
+    # Address whose history is (partially) indexed: its newest transactions, all of them once complete
+    crypto = models.CharField(max_length=10, choices=[(v.value, v.value) for v in CryptoCurrency])
+    address = models.CharField(max_length=200)
+    # Last time the newest transactions were fetched from upstream
+    synced = models.DateTimeField(null=True, blank=True)
+    complete = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = (('crypto', 'address'),)
+
+
+class AddressTransaction(models.Model):
+    # History of an indexed address, newest first by position. Newer transactions get lower positions,
+    # so the history grows at both ends without renumbering.
+    indexed_address = models.ForeignKey(to=IndexedAddress, on_delete=models.deletion.CASCADE,
+                                        related_name='transactions')
+    transaction = models.ForeignKey(to=IndexedTransaction, on_delete=models.deletion.CASCADE)
+    position = models.IntegerField()
+
+    class Meta:
+        unique_together = (('indexed_address', 'position'), ('indexed_address', 'transaction'))
+
+
+class BalanceTotal(models.Model):
+    # Sum of the last fetched balances of an owner's addresses of one cryptocurrency, kept up to date as balances
+    # are fetched (see api/personal/totals.py)
+    owner = models.ForeignKey(to=UserModel, on_delete=models.deletion.CASCADE)
+    crypto = models.CharField(max_length=10, choices=[(v.value, v.value) for v in CryptoCurrency])
+    balance = IntegerStringField(max_length=80, default=0)
+    # Addresses with a known balance
+    addresses = models.IntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (('owner', 'crypto'),)
+
+
+class BalanceSnapshot(models.Model):
+    # Append-only history of the fetched balances of an address, a snapshot is only added when the balance changed
+    # (see api/personal/totals.py). Its balance holds until the next snapshot of the address.
+    # The composite index serves the range scans of one address, so the foreign key does not get its own.
+    address = models.ForeignKey(to=Address, on_delete=models.deletion.CASCADE, db_index=False,
+                                related_name='snapshots')
+    timestamp = models.DateTimeField(default=timezone.now)
+    balance = IntegerStringField(max_length=80)
+
+    class Meta:
+        indexes = [models.Index(fields=['address', 'timestamp'], name='balancesnapshot_address_time')]
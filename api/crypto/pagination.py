@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class SearchLogCursorPagination(CursorPagination):
+    # Keyset pagination over the (creator, -created, -id) index, no COUNT and no OFFSET scans on deep pages
+    page_size = settings.SEARCH_LOG_PAGE_SIZE
+    ordering = ('-created', '-id')
+
+
+class SearchLogPageNumberPagination(PageNumberPagination):
+    page_size = settings.SEARCH_LOG_PAGE_SIZE
+
+
+class BalanceCursorPagination(CursorPagination):
+    # Keyset pagination over my addresses, only the balances of a page are fetched
+    page_size_query_param = 'size'
+    ordering = ('id',)
+
+    def __init__(self):
+        self.page_size = settings.MY_BALANCES_PAGE_SIZE
+        self.max_page_size = settings.MY_BALANCES_MAX_PAGE_SIZE
@@ -0,0 +1,74 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from api.metrics.registry import span
+
+SYNC = 'sync'
+BUFFERED = 'buffered'
+
+
+class SearchLogSink:
+    # Write path for AddressSearch/TransactionSearch entries, see SEARCH_LOG_MODE in settings for durability modes.
+    # In buffered mode entries are kept in memory and written with bulk_create by a background thread,
+    # either every SEARCH_LOG_FLUSH_INTERVAL seconds or as soon as SEARCH_LOG_BATCH_SIZE entries are waiting.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, entry):
+        if settings.SEARCH_LOG_MODE == SYNC:
+            with span('search_log'):
+                entry.save()
+            return
+
+        with self._lock:
+            self._ensure_flusher()
+            self._buffer.append(entry)
+            full = len(self._buffer) >= settings.SEARCH_LOG_BATCH_SIZE
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+
+        by_model = {}
+        for entry in entries:
+            by_model.setdefault(type(entry), []).append(entry)
+        for model, objects in by_model.items():
+            try:
+                with span('search_log_flush', endpoint='search-log-flusher'):
+                    model.objects.bulk_create(objects, batch_size=settings.SEARCH_LOG_BATCH_SIZE)
+            except DatabaseError:
+                logging.exception(f'Failed to write {len(objects)} {model.__name__} entries')
+        return len(entries)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        # Threads do not survive a fork, and the parent's buffer is not ours to write
+        self._pid = os.getpid()
+        self._buffer = []
+        self._thread = threading.Thread(target=self._run, name='search-log-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.SEARCH_LOG_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+sink = SearchLogSink()
+# Gunicorn workers exit through sys.exit on graceful shutdown, which runs atexit hooks
+atexit.register(sink.flush)
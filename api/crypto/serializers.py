@@ -1,14 +1,34 @@
-from rest_framework.serializers import ModelSerializer
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import CharField, IntegerField, ListField
+from rest_framework.serializers import ModelSerializer, Serializer
 
-from .models import AddressSearch, TransactionSearch, Address
+from .models import AddressSearch, TransactionSearch, Address, BalanceTotal
+from .validation import validate_address
 
 
 class AddressSerializer(ModelSerializer):
     class Meta:
         model = Address
-        fields = '__all__'
+        exclude = ['balance_queried', 'seen_hash', 'balance']
         extra_kwargs = {'owner': {'write_only': True}}
 
+    def validate(self, attrs):
+        try:
+            validate_address(attrs.get('crypto'), attrs.get('address'))
+        except ValidationError as e:
+            raise ValidationError({'address': e.detail})
+        return super().validate(attrs)
+
+
+class BalanceTotalSerializer(ModelSerializer):
+    # Same integer balances as AddressWithBalance
+    balance = IntegerField()
+
+    class Meta:
+        model = BalanceTotal
+        fields = ['crypto', 'balance', 'addresses', 'updated']
+
 
 class AddressSearchSerializer(ModelSerializer):
     class Meta:
@@ -20,3 +40,10 @@ class TransactionSearchSerializer(ModelSerializer):
     class Meta:
         model = TransactionSearch
         fields = '__all__'
+
+
+class AddressListSerializer(Serializer):
+    addresses = ListField(
+        child=CharField(max_length=200),
+        allow_empty=False,
+        max_length=settings.ADDRESS_BALANCES_MAX_ADDRESSES)
@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase, RequestFactory
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, \
+    HTTP_400_BAD_REQUEST
+
+from api.blockchain_client.cache import TransactionEntry
+from api.personal.async_views import my_balances
+from ..async_views import address_transactions, transaction
+from ..models import Address, AddressSearch, TransactionSearch
+
+ADDRESS = 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'
+TX = '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'
+
+
+class TestAsyncViews(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='async-user', password='pass')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def tearDown(self):
+        self.user.delete()
+
+    @patch('api.blockchain_client.async_client.AsyncBlockchainClient.transactions_for_address')
+    def test_address_transactions_should_query_client_and_log_search(self, mock):
+        mock.return_value = {'transactions': []}
+        response = async_to_sync(address_transactions)(
+            self.factory.get('/', {'page': 3}), crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.content, b'{"transactions":[]}')
+        mock.assert_awaited_once_with(
+            crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', page=3, size=50)
+        self.assertTrue(AddressSearch.objects.filter(creator=self.user, page=3).exists())
+
+    @patch('api.blockchain_client.async_client.AsyncBlockchainClient.transaction_entry')
+    def test_transaction_should_render_api_errors(self, mock):
+        mock.side_effect = NotFound(f'Transaction \'{TX}\' does not exist.')
+        response = async_to_sync(transaction)(self.factory.get('/'), crypto='bch', tx=TX)
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(response.content, f'{{"detail":"Transaction \'{TX}\' does not exist."}}'.encode())
+        self.assertTrue(TransactionSearch.objects.filter(creator=self.user, transaction=TX).exists())
+
+    @patch('api.blockchain_client.async_client.AsyncBlockchainClient.transaction_entry')
+    def test_transaction_should_answer_matching_etag_with_304(self, mock):
+        mock.return_value = TransactionEntry(data={'hash': 'tx'}, confirmed=True, expires=None, etag='"etag"')
+        response = async_to_sync(transaction)(self.factory.get('/'), crypto='btc', tx=TX)
+        self.assertEqual(response.content, b'{"hash":"tx"}')
+        self.assertEqual(response['ETag'], '"etag"')
+        response = async_to_sync(transaction)(self.factory.get('/', HTTP_IF_NONE_MATCH='"etag"'), crypto='btc', tx=TX)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    def test_should_reject_negative_pages(self):
+        response = async_to_sync(address_transactions)(self.factory.get('/', {'page': -1}), crypto='btc', address=ADDRESS)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_should_reject_malformed_pages(self):
+        response = async_to_sync(address_transactions)(self.factory.get('/', {'page': 'x'}), crypto='btc', address=ADDRESS)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.content, b'{"detail":"\'page\' must be a number"}')
+
+    def test_should_require_authentication(self):
+        response = async_to_sync(transaction)(RequestFactory().get('/'), crypto='bch', tx=TX)
+        self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
+
+    @patch('api.blockchain_client.async_client.AsyncBlockchainClient.balances')
+    def test_my_balances_should_query_my_addresses_in_order(self, mock):
+        Address(crypto='eth', address='second', owner=self.user).save()
+        Address(crypto='btc', address='first', owner=self.user).save()
+        mock.return_value = []
+        response = async_to_sync(my_balances)(self.factory.get('/'))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        mock.assert_awaited_once_with([('eth', 'second'), ('btc', 'first')])
@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.status import HTTP_200_OK
+from rest_framework.test import APIClient
+
+from api.blockchain_client.cache import TransactionEntry
+from ..models import AddressSearch, TransactionSearch
+from ..search_log import SearchLogSink
+from .test_search_views import TX
+
+
+@override_settings(SEARCH_LOG_MODE='buffered', SEARCH_LOG_BATCH_SIZE=1000, SEARCH_LOG_FLUSH_INTERVAL=3600)
+class TestBufferedSearchLog(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='buffered-log', password='pass')
+        self.sink = SearchLogSink()
+
+    def tearDown(self):
+        self.user.delete()
+
+    def test_should_write_entries_only_on_flush(self):
+        self.sink.record(AddressSearch(address='a', crypto='btc', page=0, size=50, creator=self.user))
+        self.sink.record(TransactionSearch(transaction='tx', crypto='btc', creator=self.user))
+        self.sink.record(AddressSearch(address='b', crypto='btc', page=1, size=50, creator=self.user))
+        self.assertFalse(AddressSearch.objects.filter(creator=self.user).exists())
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.sink.flush(), 3)
+        self.assertListEqual(
+            list(AddressSearch.objects.filter(creator=self.user).values_list('address', flat=True)), ['a', 'b'])
+        self.assertTrue(TransactionSearch.objects.filter(creator=self.user, transaction='tx').exists())
+        self.assertEqual(self.sink.flush(), 0)
+
+    def test_should_wake_flusher_when_batch_is_full(self):
+        # The flusher thread is kept out, it would spin on the mocked event
+        with override_settings(SEARCH_LOG_BATCH_SIZE=2), patch.object(self.sink, '_ensure_flusher'), \
+                patch.object(self.sink, '_wakeup') as wakeup:
+            self.sink.record(AddressSearch(address='a', crypto='btc', page=0, size=50, creator=self.user))
+            wakeup.set.assert_not_called()
+            self.sink.record(AddressSearch(address='b', crypto='btc', page=0, size=50, creator=self.user))
+            wakeup.set.assert_called_once()
+        self.sink.flush()
+
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
+    def test_view_should_not_write_search_on_request_path(self, mock):
+        token, _ = Token.objects.get_or_create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        mock.return_value = TransactionEntry(data=[], confirmed=True, expires=None)
+        with patch('api.crypto.views.sink', self.sink):
+            response = client.get(reverse('transaction-detail', kwargs={'crypto': 'bch', 'tx': TX}))
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertFalse(TransactionSearch.objects.filter(transaction=TX).exists())
+            self.sink.flush()
+        self.assertTrue(TransactionSearch.objects.filter(transaction=TX, creator=self.user).exists())
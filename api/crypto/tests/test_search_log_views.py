@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
@@ -34,7 +36,8 @@ class TestAddressTransactions(TestCase):
         response = self.client.get(reverse('address-transactions-log'))
 
         self.assertEqual(response.status_code, HTTP_200_OK)
-        self.assertListEqual(response.data, AddressSearchSerializer(many=True).to_representation(expected))
+        self.assertListEqual(response.data['results'],
+                             AddressSearchSerializer(many=True).to_representation(reversed(expected)))
         another_user.delete()
 
     def test_should_list_past_transaction_searches(self):
@@ -51,5 +54,30 @@ class TestAddressTransactions(TestCase):
 
         response = self.client.get(reverse('transaction-log'))
         self.assertEqual(response.status_code, HTTP_200_OK)
-        self.assertListEqual(response.data, TransactionSearchSerializer(many=True).to_representation(expected))
+        self.assertListEqual(response.data['results'],
+                             TransactionSearchSerializer(many=True).to_representation(reversed(expected)))
         another_user.delete()
+
+    def test_should_page_searches_with_cursor_without_counting(self):
+        for i in range(5):
+            AddressSearch.objects.create(address=f'address{i}', crypto='btc', page=0, size=50, creator=self.user)
+        with patch('api.crypto.pagination.SearchLogCursorPagination.page_size', 2):
+            with self.assertNumQueries(2):  # token lookup + page
+                first = self.client.get(reverse('address-transactions-log'))
+            second = self.client.get(first.data['next'])
+            third = self.client.get(second.data['next'])
+
+        self.assertNotIn('count', first.data)
+        pages = [first.data['results'], second.data['results'], third.data['results']]
+        self.assertListEqual([[log['address'] for log in page] for page in pages],
+                             [['address4', 'address3'], ['address2', 'address1'], ['address0']])
+        self.assertIsNone(third.data['next'])
+
+    def test_should_allow_page_number_pagination(self):
+        for i in range(3):
+            TransactionSearch.objects.create(transaction=f'tx{i}', crypto='btc', creator=self.user)
+        with patch('api.crypto.pagination.SearchLogPageNumberPagination.page_size', 2):
+            response = self.client.get(reverse('transaction-log'), {'page': 2})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertListEqual([log['transaction'] for log in response.data['results']], ['tx0'])
@@ -1,13 +1,22 @@
 from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework.authtoken.models import Token
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_200_OK
+from rest_framework.renderers import JSONRenderer
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_200_OK, HTTP_304_NOT_MODIFIED
 from rest_framework.test import APIClient
 
+from api.blockchain_client.cache import TransactionEntry
+from api.blockchain_client.streaming import rendered_etag
 from ..models import AddressSearch, TransactionSearch
+from ..views import last_pages
+
+ADDRESS = '1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv'
+BCH_ADDRESS = 'qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2y'
+TX = '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'
 
 
 class TestAddressTransactions(TestCase):
@@ -20,11 +29,11 @@ class TestAddressTransactions(TestCase):
     def tearDown(self):
         self.user.delete()
 
-    @patch('api.blockchain_client.client.BlockchainClient.transaction')
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
     def test_transaction_detail_should_allow_btc(self, mock):
         tx = '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'
         url = reverse('transaction-detail', kwargs={'crypto': 'btc', 'tx': tx})
-        mock.return_value = []
+        mock.return_value = TransactionEntry(data=[], confirmed=True, expires=None)
         response = self.client.get(url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         mock.assert_called_once_with(crypto='btc', tx=tx)
@@ -42,11 +51,11 @@ class TestAddressTransactions(TestCase):
             page=0,
             size=50)
 
-    @patch('api.blockchain_client.client.BlockchainClient.transaction')
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
     def test_transaction_detail_should_allow_eth(self, mock):
         tx = '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'
         url = reverse('transaction-detail', kwargs={'crypto': 'eth', 'tx': tx})
-        mock.return_value = []
+        mock.return_value = TransactionEntry(data=[], confirmed=True, expires=None)
         response = self.client.get(url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         mock.assert_called_once_with(crypto='eth', tx=tx)
@@ -64,11 +73,11 @@ class TestAddressTransactions(TestCase):
             page=1,
             size=50)
 
-    @patch('api.blockchain_client.client.BlockchainClient.transaction')
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
     def test_transaction_detail_should_allow_bch(self, mock):
         tx = '5aaa2ecc901a6d42fa27eb7ca1535df76ffc75416dd54180c4f9034b9c6d4dc5'
         url = reverse('transaction-detail', kwargs={'crypto': 'bch', 'tx': tx})
-        mock.return_value = []
+        mock.return_value = TransactionEntry(data=[], confirmed=True, expires=None)
         response = self.client.get(url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         mock.assert_called_once_with(crypto='bch', tx=tx)
@@ -102,21 +111,112 @@ class TestAddressTransactions(TestCase):
     @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
     def test_should_create_address_search_log(self, mock):
         url = reverse('address-transactions',
-                      kwargs={'crypto': 'bch', 'address': 'searchlog'})
+                      kwargs={'crypto': 'bch', 'address': BCH_ADDRESS})
         mock.return_value = {'transactions': []}
-        self.assertFalse(AddressSearch.objects.filter(crypto='bch', address='searchlog', creator=self.user).exists())
+        self.assertFalse(AddressSearch.objects.filter(crypto='bch', address=BCH_ADDRESS, creator=self.user).exists())
         response = self.client.get(url)
         self.assertEqual(response.status_code, HTTP_200_OK)
-        self.assertTrue(AddressSearch.objects.filter(crypto='bch', address='searchlog', creator=self.user).exists())
+        self.assertTrue(AddressSearch.objects.filter(crypto='bch', address=BCH_ADDRESS, creator=self.user).exists())
 
-    @patch('api.blockchain_client.client.BlockchainClient.transaction')
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
     def test_should_create_transaction_search_log(self, mock):
-        url = reverse('transaction-detail', kwargs={'crypto': 'bch', 'tx': 'searchlog'})
-        mock.return_value = []
-        self.assertFalse(TransactionSearch.objects.filter(crypto='bch', transaction='searchlog', creator=self.user).exists())
+        url = reverse('transaction-detail', kwargs={'crypto': 'bch', 'tx': TX})
+        mock.return_value = TransactionEntry(data=[], confirmed=True, expires=None)
+        self.assertFalse(TransactionSearch.objects.filter(crypto='bch', transaction=TX, creator=self.user).exists())
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(TransactionSearch.objects.filter(crypto='bch', transaction=TX, creator=self.user).exists())
+
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_address_search_should_take_page_size(self, mock):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        mock.return_value = {'transactions': []}
+        self.assertEqual(self.client.get(url, {'size': 10}).status_code, HTTP_200_OK)
+        mock.assert_called_with(crypto='btc', address=ADDRESS, page=0, size=10)
+        # Larger sizes are clamped
+        self.assertEqual(self.client.get(url, {'size': 100000}).status_code, HTTP_200_OK)
+        mock.assert_called_with(crypto='btc', address=ADDRESS, page=0, size=settings.ADDRESS_TRANSACTIONS_MAX_PAGE_SIZE)
+
+    def test_should_NOT_allow_invalid_page_sizes(self):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        response = self.client.get(url, {'size': 0})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(response.data, {'detail': '\'size\' must be positive'})
+        response = self.client.get(url, {'size': 'all'})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(response.data, {'detail': '\'size\' must be a number'})
+
+    @patch('api.blockchain_client.client.BlockchainClient.prefetch_transactions')
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_sequential_pages_should_prefetch_the_next_one(self, mock, prefetch):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        mock.return_value = {'transactions': []}
+        last_pages.clear()
+        self.client.get(url, {'page': 1, 'size': 10})
+        prefetch.assert_not_called()
+        self.client.get(url, {'page': 2, 'size': 10})
+        prefetch.assert_called_once_with('btc', ADDRESS, 3, 10)
+        # Jumping around is not a scan
+        self.client.get(url, {'page': 7, 'size': 10})
+        self.assertEqual(prefetch.call_count, 1)
+
+    @patch('api.crypto.views.sink.record')
+    @patch('api.blockchain_client.client.BlockchainClient.prefetch_transactions')
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_sequential_pages_should_be_detected_before_the_search_log_is_written(self, mock, prefetch, record):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        mock.return_value = {'transactions': []}
+        last_pages.clear()
+        self.client.get(url, {'page': 0, 'size': 10})
+        self.client.get(url, {'page': 1, 'size': 10})
+        prefetch.assert_called_once_with('btc', ADDRESS, 2, 10)
+        self.assertFalse(AddressSearch.objects.exists())
+
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
+    def test_transaction_detail_should_answer_matching_etag_with_304(self, mock):
+        url = reverse('transaction-detail', kwargs={'crypto': 'btc', 'tx': TX})
+        mock.return_value = TransactionEntry(data={'hash': 'tx'}, confirmed=True, expires=None, etag='"etag"')
         response = self.client.get(url)
+        self.assertEqual(response['ETag'], '"etag"')
+        self.assertEqual(response['Cache-Control'],
+                         f'private, max-age={settings.CONFIRMED_TRANSACTION_MAX_AGE}, immutable')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"other", W/"etag"')
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        # Searches are logged all the same
+        self.assertEqual(TransactionSearch.objects.filter(transaction=TX, creator=self.user).count(), 2)
+
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
+    def test_unconfirmed_transaction_should_be_private(self, mock):
+        url = reverse('transaction-detail', kwargs={'crypto': 'btc', 'tx': TX})
+        mock.return_value = TransactionEntry(data={'hash': 'tx'}, confirmed=False, expires=None)
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], f'private, max-age={settings.BLOCKCHAIN_CLIENT_UNCONFIRMED_TX_TTL}')
+        # Without an ETag from the cache the content hash is used
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_address_search_should_answer_unchanged_page_with_304(self, mock):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        mock.return_value = {'transactions': [{'hash': 'tx'}]}
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, HTTP_304_NOT_MODIFIED)
+        mock.return_value = {'transactions': [{'hash': 'new'}, {'hash': 'tx'}]}
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
         self.assertEqual(response.status_code, HTTP_200_OK)
-        self.assertTrue(TransactionSearch.objects.filter(crypto='bch', transaction='searchlog', creator=self.user).exists())
+        self.assertNotEqual(response['ETag'], etag)
+
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_address_search_should_render_the_page_once(self, mock):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': ADDRESS})
+        mock.return_value = {'transactions': [{'hash': 'tx'}]}
+        with patch.object(JSONRenderer, 'render', autospec=True, side_effect=JSONRenderer.render) as render:
+            response = self.client.get(url)
+        render.assert_called_once()
+        self.assertEqual(response.content, b'{"transactions":[{"hash":"tx"}]}')
+        self.assertEqual(response['ETag'], rendered_etag(response.content))
+        self.assertEqual(response['Content-Type'], 'application/json')
 
     def test_should_NOT_allow_negative_pages(self):
         url = reverse('address-transactions',
@@ -124,3 +224,18 @@ class TestAddressTransactions(TestCase):
         response = self.client.get(url, {'page': -1})
         self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
         self.assertDictEqual(response.data, {'detail': '\'page\' cannot be negative'})
+
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_address_balances_should_query_all_addresses(self, mock):
+        addresses = ['bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', '1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv']
+        mock.return_value = [{'crypto': 'btc', 'address': address, 'balance': 1} for address in addresses]
+        response = self.client.post(reverse('address-balances', kwargs={'crypto': 'btc'}),
+                                    {'addresses': addresses}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertListEqual(response.data, mock.return_value)
+        mock.assert_called_once_with(crypto='btc', addresses=addresses)
+
+    def test_address_balances_should_NOT_allow_empty_list(self):
+        response = self.client.post(reverse('address-balances', kwargs={'crypto': 'btc'}),
+                                    {'addresses': []}, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
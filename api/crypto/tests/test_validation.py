@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from rest_framework.test import APIClient
+
+from ..models import Address, AddressSearch, TransactionSearch
+from ..validation import is_valid_address, is_valid_tx_hash, keccak256
+
+VALID_ADDRESSES = {
+    'btc': ['1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv', '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy',
+            'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4',
+            'bc1p5d7rjq7g6rdk2yhzks9smlaqtedr4dekq08ge8ztwac72sfr9rusxg3297'],
+    'bch': ['qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2y', 'bitcoincash:ppm2qsznhks23z7629mms6s4cwef74vcwvn0h829pq',
+            '1BpEi6DfDAUFd7GtittLSdBeYJvcoaVggu'],
+    'eth': ['0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e', '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed'],
+}
+INVALID_ADDRESSES = {
+    # Typos in the checksum, other networks, witness version 0 with a Bech32m checksum and mixed case Bech32
+    'btc': ['1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrw', 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224e',
+            'tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx', 'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kemeawh',
+            'Bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4', 'qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2y', 'address'],
+    'bch': ['qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2z', 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'],
+    'eth': ['0x5aaeb6053F3E94C9b9A09f33669435E7Ef1BeAed', '0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744',
+            'aa62dc6cd0123d5bb1e080e61f5fe508b7c8744e'],
+}
+
+
+class TestValidation(SimpleTestCase):
+    def test_keccak256(self):
+        self.assertEqual(keccak256(b'').hex(), 'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470')
+
+    def test_valid_addresses(self):
+        for crypto, addresses in VALID_ADDRESSES.items():
+            for address in addresses:
+                self.assertTrue(is_valid_address(crypto, address), address)
+
+    def test_invalid_addresses(self):
+        for crypto, addresses in INVALID_ADDRESSES.items():
+            for address in addresses:
+                self.assertFalse(is_valid_address(crypto, address), address)
+
+    def test_tx_hashes(self):
+        self.assertTrue(is_valid_tx_hash('btc', '436b9e8e30592024ce5ea618245fe5eeac3d00cc453af9ca0ecb5611c26f59ef'))
+        self.assertTrue(is_valid_tx_hash(
+            'eth', '0x8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'))
+        self.assertFalse(is_valid_tx_hash('bch', '5aaa2ecc901a6d42fa27eb7ca1535df76ffc75416dd54180c4f9034b9c6d4dc'))
+        self.assertFalse(is_valid_tx_hash('eth', '8d3eb0836e0c73ee60c3d89d06d830f8c31c19f47c1dc6fbfc9e02e20852352b'))
+
+
+class TestValidatedViews(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='validated', password='pass')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @patch('api.blockchain_client.client.BlockchainClient.transactions_for_address')
+    def test_invalid_address_should_not_be_looked_up_or_logged(self, mock):
+        url = reverse('address-transactions', kwargs={'crypto': 'btc', 'address': 'bc1qtypo'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertListEqual(response.data, ['\'bc1qtypo\' is not a valid btc address'])
+        mock.assert_not_called()
+        self.assertFalse(AddressSearch.objects.exists())
+
+    @patch('api.blockchain_client.client.BlockchainClient.transaction_entry')
+    def test_invalid_tx_hash_should_not_be_looked_up_or_logged(self, mock):
+        response = self.client.get(reverse('transaction-detail', kwargs={'crypto': 'eth', 'tx': 'typo'}))
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        mock.assert_not_called()
+        self.assertFalse(TransactionSearch.objects.exists())
+
+    def test_my_addresses_should_only_take_valid_addresses(self):
+        response = self.client.post(reverse('my-address'), {'address': 'qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2z',
+                                                            'crypto': 'bch'})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertIn('address', response.data)
+        self.assertFalse(Address.objects.exists())
+
+    @override_settings(VALIDATE_LOOKUPS=False)
+    def test_my_addresses_should_take_anything_when_not_validating(self):
+        response = self.client.post(reverse('my-address'), {'address': 'qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2z',
+                                                            'crypto': 'bch'})
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertTrue(Address.objects.exists())
@@ -1,12 +1,18 @@
+from django.conf import settings
 from django.conf.urls import re_path
 
-from .views import AddressTransactionsView, TransactionsView, AddressSearchView, TransactionSearchView
+from . import async_views
+from .views import AddressTransactionsView, TransactionsView, AddressSearchView, TransactionSearchView, \
+    AddressBalancesView
 
 urlpatterns = [
-    re_path(r'(?P<crypto>(btc|eth|bch))/addresses/(?P<address>\w+)/transactions/$', AddressTransactionsView.as_view(),
+    re_path(r'(?P<crypto>(btc|eth|bch))/addresses/(?P<address>\w+)/transactions/$',
+            async_views.address_transactions if settings.ASYNC_VIEWS else AddressTransactionsView.as_view(),
             name='address-transactions'),
     re_path(r'searches/addresses/$', AddressSearchView.as_view(), name='address-transactions-log'),
-    re_path(r'(?P<crypto>(btc|eth|bch))/transactions/(?P<tx>\w+)/$', TransactionsView.as_view(),
+    re_path(r'(?P<crypto>(btc|eth|bch))/transactions/(?P<tx>\w+)/$',
+            async_views.transaction if settings.ASYNC_VIEWS else TransactionsView.as_view(),
             name='transaction-detail'),
     re_path(r'searches/transactions/$', TransactionSearchView.as_view(), name='transaction-log'),
+    re_path(r'(?P<crypto>(btc|eth|bch))/balances/$', AddressBalancesView.as_view(), name='address-balances'),
 ]
@@ -0,0 +1,157 @@
+import hashlib
+import re
+
+from Crypto.Hash import keccak
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from project.crypto_currencies import CryptoCurrency
+
+# Local checks of addresses and transaction hashes, so that typos are rejected before they cost an upstream
+# round trip. Every format is checked down to its checksum, without any lookup.
+
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BECH32 = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32M_CONST = 0x2bc830a3
+CASHADDR_PREFIX = 'bitcoincash'
+CASHADDR_SIZES = [160, 192, 224, 256, 320, 384, 448, 512]
+
+
+def base58_address(address, versions=(0x00, 0x05)):
+    # Base58Check P2PKH and P2SH addresses: version byte, 20 byte hash and a 4 byte double SHA-256 checksum
+    if not 26 <= len(address) <= 35 or any(char not in BASE58 for char in address):
+        return False
+    number = 0
+    for char in address:
+        number = number * 58 + BASE58.index(char)
+    # Leading '1's stand for zero bytes
+    zeros = len(address) - len(address.lstrip('1'))
+    data = bytes(zeros) + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    if len(data) != 25 or data[0] not in versions:
+        return False
+    return hashlib.sha256(hashlib.sha256(data[:-4]).digest()).digest()[:4] == data[-4:]
+
+
+def bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    check = 1
+    for value in values:
+        top = check >> 25
+        check = (check & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            check ^= generator[i] if (top >> i) & 1 else 0
+    return check
+
+
+def convert_bits(data, source, target):
+    # Regroups `source` bit values to `target` bit values, None if the padding is not zeros
+    value = bits = 0
+    result = []
+    for item in data:
+        value = value << source | item
+        bits += source
+        while bits >= target:
+            bits -= target
+            result.append(value >> bits & (1 << target) - 1)
+    if bits >= source or value & (1 << bits) - 1:
+        return None
+    return result
+
+
+def segwit_address(address, hrp='bc'):
+    # Bech32 (witness version 0) and Bech32m (versions 1 to 16) addresses, BIP 173 and BIP 350
+    if not 14 <= len(address) <= 90 or address not in (address.lower(), address.upper()):
+        return False
+    address = address.lower()
+    if not address.startswith(hrp + '1') or any(char not in BECH32 for char in address[len(hrp) + 1:]):
+        return False
+    data = [BECH32.index(char) for char in address[len(hrp) + 1:]]
+    if len(data) < 7:
+        return False
+    check = bech32_polymod([ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp] + data)
+    version, program = data[0], convert_bits(data[1:-6], 5, 8)
+    if program is None or version > 16 or not 2 <= len(program) <= 40:
+        return False
+    if version == 0:
+        return check == 1 and len(program) in (20, 32)
+    return check == BECH32M_CONST
+
+
+def cashaddr_polymod(values):
+    generator = [0x98f2bc8e61, 0x79b76d99e2, 0xf33e5fb3c4, 0xae2eabe2a8, 0x1e4f43e470]
+    check = 1
+    for value in values:
+        top = check >> 35
+        check = (check & 0x07ffffffff) << 5 ^ value
+        for i in range(5):
+            check ^= generator[i] if (top >> i) & 1 else 0
+    return check ^ 1
+
+
+def cashaddr_address(address, prefix=CASHADDR_PREFIX):
+    # CashAddr P2PKH and P2SH addresses, with or without their prefix
+    if address not in (address.lower(), address.upper()):
+        return False
+    address = address.lower()
+    if address.startswith(prefix + ':'):
+        address = address[len(prefix) + 1:]
+    if not 42 <= len(address) <= 112 or any(char not in BECH32 for char in address):
+        return False
+    data = [BECH32.index(char) for char in address]
+    if cashaddr_polymod([ord(char) & 31 for char in prefix] + [0] + data) != 0:
+        return False
+    payload = convert_bits(data[:-8], 5, 8)
+    if not payload:
+        return False
+    version = payload[0]
+    return version >> 3 in (0, 1) and CASHADDR_SIZES[version & 7] == 8 * (len(payload) - 1)
+
+
+def keccak256(data):
+    # Ethereum's Keccak-256, which is not hashlib's SHA3-256 (that one pads with 0x06)
+    return keccak.new(digest_bits=256, data=data).digest()
+
+
+ETH_ADDRESS = re.compile(r'0x[0-9a-fA-F]{40}')
+
+
+def eth_address(address):
+    # Hex addresses, mixed case ones have to carry a valid EIP-55 checksum
+    if not ETH_ADDRESS.fullmatch(address):
+        return False
+    digits = address[2:]
+    if digits in (digits.lower(), digits.upper()):
+        return True
+    checksum = keccak256(digits.lower().encode()).hex()
+    return all(char.isdigit() or char.isupper() == (int(check, 16) >= 8) for char, check in zip(digits, checksum))
+
+
+ADDRESS_FORMATS = {
+    CryptoCurrency.BTC.value: [base58_address, segwit_address],
+    CryptoCurrency.BCH.value: [cashaddr_address, base58_address],
+    CryptoCurrency.ETH.value: [eth_address],
+}
+TX_HASHES = {
+    CryptoCurrency.BTC.value: re.compile(r'[0-9a-fA-F]{64}'),
+    CryptoCurrency.BCH.value: re.compile(r'[0-9a-fA-F]{64}'),
+    CryptoCurrency.ETH.value: re.compile(r'0x[0-9a-fA-F]{64}'),
+}
+
+
+def is_valid_address(crypto, address):
+    return any(valid(address) for valid in ADDRESS_FORMATS.get(crypto, []))
+
+
+def is_valid_tx_hash(crypto, tx):
+    return crypto in TX_HASHES and TX_HASHES[crypto].fullmatch(tx) is not None
+
+
+def validate_address(crypto, address):
+    # Unsupported cryptocurrencies are left to the client, which rejects them
+    if settings.VALIDATE_LOOKUPS and crypto in ADDRESS_FORMATS and not is_valid_address(crypto, address):
+        raise ValidationError(f'\'{address}\' is not a valid {crypto} address')
+
+
+def validate_tx_hash(crypto, tx):
+    if settings.VALIDATE_LOOKUPS and crypto in TX_HASHES and not is_valid_tx_hash(crypto, tx):
+        raise ValidationError(f'\'{tx}\' is not a valid {crypto} transaction hash')
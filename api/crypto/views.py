@@ -1,67 +1,144 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ParseError
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 from rest_framework.views import APIView
 
+from api.blockchain_client.cache import TieredCache
 from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.streaming import render_transactions
+from .conditional import RenderedResponse, conditional_response, transaction_cache_control, \
+    transactions_page_cache_control
 from .models import TransactionSearch, AddressSearch
-from .serializers import AddressSearchSerializer, TransactionSearchSerializer
+from .pagination import SearchLogCursorPagination, SearchLogPageNumberPagination
+from .search_log import sink
+from .serializers import AddressSearchSerializer, TransactionSearchSerializer, AddressListSerializer
+from .validation import validate_address, validate_tx_hash
 
 
-class AddressSearchView(ListAPIView):
-    queryset = AddressSearch.objects.all()
-    serializer_class = AddressSearchSerializer
-    pagination_class = PageNumberPagination
+class SearchLogView(ListAPIView):
+    # Cursor pagination by default, passing 'page' switches to the old page number pagination
+    pagination_class = SearchLogCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if SearchLogPageNumberPagination.page_query_param in self.request.query_params:
+                self._paginator = SearchLogPageNumberPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def filter_queryset(self, queryset):
-        return queryset.filter(creator=self.request.user)
+        return queryset.filter(creator=self.request.user).order_by('-created', '-id')
+
+
+class AddressSearchView(SearchLogView):
+    queryset = AddressSearch.objects.all()
+    serializer_class = AddressSearchSerializer
 
 
-class TransactionSearchView(ListAPIView):
+class TransactionSearchView(SearchLogView):
     queryset = TransactionSearch.objects.all()
     serializer_class = TransactionSearchSerializer
-    pagination_class = PageNumberPagination
 
-    def filter_queryset(self, queryset):
-        return queryset.filter(creator=self.request.user)
 
+# The last page of address transactions every user asked for, kept per worker (and in the shared cache when
+# there is one) for the prefetch window. Tracked here rather than read back from the search log, which may not
+# be flushed yet and would cost a query per request.
+last_pages = TieredCache(settings.ADDRESS_TRANSACTIONS_PREFETCH_USERS, shared_alias=settings.BLOCKCHAIN_CLIENT_SHARED_CACHE)
 
-class AddressTransactionsView(APIView):
 
-    # Locking page size for simplicity
+def scanning_sequentially(user, crypto, address, page, size):
+    # The user's last page (within the prefetch window) was the previous page of the same history
+    window = settings.ADDRESS_TRANSACTIONS_PREFETCH_WINDOW
+    if not window:
+        return False
+    key = f'address-transactions:last-page:{user.pk}'
+    last = last_pages.get(key)
+    last_pages.set(key, (crypto, address, page, size), ttl=window)
+    return page >= 1 and last == (crypto, address, page - 1, size)
+
+
+class AddressTransactionsView(APIView):
+    # Page size is picked with 'size', up to ADDRESS_TRANSACTIONS_MAX_PAGE_SIZE
     page_size = 50
     page_query_param = 'page'
+    page_size_query_param = 'size'
+
+    @classmethod
+    def get_page(cls, query_params):
+        # Negative pages are rejected by the client
+        try:
+            return int(query_params.get(cls.page_query_param, 0))
+        except ValueError:
+            raise ParseError('\'page\' must be a number')
+
+    @classmethod
+    def get_page_size(cls, query_params):
+        try:
+            size = int(query_params.get(cls.page_size_query_param, cls.page_size))
+        except ValueError:
+            raise ParseError('\'size\' must be a number')
+        if size < 1:
+            raise ParseError('\'size\' must be positive')
+        return min(size, settings.ADDRESS_TRANSACTIONS_MAX_PAGE_SIZE)
 
     def get(self, request, *args, **kwargs):
-        page = int(request.query_params.get(self.page_query_param, 0))
+        page = self.get_page(request.query_params)
+        size = self.get_page_size(request.query_params)
         crypto = kwargs.get('crypto')
         address = kwargs.get('address')
-
-        # TODO: might do extra validations on address here, but don't know enough about addresses to do it right now.
-
-        transactions = BlockchainClient.transactions_for_address(
+        validate_address(crypto, address)
+
+        # Indexed pages come from the database, they are not streamed
+        stream = settings.STREAM_ADDRESS_TRANSACTIONS and not settings.BLOCKCHAIN_CLIENT_TX_INDEX
+        if stream:
+            transactions = BlockchainClient.stream_transactions_for_address(
+                crypto=crypto,
+                address=address,
+                page=page,
+                size=size
+            )
+        else:
+            transactions = BlockchainClient.transactions_for_address(
+                crypto=crypto,
+                address=address,
+                page=page,
+                size=size
+            )
+            if scanning_sequentially(request.user, crypto, address, page, size):
+                BlockchainClient.prefetch_transactions(crypto, address, page + 1, size)
+        sink.record(AddressSearch(
             crypto=crypto,
             address=address,
             page=page,
-            size=self.page_size
-        )
-        AddressSearch.objects.create(
-            crypto=crypto,
-            address=address,
-            page=page,
-            size=self.page_size,
+            size=size,
             creator=request.user
-        )
-        return Response(transactions)
+        ))
+        if stream:
+            # Upstream failures past this point cut the response short
+            return StreamingHttpResponse(render_transactions(transactions), content_type='application/json')
+        return conditional_response(request, transactions, RenderedResponse, cache_control=transactions_page_cache_control())
 
 
 class TransactionsView(APIView):
     def get(self, request, *args, **kwargs):
         crypto = kwargs.get('crypto')
         tx = kwargs.get('tx')
-
-        # TODO: might do extra validations on tx id here, but don't know enough about tx ids to do it right now.
-
-        TransactionSearch.objects.create(crypto=crypto, transaction=tx, creator=request.user)
-        return Response(BlockchainClient.transaction(crypto=crypto, tx=tx))
+        validate_tx_hash(crypto, tx)
+        sink.record(TransactionSearch(crypto=crypto, transaction=tx, creator=request.user))
+        entry = BlockchainClient.transaction_entry(crypto=crypto, tx=tx)
+        return conditional_response(request, entry.data, RenderedResponse, etag=entry.etag,
+                                    cache_control=transaction_cache_control(entry))
+
+
+class AddressBalancesView(APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = AddressListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(BlockchainClient.address_balances(
+            crypto=kwargs.get('crypto'),
+            addresses=serializer.validated_data['addresses']))
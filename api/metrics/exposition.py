@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.resilience import STATES
+from .registry import BUCKETS, merge, registry
+
+PREFIX = 'cryptosearch'
+
+
+def client_gauges():
+    # Upstream client counters of this worker, they are gauges since they restart with the worker
+    gauges = []
+    for host, stats in BlockchainClient.transport_stats().items():
+        gauges.extend({'name': f'upstream_{name}', 'labels': {'host': host}, 'value': value}
+                      for name, value in stats.items())
+    for cache, stats in BlockchainClient.cache_stats().items():
+        gauges.extend({'name': f'cache_{name}', 'labels': {'cache': cache}, 'value': value}
+                      for name, value in stats.items())
+    gauges.extend({'name': f'single_flight_{name}', 'labels': {}, 'value': value}
+                  for name, value in BlockchainClient.single_flight_stats().items())
+    for host, read_timeout in BlockchainClient.timeout_stats().items():
+        gauges.append({'name': 'upstream_read_timeout_seconds', 'labels': {'host': host}, 'value': read_timeout})
+    for (host, crypto), stats in BlockchainClient.breaker_stats().items():
+        series = {'host': host, 'crypto': crypto}
+        # 0 closed, 1 half open, 2 open
+        gauges.append({'name': 'circuit_state', 'labels': series, 'value': STATES.index(stats['state'])})
+        gauges.extend({'name': f'circuit_{name}', 'labels': series, 'value': stats[name]} for name in ('opened', 'rejected'))
+    for (host, crypto), stats in BlockchainClient.retry_budget_stats().items():
+        gauges.extend({'name': f'retry_budget_{name}', 'labels': {'host': host, 'crypto': crypto}, 'value': value}
+                      for name, value in stats.items())
+    gauges.extend({'name': f'rate_limit_{name}', 'labels': {}, 'value': value}
+                  for name, value in BlockchainClient.rate_limit_stats().items())
+    return gauges
+
+
+def worker_snapshot():
+    snapshot = registry.snapshot()
+    snapshot['gauges'] = client_gauges()
+    return snapshot
+
+
+def dump():
+    # Writes this worker's snapshot to METRICS_DIR
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(worker_snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+
+class Dumper:
+    # Background thread dumping the worker's metrics every METRICS_DUMP_INTERVAL seconds (with METRICS_DIR),
+    # so that requests never wait for the file I/O
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        if settings.METRICS_DIR is None or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            # Threads do not survive a fork
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='metrics-dumper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.METRICS_DUMP_INTERVAL)
+            self.dump()
+
+    def dump(self):
+        if settings.METRICS_DIR is None:
+            return
+        try:
+            dump()
+        except OSError:
+            logging.exception('Failed to dump metrics')
+
+
+dumper = Dumper()
+# The last counts of a worker are dumped when it exits
+atexit.register(dumper.dump)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    # This worker's live snapshot merged with the last ones dumped by the other workers.
+    # Workers that are gone still count towards histograms and counters, but not gauges.
+    snapshots = [worker_snapshot()]
+    if settings.METRICS_DIR is not None and os.path.isdir(settings.METRICS_DIR):
+        for name in os.listdir(settings.METRICS_DIR):
+            if not name.endswith('.json') or name == f'{os.getpid()}.json':
+                continue
+            try:
+                with open(os.path.join(settings.METRICS_DIR, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not alive(snapshot['pid']):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+    return merge(snapshots)
+
+
+def labels(values):
+    if not values:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(values, escaped)) + '}'
+
+
+def render(metrics):
+    # Prometheus text exposition format
+    lines = [
+        f'# HELP {PREFIX}_stage_seconds Duration of request stages (sampled, see METRICS_SAMPLE_RATE)',
+        f'# TYPE {PREFIX}_stage_seconds histogram',
+    ]
+    for histogram in sorted(metrics['histograms'], key=lambda h: (h['endpoint'], h['stage'])):
+        series = {'endpoint': histogram['endpoint'], 'stage': histogram['stage']}
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+            cumulative += count
+            lines.append(f'{PREFIX}_stage_seconds_bucket{labels(dict(series, le=bound))} {cumulative}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{labels(series)} {histogram["sum"]}')
+        lines.append(f'{PREFIX}_stage_seconds_count{labels(series)} {histogram["count"]}')
+
+    by_name = {}
+    for counter in metrics['counters']:
+        by_name.setdefault(counter['name'], []).append(counter)
+    for name, counters in sorted(by_name.items()):
+        lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+        for counter in sorted(counters, key=lambda c: sorted(c['labels'].items())):
+            lines.append(f'{PREFIX}_{name}_total{labels(counter["labels"])} {counter["value"]}')
+
+    by_name = {}
+    for gauge in metrics['gauges']:
+        by_name.setdefault(gauge['name'], []).append(gauge)
+    for name, gauges in sorted(by_name.items()):
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        for gauge in gauges:
+            lines.append(f'{PREFIX}_{name}{labels(gauge["labels"])} {gauge["value"]}')
+    return '\n'.join(lines) + '\n'
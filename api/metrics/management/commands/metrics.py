@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.metrics.exposition import collect, render
+
+
+class Command(BaseCommand):
+    help = 'Prints the metrics dumped by the API workers to METRICS_DIR, in Prometheus text format or as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print JSON instead of the Prometheus text format')
+
+    def handle(self, *args, **options):
+        metrics = collect()
+        self.stdout.write(json.dumps(metrics, indent=2) if options['json'] else render(metrics), ending='')
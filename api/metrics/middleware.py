@@ -0,0 +1,54 @@
+import asyncio
+import random
+import time
+
+from django.conf import settings
+
+from .exposition import dumper
+from .registry import Sample, current, registry
+
+
+class MetricsMiddleware:
+    # Counts every request per endpoint (url name) and status. A METRICS_SAMPLE_RATE share of requests
+    # also gets its stages timed, see span() in registry.
+    # Sync and async capable, so that async views are not run through a thread under ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function for Django's middleware chain
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        sample, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, sample, started)
+        return response
+
+    async def __acall__(self, request):
+        sample, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, sample, started)
+        return response
+
+    def start(self):
+        dumper.start()
+        sample = Sample() if random.random() < settings.METRICS_SAMPLE_RATE else None
+        return sample, current.set(sample), time.perf_counter()
+
+    def finish(self, request, response, sample, started):
+        endpoint = getattr(request.resolver_match, 'url_name', None) or 'unresolved'
+        if sample is not None:
+            sample.spans.append(('request', time.perf_counter() - started))
+            registry.observe_many(endpoint, sample.spans)
+        registry.increment('requests', endpoint=endpoint, status=str(response.status_code))
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds, the last bucket (+Inf) catches everything above
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # Per worker histograms of stage durations keyed by (stage, endpoint) and counters keyed by (name, labels).
+    # Snapshots are plain JSON friendly dicts, so workers can hand them to each other through files.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, stage, endpoint, seconds):
+        with self._lock:
+            self._observe(stage, endpoint, seconds)
+
+    def observe_many(self, endpoint, spans):
+        with self._lock:
+            for stage, seconds in spans:
+                self._observe(stage, endpoint, seconds)
+
+    def _observe(self, stage, endpoint, seconds):
+        histogram = self._histograms.get((stage, endpoint))
+        if histogram is None:
+            histogram = self._histograms[(stage, endpoint)] = Histogram()
+        histogram.observe(seconds)
+
+    def increment(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'histograms': [
+                    {'stage': stage, 'endpoint': endpoint, 'buckets': list(histogram.counts),
+                     'sum': histogram.sum, 'count': histogram.count}
+                    for (stage, endpoint), histogram in self._histograms.items()
+                ],
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                'gauges': [],
+            }
+
+    def clear(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+
+def merge(snapshots):
+    # Histograms and counters add up across workers, gauges stay per worker (labelled with its pid)
+    histograms, counters, gauges = {}, {}, []
+    for snapshot in snapshots:
+        for histogram in snapshot['histograms']:
+            key = (histogram['stage'], histogram['endpoint'])
+            merged = histograms.setdefault(key, {
+                'stage': key[0], 'endpoint': key[1], 'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+        for counter in snapshot['counters']:
+            key = (counter['name'], tuple(sorted(counter['labels'].items())))
+            merged = counters.setdefault(key, {'name': counter['name'], 'labels': counter['labels'], 'value': 0})
+            merged['value'] += counter['value']
+        for gauge in snapshot['gauges']:
+            gauges.append(dict(gauge, labels=dict(gauge['labels'], pid=str(snapshot['pid']))))
+    return {'histograms': list(histograms.values()), 'counters': list(counters.values()), 'gauges': gauges}
+
+
+class Sample:
+    # Spans of one sampled request, recorded under the endpoint once the request is done
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = []
+
+
+current = ContextVar('metrics_sample', default=None)
+registry = Registry()
+
+
+@contextmanager
+def span(stage, endpoint=None):
+    # Times a stage of the sampled request in progress. Outside of requests (e.g. background threads)
+    # an endpoint has to be given, and the stage is always recorded.
+    sample = current.get()
+    if sample is None and endpoint is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if sample is not None:
+            sample.spans.append((stage, elapsed))
+        else:
+            registry.observe(stage, endpoint, elapsed)
@@ -0,0 +1,66 @@
+from django.test import TestCase
+
+from api.metrics.registry import Registry, Sample, current, merge, registry, span
+
+
+class TestRegistry(TestCase):
+    def test_should_bucket_observations(self):
+        metrics = Registry()
+        metrics.observe('upstream', 'transaction-detail', 0.003)
+        metrics.observe('upstream', 'transaction-detail', 20)
+        histogram, = metrics.snapshot()['histograms']
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(histogram['buckets'][2], 1)
+        self.assertEqual(histogram['buckets'][-1], 1)
+        self.assertAlmostEqual(histogram['sum'], 20.003)
+
+    def test_merge_should_add_up_workers_and_keep_gauges_apart(self):
+        worker, another_worker = Registry(), Registry()
+        worker.observe('upstream', 'my-balance', 0.1)
+        another_worker.observe('upstream', 'my-balance', 0.2)
+        worker.increment('requests', endpoint='my-balance', status='200')
+        another_worker.increment('requests', endpoint='my-balance', status='200')
+        snapshots = [worker.snapshot(), dict(another_worker.snapshot(), pid=1)]
+        snapshots[0]['gauges'] = [{'name': 'cache_hits', 'labels': {}, 'value': 1}]
+        snapshots[1]['gauges'] = [{'name': 'cache_hits', 'labels': {}, 'value': 2}]
+        merged = merge(snapshots)
+        self.assertEqual(merged['histograms'][0]['count'], 2)
+        self.assertEqual(merged['counters'][0]['value'], 2)
+        self.assertEqual(len(merged['gauges']), 2)
+        self.assertEqual(merged['gauges'][1]['labels'], {'pid': '1'})
+
+
+class TestSpan(TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def test_should_not_record_outside_of_sampled_requests(self):
+        with span('transform'):
+            pass
+        self.assertListEqual(registry.snapshot()['histograms'], [])
+
+    def test_should_collect_spans_of_sampled_request(self):
+        sample = Sample()
+        token = current.set(sample)
+        try:
+            with span('transform'):
+                pass
+        finally:
+            current.reset(token)
+        self.assertListEqual([stage for stage, _ in sample.spans], ['transform'])
+
+    def test_should_record_background_spans_with_endpoint(self):
+        with span('search_log_flush', endpoint='search-log-flusher'):
+            pass
+        histogram, = registry.snapshot()['histograms']
+        self.assertEqual((histogram['stage'], histogram['endpoint']), ('search_log_flush', 'search-log-flusher'))
+
+    def test_should_record_span_when_body_raises(self):
+        sample = Sample()
+        token = current.set(sample)
+        try:
+            with self.assertRaises(ValueError), span('json_decode'):
+                raise ValueError()
+        finally:
+            current.reset(token)
+        self.assertEqual(len(sample.spans), 1)
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.tests.test_blockchain_client import TRANSPORT_GET, StubResponse
+from api.crypto.tests.test_search_views import TX
+from api.metrics.exposition import dump
+from api.metrics.middleware import MetricsMiddleware
+from api.metrics.registry import registry
+
+TRANSACTION = {
+    'inputs': [{'address': 'a', 'value': 1}],
+    'outputs': [{'address': 'b', 'value': 1}],
+    'time': 1620513287,
+    'block': {'height': 1},
+}
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class TestMetrics(TestCase):
+    def setUp(self):
+        registry.clear()
+        BlockchainClient.reset()
+        self.user = get_user_model().objects.create(username='metrics', password='pass')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    @patch(TRANSPORT_GET)
+    def test_should_time_request_stages_per_endpoint(self, mock):
+        mock.return_value = StubResponse(TRANSACTION)
+        self.client.get(reverse('transaction-detail', kwargs={'crypto': 'btc', 'tx': TX}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        # The transport is patched, so there is no upstream span
+        for stage in ['request', 'search_log', 'json_decode', 'transform', 'serialize']:
+            self.assertIn(f'cryptosearch_stage_seconds_count{{endpoint="transaction-detail",stage="{stage}"}} 1',
+                          text)
+        self.assertIn('cryptosearch_requests_total{endpoint="transaction-detail",status="200"} 1', text)
+        self.assertIn('# TYPE cryptosearch_cache_hits gauge', text)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_should_count_unsampled_requests(self):
+        self.client.get(reverse('my-balance'))
+        histograms = registry.snapshot()['histograms']
+        self.assertListEqual(histograms, [])
+        self.assertEqual(registry.snapshot()['counters'][0]['labels'], {'endpoint': 'my-balance', 'status': '200'})
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8'])
+    def test_should_only_serve_allowed_networks_and_admins(self):
+        self.assertEqual(APIClient().get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_middleware_should_stay_async_in_async_chains(self):
+        async def view(request):
+            await asyncio.sleep(0)
+            return HttpResponse(status=204)
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(registry.snapshot()['counters'][0]['labels'], {'endpoint': 'unresolved', 'status': '204'})
+
+    def test_command_should_merge_dumped_workers(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            registry.observe('upstream', 'my-balance', 0.1)
+            dump()
+            with open(f'{directory}/1.json', 'w') as f:
+                json.dump(dict(registry.snapshot(), pid=1), f)
+            out = StringIO()
+            call_command('metrics', json=True, stdout=out)
+        histogram, = json.loads(out.getvalue())['histograms']
+        self.assertEqual(histogram['count'], 2)
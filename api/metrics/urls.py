@@ -0,0 +1,7 @@
+from django.conf.urls import re_path
+
+from .views import MetricsView
+
+urlpatterns = [
+    re_path(r'^$', MetricsView.as_view(), name='metrics'),
+]
@@ -0,0 +1,29 @@
+import ipaddress
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.permissions import BasePermission, IsAdminUser
+from rest_framework.views import APIView
+
+from .exposition import collect, render
+
+
+def from_allowed_network(request):
+    try:
+        client = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(client in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+class IsScraperOrAdmin(BasePermission):
+    # Scrapers are let in from METRICS_ALLOWED_NETWORKS without a token, anyone else has to be an admin user
+    def has_permission(self, request, view):
+        return from_allowed_network(request) or IsAdminUser().has_permission(request, view)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsScraperOrAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
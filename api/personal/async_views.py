@@ -0,0 +1,19 @@
+from asgiref.sync import sync_to_async
+from rest_framework.request import Request
+
+from api.blockchain_client.async_client import AsyncBlockchainClient
+from api.crypto.async_views import async_api_view, render
+from api.crypto.conditional import conditional_response
+from api.crypto.models import Address
+from .totals import record_balances
+from .views import balances_page, mark_balances_queried, paginated
+
+
+@async_api_view
+async def my_balances(request):
+    await sync_to_async(mark_balances_queried)(request.user)
+    paginator, addresses = await sync_to_async(balances_page)(
+        Request(request), Address.objects.filter(owner=request.user).order_by('pk'))
+    balances = await AsyncBlockchainClient.balances(addresses)
+    await sync_to_async(record_balances)(balances)
+    return conditional_response(request, paginated(paginator, balances), render)
@@ -0,0 +1,184 @@
+import csv
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import APIException, UnsupportedMediaType
+
+from api.blockchain_client.streaming import iter_items
+from api.crypto.models import Address
+from api.crypto.validation import is_valid_address
+from project.crypto_currencies import CryptoCurrency
+from .totals import update_totals
+
+# Bulk import and removal of my addresses. Uploads are read, checked and written BULK_ADDRESSES_BATCH_SIZE rows
+# at a time, so memory stays bounded by a batch (and the reported errors) whatever the size of the upload.
+# Rows are {"crypto": ..., "address": ...} objects (a JSON array or NDJSON) or crypto,address CSV lines,
+# the crypto can be left out when it is given as ?crypto=.
+
+CRYPTOS = {crypto.value for crypto in CryptoCurrency}
+MAX_LINE = 4096
+
+
+def iter_lines(stream):
+    # Lines of the body, a line longer than MAX_LINE is skipped and comes out as None
+    while True:
+        line = stream.readline(MAX_LINE)
+        if not line:
+            return
+        if len(line) < MAX_LINE or line.endswith(b'\n'):
+            yield line
+            continue
+        while line and not line.endswith(b'\n'):
+            line = stream.readline(MAX_LINE)
+        yield None
+
+
+def json_rows(stream):
+    # (row, item, error) of a JSON array, a syntax error ends the upload
+    chunks = iter(lambda: stream.read(settings.STREAM_CHUNK_SIZE), b'')
+    row = 0
+    try:
+        for item in iter_items(chunks):
+            row += 1
+            yield row, item, None
+    except APIException:
+        yield row + 1, None, 'Malformed JSON, the rest of the upload was not read'
+
+
+def ndjson_rows(stream):
+    for row, line in enumerate(iter_lines(stream), 1):
+        if line is None:
+            yield row, None, 'Row is too long'
+        elif line.strip():
+            try:
+                yield row, json.loads(line), None
+            except ValueError:
+                yield row, None, 'Malformed JSON'
+
+
+def csv_rows(stream):
+    for row, line in enumerate(iter_lines(stream), 1):
+        if line is None:
+            yield row, None, 'Row is too long'
+            continue
+        try:
+            fields = [field.strip() for field in next(csv.reader([line.decode()]), [])]
+        except (UnicodeDecodeError, csv.Error):
+            yield row, None, 'Malformed CSV'
+            continue
+        if not any(fields) or (row == 1 and fields in (['crypto', 'address'], ['address'])):
+            continue
+        if len(fields) == 1:
+            yield row, {'address': fields[0]}, None
+        elif len(fields) == 2:
+            yield row, {'crypto': fields[0], 'address': fields[1]}, None
+        else:
+            yield row, None, 'Expected crypto,address'
+
+
+READERS = {
+    'application/json': json_rows,
+    'application/x-ndjson': ndjson_rows,
+    'text/csv': csv_rows,
+}
+
+
+def read_rows(request):
+    media_type = request.content_type.split(';')[0].strip()
+    if media_type not in READERS:
+        raise UnsupportedMediaType(media_type)
+    # No stream without a body
+    return READERS[media_type](request.stream) if request.stream is not None else iter(())
+
+
+def parse_row(item, default_crypto, validate):
+    # (crypto, address) of an uploaded row, or why it was rejected
+    if not isinstance(item, dict):
+        return None, 'Expected {"crypto": ..., "address": ...}'
+    crypto = item.get('crypto', default_crypto)
+    address = item.get('address')
+    if crypto not in CRYPTOS:
+        return None, f'Cryptocurrency \'{crypto}\' is not supported'
+    if not isinstance(address, str) or not address or len(address) > Address._meta.get_field('address').max_length:
+        return None, 'Invalid address'
+    if validate and settings.VALIDATE_LOOKUPS and not is_valid_address(crypto, address):
+        return None, f'\'{address}\' is not a valid {crypto} address'
+    return (crypto, address), None
+
+
+class Summary:
+    # Counts of what happened to the rows, with the first BULK_ADDRESSES_MAX_ERRORS rejected rows
+    def __init__(self, *counts):
+        self.counts = dict.fromkeys(counts + ('invalid',), 0)
+        self.errors = []
+        self.truncated = False
+
+    def add(self, name, value):
+        self.counts[name] += value
+
+    def reject(self, row, error):
+        self.counts['invalid'] += 1
+        if len(self.errors) < settings.BULK_ADDRESSES_MAX_ERRORS:
+            self.errors.append({'row': row, 'error': error})
+
+    def as_dict(self):
+        return dict(self.counts, errors=self.errors, truncated=self.truncated)
+
+
+def batches(request, summary, validate):
+    # Accepted (crypto, address) pairs in batches, rejected rows go to the summary.
+    # Rows past BULK_ADDRESSES_MAX_ROWS are not read.
+    default_crypto = request.query_params.get('crypto')
+    batch = []
+    for count, (row, item, error) in enumerate(read_rows(request)):
+        if count == settings.BULK_ADDRESSES_MAX_ROWS:
+            summary.truncated = True
+            break
+        if error is None:
+            pair, error = parse_row(item, default_crypto, validate)
+        if error is not None:
+            summary.reject(row, error)
+            continue
+        batch.append(pair)
+        if len(batch) == settings.BULK_ADDRESSES_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_addresses(request):
+    # Rows that are already my addresses (or repeated in the upload) are counted as existing
+    summary = Summary('created', 'existing')
+    owner = request.user
+    for batch in batches(request, summary, validate=True):
+        pairs = set(batch)
+        existing = pairs & set(Address.objects.filter(
+            owner=owner, address__in={address for _, address in pairs}
+        ).values_list('crypto', 'address'))
+        new = pairs - existing
+        # Conflicts with addresses added in the meantime are left to the unique constraint
+        Address.objects.bulk_create([Address(crypto=crypto, address=address, owner=owner) for crypto, address in new],
+                                    ignore_conflicts=True)
+        summary.add('created', len(new))
+        summary.add('existing', len(batch) - len(new))
+    return summary
+
+
+def delete_addresses(request):
+    # Addresses are not validated, so that anything that was added can be removed
+    summary = Summary('deleted', 'missing')
+    owner = request.user
+    for batch in batches(request, summary, validate=False):
+        by_crypto = {}
+        for crypto, address in batch:
+            by_crypto.setdefault(crypto, set()).add(address)
+        deleted = sum(
+            Address.objects.filter(owner=owner, crypto=crypto, address__in=addresses).delete()[1].get(
+                Address._meta.label, 0)
+            for crypto, addresses in by_crypto.items())
+        summary.add('deleted', deleted)
+        summary.add('missing', len(batch) - deleted)
+        for crypto in by_crypto:
+            update_totals({owner.pk}, crypto)
+    return summary
@@ -0,0 +1,106 @@
+from datetime import datetime, time, timedelta
+from itertools import chain, groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+
+from api.crypto.models import Address, BalanceSnapshot
+
+# Balance history of my addresses from their snapshots (BalanceSnapshot). The snapshots of a range are read in one
+# pass, address by address in timestamp order along the (address, timestamp) index, and downsampled on the fly to the
+# last balance of every interval.
+
+INTERVALS = {
+    'hour': lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+    'day': lambda moment: moment.replace(hour=0, minute=0, second=0, microsecond=0),
+    'week': lambda moment: (moment - timedelta(days=moment.weekday())).replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def parse_moment(query_params, name, default):
+    # Times (naive ones are UTC) or dates (their start) of the query
+    value = query_params.get(name)
+    if value is None:
+        return default
+    try:
+        moment = parse_datetime(value)
+        if moment is None and parse_date(value) is not None:
+            moment = datetime.combine(parse_date(value), time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ParseError(f'\'{name}\' must be a date or a date and time')
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment, timezone.utc)
+
+
+def history_range(query_params):
+    # [since, until) of the query, the last BALANCE_HISTORY_DEFAULT_DAYS days by default
+    until = parse_moment(query_params, 'until', timezone.now())
+    since = parse_moment(query_params, 'since', until - timedelta(days=settings.BALANCE_HISTORY_DEFAULT_DAYS))
+    if since >= until:
+        raise ParseError('\'since\' must be before \'until\'')
+    return since, until
+
+
+def parse_interval(query_params):
+    interval = query_params.get('interval')
+    if interval is not None and interval not in INTERVALS:
+        raise ParseError(f'\'interval\' must be one of {", ".join(INTERVALS)}')
+    return interval
+
+
+def downsample(snapshots, interval):
+    # Last (timestamp, balance) of every interval, timestamped with the start of the interval
+    truncate = INTERVALS[interval]
+    last = None
+    for timestamp, balance in snapshots:
+        bucket = truncate(timestamp.astimezone(timezone.utc))
+        if last is not None and last[0] != bucket:
+            yield last
+        last = (bucket, balance)
+    if last is not None:
+        yield last
+
+
+def balance_history(user, query_params):
+    since, until = history_range(query_params)
+    interval = parse_interval(query_params)
+    addresses = Address.objects.filter(owner=user)
+    if 'crypto' in query_params:
+        addresses = addresses.filter(crypto=query_params['crypto'])
+    if 'address' in query_params:
+        addresses = addresses.filter(address=query_params['address'])
+    # The balance at `since` is the one of the last snapshot before it
+    initial = Subquery(BalanceSnapshot.objects.filter(
+        address=OuterRef('pk'), timestamp__lt=since
+    ).order_by('-timestamp').values('balance')[:1])
+    selected = addresses.values('pk')
+    addresses = addresses.annotate(initial=initial).order_by('pk')
+
+    # A single scan of the range, grouped by address
+    snapshots = groupby(BalanceSnapshot.objects.filter(
+        address__in=selected, timestamp__gte=since, timestamp__lt=until
+    ).order_by('address_id', 'timestamp', 'pk').values_list('address_id', 'timestamp', 'balance').iterator(),
+        key=itemgetter(0))
+    group = next(snapshots, None)
+
+    result = []
+    for address in addresses:
+        balances = [] if address.initial is None else [(since, address.initial)]
+        if group is not None and group[0] == address.pk:
+            balances = chain(balances, ((timestamp, balance) for _, timestamp, balance in group[1]))
+        if interval is not None:
+            balances = downsample(balances, interval)
+        result.append({
+            'crypto': address.crypto,
+            'address': address.address,
+            'balances': [{'timestamp': timestamp, 'balance': balance} for timestamp, balance in balances],
+        })
+        # The group is read before moving on to the next one
+        if group is not None and group[0] == address.pk:
+            group = next(snapshots, None)
+    return result
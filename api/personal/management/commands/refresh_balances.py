@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.ratelimit import background
+from api.crypto.models import Address
+from api.personal.totals import record_balances
+
+
+class Command(BaseCommand):
+    help = 'Keeps balances of watched addresses fresh in the balance cache, most recently queried addresses first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single refresh round and exit')
+        parser.add_argument('--interval', type=float, default=settings.BLOCKCHAIN_CLIENT_BALANCE_FRESH_TTL / 2,
+                            help='Seconds between the starts of refresh rounds')
+        parser.add_argument('--limit', type=int, default=None, help='Addresses refreshed per round')
+
+    def handle(self, *args, once=False, interval=None, limit=None, **options):
+        if settings.BLOCKCHAIN_CLIENT_SHARED_CACHE is None:
+            self.stderr.write('BLOCKCHAIN_CLIENT_SHARED_CACHE is not set, web workers will not see refreshed balances')
+
+        while True:
+            started = time.monotonic()
+            # Refreshes yield to the web workers' requests in the shared upstream rate limit
+            with background():
+                refreshed, failed = self.refresh(limit)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Refreshed {refreshed} balances ({failed} failed) in {elapsed:.1f}s')
+            if once:
+                return
+            time.sleep(max(0, interval - elapsed))
+
+    def refresh(self, limit):
+        # An address watched by several users goes by its most recent query, never queried addresses go last
+        addresses = Address.objects.values('crypto', 'address').annotate(
+            queried=Max('balance_queried')
+        ).order_by(F('queried').desc(nulls_last=True), 'crypto', 'address').values_list('crypto', 'address')
+        if limit is not None:
+            addresses = addresses[:limit]
+
+        # Windows keep the priority order across cryptos, each window is as much as fetch_balances does at once
+        window = settings.BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE * settings.BLOCKCHAIN_CLIENT_FAN_OUT
+        addresses = list(addresses)
+        refreshed = failed = 0
+        for start in range(0, len(addresses), window):
+            by_crypto = {}
+            for crypto, address in addresses[start:start + window]:
+                by_crypto.setdefault(crypto, []).append(address)
+            for crypto, requested in by_crypto.items():
+                balances = BlockchainClient.fetch_balances(crypto, requested)
+                # Keeps the owners' balance totals up to date
+                record_balances(balances)
+                for balance in balances:
+                    if 'error' in balance:
+                        failed += 1
+                    else:
+                        refreshed += 1
+        return refreshed, failed
@@ -0,0 +1,82 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.db.models import F, Max
+from rest_framework.exceptions import APIException
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.ratelimit import background
+from api.crypto.models import Address
+
+
+def sync_address(crypto, address):
+    # New transactions of a watched address into the transaction index. Watches that have not seen any
+    # transaction yet start from the current newest one, so only what happens after that is new to them.
+    try:
+        newest = BlockchainClient.sync_address(crypto, address)
+        if newest is not None:
+            Address.objects.filter(crypto=crypto, address=address, seen_hash__isnull=True).update(seen_hash=newest)
+    except APIException:
+        return False
+    except DatabaseError:
+        # E.g. a locked SQLite database, the address is synced again in the next round
+        logging.exception(f'Failed to sync {crypto} address {address}')
+        return False
+    return True
+
+
+def sync_in_thread(crypto, address):
+    try:
+        return sync_address(crypto, address)
+    finally:
+        # Pool threads get their own database connection, it is not closed by any request cycle
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Fetches the transactions of watched addresses that are newer than the indexed ones, ' \
+           'most recently queried addresses first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single sync round and exit')
+        parser.add_argument('--interval', type=float, default=settings.BLOCKCHAIN_CLIENT_TX_INDEX_SYNC_TTL,
+                            help='Seconds between the starts of sync rounds')
+        parser.add_argument('--concurrency', type=int, default=settings.BLOCKCHAIN_CLIENT_FAN_OUT,
+                            help='Addresses synced at the same time')
+        parser.add_argument('--limit', type=int, default=None, help='Addresses synced per round')
+
+    def handle(self, *args, once=False, interval=None, concurrency=None, limit=None, **options):
+        while True:
+            started = time.monotonic()
+            # Syncs yield to the web workers' requests in the shared upstream rate limit
+            with background():
+                synced, failed = self.sync(limit, concurrency)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Synced {synced} addresses ({failed} failed) in {elapsed:.1f}s')
+            if once:
+                return
+            time.sleep(max(0, interval - elapsed))
+
+    def sync(self, limit, concurrency):
+        # Same order as refresh_balances, an address watched by several users is synced once
+        addresses = Address.objects.values('crypto', 'address').annotate(
+            queried=Max('balance_queried')
+        ).order_by(F('queried').desc(nulls_last=True), 'crypto', 'address').values_list('crypto', 'address')
+        if limit is not None:
+            addresses = addresses[:limit]
+        addresses = list(addresses)
+
+        if concurrency <= 1:
+            results = [sync_address(crypto, address) for crypto, address in addresses]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(copy_context().run, sync_in_thread, crypto, address)
+                           for crypto, address in addresses]
+                results = [future.result() for future in futures]
+        synced = sum(1 for result in results if result)
+        return synced, len(results) - synced
@@ -0,0 +1,80 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.status import HTTP_200_OK, HTTP_415_UNSUPPORTED_MEDIA_TYPE
+from rest_framework.test import APIClient
+
+from api.crypto.models import Address
+
+BTC = ['1LDXE2o8mJDKcgLjLZStZq2nZXMQaUzdrv', '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy']
+BCH = ['qpld9cdua8aa34hl3dm8xrv37y2ps4dwjura8m3h2y', 'qqtgm0njzgctkmhc28q6530zvjs0pjedxq4d4r7qfr']
+ETH = ['0xaa62dc6cd0123d5bb1e080e61f5fe508b7c8744e', '0xd2c7649ab7ededf965e5bcd0d7007ebeaee179c4']
+
+
+class TestBulkAddresses(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='bulk', password='pass')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def upload(self, name, body, content_type, **params):
+        url = reverse(name)
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        response = self.client.post(url, data=body, content_type=content_type)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return response.data
+
+    def addresses(self):
+        return sorted(Address.objects.filter(owner=self.user).values_list('crypto', 'address'))
+
+    @override_settings(BULK_ADDRESSES_BATCH_SIZE=2)
+    def test_json_import_should_report_every_row(self):
+        Address.objects.create(crypto='btc', address=BTC[1], owner=self.user)
+        body = json.dumps([{'crypto': 'btc', 'address': BTC[0]}, {'crypto': 'btc', 'address': BTC[1]},
+                           {'crypto': 'doge', 'address': 'b'}, {'crypto': 'eth', 'address': ETH[0]},
+                           {'crypto': 'eth', 'address': ETH[0]}, 'd'])
+        summary = self.upload('my-address-bulk', body, 'application/json')
+        self.assertDictEqual(summary, {'created': 2, 'existing': 2, 'invalid': 2, 'truncated': False, 'errors': [
+            {'row': 3, 'error': 'Cryptocurrency \'doge\' is not supported'},
+            {'row': 6, 'error': 'Expected {"crypto": ..., "address": ...}'},
+        ]})
+        self.assertListEqual(self.addresses(), [('btc', BTC[0]), ('btc', BTC[1]), ('eth', ETH[0])])
+
+    def test_ndjson_import_should_keep_going_after_bad_rows(self):
+        body = f'{{"crypto": "bch", "address": "{BCH[0]}"}}\n{{oops\n\n{{"crypto": "bch", "address": "{BCH[1]}"}}\n'
+        summary = self.upload('my-address-bulk', body, 'application/x-ndjson')
+        self.assertEqual(summary['created'], 2)
+        self.assertListEqual(summary['errors'], [{'row': 2, 'error': 'Malformed JSON'}])
+
+    def test_csv_import_should_take_crypto_from_query(self):
+        summary = self.upload('my-address-bulk', f'address\n{ETH[0]}\n{ETH[1]}\n', 'text/csv', crypto='eth')
+        self.assertEqual(summary['created'], 2)
+        summary = self.upload('my-address-bulk', f'crypto,address\nbtc,{BTC[0]}\nbtc,{BTC[0]},extra\n', 'text/csv')
+        self.assertEqual(summary['created'], 1)
+        self.assertListEqual(summary['errors'], [{'row': 3, 'error': 'Expected crypto,address'}])
+        self.assertListEqual(self.addresses(), [('btc', BTC[0]), ('eth', ETH[0]), ('eth', ETH[1])])
+
+    @override_settings(BULK_ADDRESSES_MAX_ROWS=2, BULK_ADDRESSES_MAX_ERRORS=1)
+    def test_import_should_be_bounded(self):
+        summary = self.upload('my-address-bulk', 'x,a\nx,b\nbtc,c\n', 'text/csv')
+        self.assertDictEqual(summary, {'created': 0, 'existing': 0, 'invalid': 2, 'truncated': True,
+                                       'errors': [{'row': 1, 'error': 'Cryptocurrency \'x\' is not supported'}]})
+
+    def test_bulk_delete_should_only_delete_my_addresses(self):
+        another_user = get_user_model().objects.create(username='bulk-another', password='pass')
+        Address.objects.create(crypto='btc', address='a', owner=another_user)
+        Address.objects.create(crypto='btc', address='a', owner=self.user)
+        Address.objects.create(crypto='eth', address='a', owner=self.user)
+        summary = self.upload('my-address-bulk-delete', 'btc,a\nbtc,b\n', 'text/csv')
+        self.assertDictEqual(summary, {'deleted': 1, 'missing': 1, 'invalid': 0, 'truncated': False, 'errors': []})
+        self.assertListEqual(self.addresses(), [('eth', 'a')])
+        self.assertTrue(Address.objects.filter(owner=another_user).exists())
+
+    def test_should_reject_other_uploads(self):
+        response = self.client.post(reverse('my-address-bulk'), data='a', content_type='text/plain')
+        self.assertEqual(response.status_code, HTTP_415_UNSUPPORTED_MEDIA_TYPE)
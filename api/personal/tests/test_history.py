@@ -0,0 +1,88 @@
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from rest_framework.test import APIClient
+
+from api.crypto.models import Address, BalanceSnapshot
+from api.personal.totals import record_balances
+
+
+def moment(day, hour=0):
+    return datetime(2026, 10, day, hour, tzinfo=timezone.utc)
+
+
+class TestBalanceHistory(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='history', password='pass')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.address = Address.objects.create(crypto='btc', address='first', owner=self.user)
+
+    def snapshot(self, timestamp, balance, address=None):
+        BalanceSnapshot.objects.create(address=address or self.address, timestamp=timestamp, balance=balance)
+
+    def history(self, **params):
+        response = self.client.get(reverse('my-balance-history'), params)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return [(entry['address'], [(point['timestamp'], point['balance']) for point in entry['balances']])
+                for entry in response.data]
+
+    def test_record_balances_should_only_snapshot_changed_balances(self):
+        another = get_user_model().objects.create(username='history-another', password='pass')
+        Address.objects.create(crypto='btc', address='first', owner=another)
+        for balance in (10, 10, 20):
+            record_balances([{'crypto': 'btc', 'address': 'first', 'balance': balance}])
+        record_balances([{'crypto': 'btc', 'address': 'first', 'balance': None, 'error': 'Failed'}])
+        self.assertListEqual(
+            list(self.address.snapshots.order_by('timestamp', 'pk').values_list('balance', flat=True)), [10, 20])
+        # Every watching address has its own history
+        self.assertEqual(BalanceSnapshot.objects.filter(address__owner=another).count(), 2)
+
+    def test_record_balances_should_not_snapshot_unchanged_balances_beyond_64_bits(self):
+        wei = 2 ** 63 + 1
+        for balance in (wei, wei, wei + 1):
+            record_balances([{'crypto': 'btc', 'address': 'first', 'balance': balance}])
+        self.assertListEqual(
+            list(self.address.snapshots.order_by('timestamp', 'pk').values_list('balance', flat=True)), [wei, wei + 1])
+        [(_, points)] = self.history(since='2026-01-01')
+        self.assertListEqual([balance for _, balance in points], [wei, wei + 1])
+
+    def test_history_should_list_snapshots_of_the_range(self):
+        self.snapshot(moment(1), 5)
+        self.snapshot(moment(2), 10)
+        self.snapshot(moment(3), 20)
+        self.snapshot(moment(5), 30)
+        # The balance at `since` comes from the last snapshot before it
+        self.assertListEqual(self.history(since='2026-10-02T12:00:00Z', until='2026-10-05'), [
+            ('first', [(moment(2, 12), 10), (moment(3), 20)]),
+        ])
+
+    def test_history_should_return_the_last_balance_of_every_interval(self):
+        another = Address.objects.create(crypto='eth', address='second', owner=self.user)
+        self.snapshot(moment(1, 1), 5)
+        self.snapshot(moment(1, 20), 7)
+        self.snapshot(moment(3, 4), 9)
+        self.snapshot(moment(1, 2), 100, address=another)
+        self.assertListEqual(self.history(since='2026-10-01', until='2026-10-10', interval='day'), [
+            ('first', [(moment(1), 7), (moment(3), 9)]),
+            ('second', [(moment(1), 100)]),
+        ])
+        self.assertListEqual(self.history(since='2026-10-01', until='2026-10-10', interval='day', crypto='eth'), [
+            ('second', [(moment(1), 100)]),
+        ])
+
+    def test_history_should_only_list_my_addresses(self):
+        another = get_user_model().objects.create(username='history-another', password='pass')
+        self.snapshot(moment(1), 5, address=Address.objects.create(crypto='btc', address='first', owner=another))
+        self.assertListEqual(self.history(since='2026-10-01', until='2026-10-10'), [('first', [])])
+
+    def test_history_should_reject_malformed_queries(self):
+        for params in ({'since': 'yesterday'}, {'since': '2026-10-02', 'until': '2026-10-01'}, {'interval': 'month'}):
+            response = self.client.get(reverse('my-balance-history'), params)
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
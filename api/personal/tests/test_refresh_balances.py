@@ -0,0 +1,74 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.crypto.models import Address, BalanceTotal
+
+
+def balances(crypto, addresses):
+    return [{'crypto': crypto, 'address': address, 'balance': 1} if address != 'failing' else
+            {'crypto': crypto, 'address': address, 'balance': None, 'error': 'Failed'} for address in addresses]
+
+
+@override_settings(BLOCKCHAIN_CLIENT_SHARED_CACHE='default')
+class TestRefreshBalances(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='refresh', password='pass')
+        self.another_user = get_user_model().objects.create(username='refresh-another', password='pass')
+
+    @patch('api.blockchain_client.client.BlockchainClient.fetch_balances', side_effect=balances)
+    def test_should_refresh_most_recently_queried_addresses_first(self, mock):
+        now = timezone.now()
+        Address.objects.create(crypto='btc', address='never', owner=self.user)
+        Address.objects.create(crypto='btc', address='old', owner=self.user, balance_queried=now - timedelta(days=1))
+        Address.objects.create(crypto='eth', address='recent', owner=self.user, balance_queried=now)
+        # Watched by two users, the most recent query counts
+        Address.objects.create(crypto='btc', address='shared', owner=self.user, balance_queried=now - timedelta(days=2))
+        Address.objects.create(crypto='btc', address='shared', owner=self.another_user,
+                               balance_queried=now - timedelta(hours=1))
+        with override_settings(BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE=1, BLOCKCHAIN_CLIENT_FAN_OUT=1):
+            call_command('refresh_balances', once=True, stdout=StringIO())
+        self.assertListEqual([call.args for call in mock.call_args_list], [
+            ('eth', ['recent']), ('btc', ['shared']), ('btc', ['old']), ('btc', ['never'])])
+
+    @patch('api.blockchain_client.client.BlockchainClient.fetch_balances', side_effect=balances)
+    def test_should_group_addresses_by_crypto_and_report_failures(self, mock):
+        for crypto, address in [('btc', 'first'), ('eth', 'failing'), ('btc', 'second')]:
+            Address.objects.create(crypto=crypto, address=address, owner=self.user)
+        out = StringIO()
+        call_command('refresh_balances', once=True, stdout=out)
+        self.assertEqual(mock.call_count, 2)
+        self.assertIn('Refreshed 2 balances (1 failed)', out.getvalue())
+
+    @patch('api.blockchain_client.client.BlockchainClient.fetch_balances', side_effect=balances)
+    def test_should_respect_limit(self, mock):
+        for address in ['first', 'second', 'third']:
+            Address.objects.create(crypto='btc', address=address, owner=self.user)
+        call_command('refresh_balances', once=True, limit=2, stdout=StringIO())
+        self.assertEqual(len(mock.call_args.args[1]), 2)
+
+    @patch('api.blockchain_client.client.BlockchainClient.fetch_balances', side_effect=balances)
+    def test_should_keep_balance_totals_up_to_date(self, mock):
+        for crypto, address in [('btc', 'first'), ('btc', 'second'), ('eth', 'failing')]:
+            Address.objects.create(crypto=crypto, address=address, owner=self.user)
+        Address.objects.create(crypto='btc', address='first', owner=self.another_user)
+        call_command('refresh_balances', once=True, stdout=StringIO())
+        totals = BalanceTotal.objects.order_by('owner_id', 'crypto').values_list(
+            'owner__username', 'crypto', 'balance', 'addresses')
+        self.assertListEqual(list(totals), [('refresh', 'btc', 2, 2), ('refresh-another', 'btc', 1, 1)])
+
+    @patch('api.blockchain_client.client.BlockchainClient.fetch_balances')
+    def test_should_keep_balances_beyond_64_bits_exact(self, mock):
+        wei = 2 ** 63 + 1
+        mock.return_value = [{'crypto': 'eth', 'address': 'first', 'balance': wei},
+                             {'crypto': 'eth', 'address': 'second', 'balance': wei * 10 ** 6}]
+        for address in ['first', 'second']:
+            Address.objects.create(crypto='eth', address=address, owner=self.user)
+        call_command('refresh_balances', once=True, stdout=StringIO())
+        self.assertEqual(Address.objects.get(address='first').balance, wei)
+        self.assertEqual(BalanceTotal.objects.get(owner=self.user).balance, wei * (10 ** 6 + 1))
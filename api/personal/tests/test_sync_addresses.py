@@ -0,0 +1,133 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.status import HTTP_204_NO_CONTENT
+from rest_framework.test import APIClient
+
+from api.blockchain_client.client import BlockchainClient
+from api.blockchain_client.index import TransactionIndex
+from api.blockchain_client.tests.test_blockchain_client import StubResponse, TRANSPORT_GET
+from api.blockchain_client.tests.test_index import UpstreamHistory, haskoin_transaction
+from api.crypto.models import Address
+
+
+class TestSyncAddresses(TestCase):
+    def setUp(self):
+        BlockchainClient.reset()
+        patcher = patch.object(BlockchainClient, 'transaction_index', TransactionIndex(chunk=4, sync_ttl=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create(username='sync', password='pass')
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        Address.objects.create(crypto='btc', address='watched', owner=self.user)
+
+    def sync(self):
+        out = StringIO()
+        call_command('sync_addresses', once=True, concurrency=1, stdout=out)
+        return out.getvalue()
+
+    def new_transactions(self):
+        return [(entry['address'], [tx['hash'] for tx in entry['transactions']])
+                for entry in self.client.get(reverse('my-new-transactions')).data]
+
+    @patch(TRANSPORT_GET)
+    def test_should_only_report_transactions_after_the_first_sync(self, mock):
+        history = mock.side_effect = UpstreamHistory(['tx1', 'tx0'])
+        self.assertIn('Synced 1 addresses (0 failed)', self.sync())
+        self.assertEqual(Address.objects.get().seen_hash, 'tx1')
+        self.assertListEqual(self.new_transactions(), [])
+
+        history.transactions[:0] = [haskoin_transaction('tx3'), haskoin_transaction('tx2')]
+        self.sync()
+        self.assertListEqual(self.new_transactions(), [('watched', ['tx3', 'tx2'])])
+
+    @patch(TRANSPORT_GET)
+    def test_sync_should_stop_at_the_newest_indexed_transaction(self, mock):
+        history = mock.side_effect = UpstreamHistory([f'tx{i}' for i in range(10, 0, -1)])
+        self.sync()
+        history.transactions.insert(0, haskoin_transaction('tx11'))
+        self.sync()
+        # A single page of the newest transactions, the older ones were not paged through again
+        self.assertEqual(mock.call_count, 2)
+        mock.assert_called_with('https://api.blockchain.info/haskoin-store/btc/address/watched/transactions/full',
+                                params={'limit': 4, 'offset': 0})
+
+    @patch(TRANSPORT_GET)
+    def test_seen_should_move_the_mark_to_the_newest_transaction(self, mock):
+        history = mock.side_effect = UpstreamHistory(['tx0'])
+        self.sync()
+        history.transactions.insert(0, haskoin_transaction('tx1'))
+        self.sync()
+        self.assertEqual(self.client.post(reverse('my-new-transactions')).status_code, HTTP_204_NO_CONTENT)
+        self.assertEqual(Address.objects.get().seen_hash, 'tx1')
+        self.assertListEqual(self.new_transactions(), [])
+
+    @patch(TRANSPORT_GET)
+    def test_new_transactions_should_take_the_same_queries_for_any_number_of_addresses(self, mock):
+        history = mock.side_effect = UpstreamHistory(['tx0'])
+        self.sync()
+        history.transactions[:0] = [haskoin_transaction('tx2'), haskoin_transaction('tx1')]
+        self.sync()
+        with CaptureQueriesContext(connection) as one:
+            self.assertListEqual(self.new_transactions(), [('watched', ['tx2', 'tx1'])])
+        for address in ('second', 'third'):
+            Address.objects.create(crypto='btc', address=address, owner=self.user, seen_hash='tx1')
+        self.sync()
+        with CaptureQueriesContext(connection) as three, override_settings(MY_NEW_TRANSACTIONS_LIMIT=1):
+            self.assertListEqual(self.new_transactions(),
+                                 [('watched', ['tx2']), ('second', ['tx2']), ('third', ['tx2'])])
+        self.assertEqual(len(three), len(one))
+        with CaptureQueriesContext(connection) as marked:
+            self.client.post(reverse('my-new-transactions'))
+        self.assertListEqual(self.new_transactions(), [])
+        self.assertLessEqual(len(marked), len(one) + 1)
+
+    @override_settings(MY_BALANCES_PAGE_SIZE=1)
+    @patch(TRANSPORT_GET)
+    def test_new_transactions_should_be_paginated_like_my_balances(self, mock):
+        mock.side_effect = UpstreamHistory(['tx1', 'tx0'])
+        Address.objects.create(crypto='btc', address='second', owner=self.user, seen_hash='tx0')
+        Address.objects.filter(address='watched').update(seen_hash='tx0')
+        self.sync()
+        response = self.client.get(reverse('my-new-transactions'))
+        self.assertListEqual([entry['address'] for entry in response.data['results']], ['watched'])
+        response = self.client.get(response.data['next'])
+        self.assertListEqual([entry['address'] for entry in response.data['results']], ['second'])
+        self.assertIsNone(response.data['next'])
+
+    @patch(TRANSPORT_GET)
+    def test_should_report_failed_syncs(self, mock):
+        mock.return_value = StubResponse({}, 404)
+        self.assertIn('Synced 0 addresses (1 failed)', self.sync())
+        self.assertIsNone(Address.objects.get().seen_hash)
+
+    @patch(TRANSPORT_GET)
+    def test_database_errors_should_only_fail_their_address(self, mock):
+        mock.side_effect = UpstreamHistory(['tx0'])
+        Address.objects.create(crypto='btc', address='locked', owner=self.user)
+        sync_address = BlockchainClient.sync_address
+
+        def locked(crypto, address):
+            if address == 'locked':
+                raise OperationalError('database is locked')
+            return sync_address(crypto, address)
+
+        with patch.object(BlockchainClient, 'sync_address', side_effect=locked), self.assertLogs(level='ERROR'):
+            self.assertIn('Synced 1 addresses (1 failed)', self.sync())
+        self.assertEqual(Address.objects.get(address='watched').seen_hash, 'tx0')
+
+    @patch(TRANSPORT_GET)
+    def test_sync_should_fall_back_to_the_index_when_indexed_concurrently(self, mock):
+        mock.side_effect = UpstreamHistory(['tx0'])
+        self.sync()
+        with patch.object(TransactionIndex, 'sync_address', side_effect=IntegrityError()):
+            self.assertEqual(BlockchainClient.sync_address('btc', 'watched'), 'tx0')
@@ -1,11 +1,12 @@
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.authtoken.models import Token
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND, \
-    HTTP_400_BAD_REQUEST
+from rest_framework.exceptions import APIException
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED, \
+    HTTP_404_NOT_FOUND, HTTP_400_BAD_REQUEST
 from rest_framework.test import APIClient
 
 from api.blockchain_client.serializers import AddressWithBalance
@@ -25,7 +26,7 @@ class TestMyAddressViews(TestCase):
 
     def test_list_should_list_my_addresses(self):
         another_user = get_user_model().objects.create(username='my-address-another', password='pass')
-        address = 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224'
+        address = 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'
         expected = []
         for i in range(2):
             addr = Address(crypto='btc', address=f'{address}{i}', owner=self.user)
@@ -42,63 +43,147 @@ class TestMyAddressViews(TestCase):
     def test_create_should_create_address_for_me(self):
         self.assertFalse(Address.objects.filter(
             owner=self.user,
-            address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224',
+            address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d',
             crypto='btc').exists())
         response = self.client.post(
             reverse('my-address'),
-            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224', 'crypto': 'btc'})
+            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'crypto': 'btc'})
         self.assertEqual(response.status_code, HTTP_201_CREATED)
         self.assertTrue(Address.objects.filter(
             owner=self.user,
-            address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224',
+            address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d',
             crypto='btc').exists())
 
     def test_create_should_NOT_allow_duplicates(self):
         response = self.client.post(
             reverse('my-address'),
-            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224', 'crypto': 'btc'})
+            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'crypto': 'btc'})
         self.client.post(
             reverse('my-address'),
-            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224', 'crypto': 'btc'})
+            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'crypto': 'btc'})
         duplicate = self.client.post(
             reverse('my-address'),
-            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224', 'crypto': 'btc'})
+            {'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', 'crypto': 'btc'})
         self.assertTrue(response.status_code, HTTP_200_OK)
         self.assertEqual(duplicate.status_code, HTTP_400_BAD_REQUEST)
         self.assertDictEqual(duplicate.data,
                              {'non_field_errors': ['The fields crypto, address, owner must make a unique set.']})
 
     def test_delete_should_delete_my_address(self):
-        addr = Address(crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224', owner=self.user)
+        addr = Address(crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', owner=self.user)
         addr.save()
         self.assertTrue(Address.objects.filter(pk=addr.pk).exists())
-        url = reverse('my-address-detail', kwargs={'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224'})
+        url = reverse('my-address-detail', kwargs={'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'})
         response = self.client.delete(url + '?crypto=btc')  # Passing data query params don't work with delete..
         self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
         self.assertFalse(Address.objects.filter(pk=addr.pk).exists())
 
     def test_delete_should_return_404_if_address_does_not_exist(self):
-        url = reverse('my-address-detail', kwargs={'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224'})
+        url = reverse('my-address-detail', kwargs={'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'})
         response = self.client.delete(url + '?crypto=btc')  # Passing data query params don't work with delete..
         self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
 
-    @patch('api.blockchain_client.client.BlockchainClient.address_balance')
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
     def test_my_balance_should_show_list_of_my_addresses_with_balances(self, mock):
         another_user = get_user_model().objects.create(username='my-address-another', password='pass')
         Address(crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d', owner=self.user).save()
         Address(crypto='bch', address='qqtgm0njzgctkmhc28q6530zvjs0pjedxq4d4r7qfr', owner=another_user).save()
-        mock.return_value = AddressWithBalance().to_representation({
+        mock.return_value = AddressWithBalance(many=True).to_representation([{
             'crypto': 'btc',
             'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d',
-            'balance': 1000})
+            'balance': 1000}])
         response = self.client.get(reverse('my-balance'))
-        mock.assert_called_once_with(crypto='btc', address='bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d')
+        mock.assert_called_once_with('btc', ['bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d'])
         self.assertEqual(response.status_code, HTTP_200_OK)
         self.assertListEqual(response.data, [{
             'address': 'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph224d',
             'crypto': 'btc',
             'balance': 1000}])
 
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_my_balance_should_mark_failed_addresses_and_keep_order(self, mock):
+        def balances(crypto, addresses):
+            if crypto == 'eth':
+                raise APIException('Failed to retrieve balances for 1 addresses')
+            return [{'crypto': crypto, 'address': address, 'balance': len(address)} for address in addresses]
+
+        mock.side_effect = balances
+        for crypto, address in [('btc', 'first'), ('eth', 'failing'), ('bch', 'third'), ('btc', 'fourth')]:
+            Address(crypto=crypto, address=address, owner=self.user).save()
+        response = self.client.get(reverse('my-balance'))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertListEqual(response.data, [
+            {'crypto': 'btc', 'address': 'first', 'balance': 5},
+            {'crypto': 'eth', 'address': 'failing', 'balance': None,
+             'error': 'Failed to retrieve balances for 1 addresses'},
+            {'crypto': 'bch', 'address': 'third', 'balance': 5},
+            {'crypto': 'btc', 'address': 'fourth', 'balance': 6},
+        ])
+        self.assertEqual(mock.call_count, 3)
+
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_my_balance_should_mark_addresses_as_queried_once_per_resolution(self, mock):
+        mock.side_effect = lambda crypto, addresses: [
+            {'crypto': crypto, 'address': address, 'balance': 0} for address in addresses]
+        address = Address.objects.create(crypto='btc', address='first', owner=self.user)
+        self.client.get(reverse('my-balance'))
+        address.refresh_from_db()
+        queried = address.balance_queried
+        self.assertIsNotNone(queried)
+        self.client.get(reverse('my-balance'))
+        address.refresh_from_db()
+        self.assertEqual(address.balance_queried, queried)
+
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_my_balance_should_answer_unchanged_balances_with_304(self, mock):
+        balance = {'crypto': 'btc', 'address': 'first', 'balance': 1}
+        mock.side_effect = lambda crypto, addresses: [balance]
+        Address.objects.create(crypto='btc', address='first', owner=self.user)
+        response = self.client.get(reverse('my-balance'))
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        response = self.client.get(reverse('my-balance'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        balance['balance'] = 2
+        response = self.client.get(reverse('my-balance'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data[0]['balance'], 2)
+
+    @override_settings(MY_BALANCES_PAGE_SIZE=2)
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_my_balance_should_only_fetch_balances_of_the_page(self, mock):
+        mock.side_effect = lambda crypto, addresses: [
+            {'crypto': crypto, 'address': address, 'balance': 1} for address in addresses]
+        for address in ['first', 'second', 'third']:
+            Address.objects.create(crypto='btc', address=address, owner=self.user)
+        response = self.client.get(reverse('my-balance'))
+        self.assertListEqual([balance['address'] for balance in response.data['results']], ['first', 'second'])
+        mock.assert_called_once_with('btc', ['first', 'second'])
+        response = self.client.get(response.data['next'])
+        self.assertListEqual([balance['address'] for balance in response.data['results']], ['third'])
+        self.assertIsNone(response.data['next'])
+        mock.assert_called_with('btc', ['third'])
+
+    @patch('api.blockchain_client.client.BlockchainClient.address_balances')
+    def test_my_balance_totals_should_follow_fetched_balances(self, mock):
+        balances = {'first': 10, 'second': 5}
+        mock.side_effect = lambda crypto, addresses: [
+            {'crypto': crypto, 'address': address, 'balance': balances[address]} for address in addresses]
+        Address.objects.create(crypto='eth', address='first', owner=self.user)
+        Address.objects.create(crypto='eth', address='second', owner=self.user)
+        self.client.get(reverse('my-balance'))
+        balances['first'] = 20
+        self.client.get(reverse('my-balance'))
+        response = self.client.get(reverse('my-balance-totals'))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['crypto'], 'eth')
+        self.assertEqual(response.data[0]['balance'], 25)
+        self.assertEqual(response.data[0]['addresses'], 2)
+        # Removed addresses leave the totals
+        self.client.delete(reverse('my-address-detail', kwargs={'address': 'first'}) + '?crypto=eth')
+        self.assertEqual(self.client.get(reverse('my-balance-totals')).data[0]['balance'], 5)
+
     def test_my_balance_should_return_empty_list_if_no_balances_exist(self):
         response = self.client.get(reverse('my-balance'))
         self.assertEqual(response.status_code, HTTP_200_OK)
@@ -0,0 +1,53 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from api.crypto.models import Address, BalanceSnapshot, BalanceTotal
+
+# Per owner and cryptocurrency totals of the last fetched balances (BalanceTotal). Fetched balances are stored
+# on the addresses watching them, the totals of owners whose balances changed are summed up again from those
+# (in Python, the balances are integer strings in the database).
+# Changed balances are appended to the history of the addresses (BalanceSnapshot) as well.
+
+
+def record_balances(balances):
+    # Fetched balances, as returned by the blockchain client (failed ones are skipped)
+    by_crypto = {}
+    for balance in balances:
+        if balance.get('error') is None and balance.get('balance') is not None:
+            by_crypto.setdefault(balance['crypto'], {})[balance['address']] = balance['balance']
+
+    for crypto, fetched in by_crypto.items():
+        rows = Address.objects.filter(crypto=crypto, address__in=fetched).values_list(
+            'pk', 'address', 'balance', 'owner_id')
+        changed = {}
+        snapshots = []
+        now = timezone.now()
+        for pk, address, stored, owner in rows:
+            # Both are ints, exact at any size
+            if stored != fetched[address]:
+                changed.setdefault(address, set()).add(owner)
+                snapshots.append(BalanceSnapshot(address_id=pk, timestamp=now, balance=fetched[address]))
+        for address in changed:
+            Address.objects.filter(crypto=crypto, address=address).update(balance=fetched[address])
+        BalanceSnapshot.objects.bulk_create(snapshots)
+        update_totals({owner for owners in changed.values() for owner in owners}, crypto)
+
+
+def update_totals(owners, crypto):
+    if not owners:
+        return
+    sums = {}
+    for owner, balance in Address.objects.filter(
+            owner_id__in=owners, crypto=crypto, balance__isnull=False).values_list('owner_id', 'balance').iterator():
+        total, count = sums.get(owner, (0, 0))
+        sums[owner] = (total + balance, count + 1)
+    now = timezone.now()
+    for owner in owners:
+        total, count = sums.get(owner, (0, 0))
+        fields = {'balance': total, 'addresses': count, 'updated': now}
+        try:
+            with transaction.atomic():
+                BalanceTotal.objects.update_or_create(owner_id=owner, crypto=crypto, defaults=fields)
+        except IntegrityError:
+            # Created by another worker in the meantime
+            BalanceTotal.objects.filter(owner_id=owner, crypto=crypto).update(**fields)
@@ -1,9 +1,18 @@
+from django.conf import settings
 from django.conf.urls import re_path
 
-from .views import MyAddressView, MyAddressDestroyView, MyBalanceView
+from . import async_views
+from .views import MyAddressView, MyAddressBulkView, MyAddressBulkDeleteView, MyAddressDestroyView, MyBalanceView, \
+    MyBalanceHistoryView, MyBalanceTotalsView, MyNewTransactionsView
 
 urlpatterns = [
     re_path(r'addresses/$', MyAddressView.as_view(), name='my-address'),
+    re_path(r'addresses/bulk/$', MyAddressBulkView.as_view(), name='my-address-bulk'),
+    re_path(r'addresses/bulk/delete/$', MyAddressBulkDeleteView.as_view(), name='my-address-bulk-delete'),
     re_path(r'addresses/(?P<address>\w+)/$', MyAddressDestroyView.as_view(), name='my-address-detail'),
-    re_path(r'balances/$', MyBalanceView.as_view(), name='my-balance')
+    re_path(r'transactions/new/$', MyNewTransactionsView.as_view(), name='my-new-transactions'),
+    re_path(r'balances/history/$', MyBalanceHistoryView.as_view(), name='my-balance-history'),
+    re_path(r'balances/totals/$', MyBalanceTotalsView.as_view(), name='my-balance-totals'),
+    re_path(r'balances/$', async_views.my_balances if settings.ASYNC_VIEWS else MyBalanceView.as_view(),
+            name='my-balance')
 ]
@@ -1,12 +1,20 @@
-import logging
+from datetime import timedelta
 
-from rest_framework.generics import DestroyAPIView, ListCreateAPIView
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.generics import DestroyAPIView, ListAPIView, ListCreateAPIView
 from rest_framework.response import Response
+from rest_framework.status import HTTP_204_NO_CONTENT
 from rest_framework.views import APIView
 
 from api.blockchain_client.client import BlockchainClient
-from api.crypto.models import Address
-from api.crypto.serializers import AddressSerializer
+from api.crypto.conditional import RenderedResponse, conditional_response
+from api.crypto.models import Address, BalanceTotal
+from api.crypto.pagination import BalanceCursorPagination
+from api.crypto.serializers import AddressSerializer, BalanceTotalSerializer
+from .bulk import delete_addresses, import_addresses
+from .history import balance_history
+from .totals import record_balances, update_totals
 
 
 class MyAddressView(ListCreateAPIView):
@@ -33,12 +41,103 @@ class MyAddressDestroyView(DestroyAPIView):
     def filter_queryset(self, queryset):
         return queryset.filter(owner=self.request.user, crypto=self.request.query_params.get('crypto'))
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        update_totals({instance.owner_id}, instance.crypto)
+
+
+class MyAddressBulkView(APIView):
+    # Adds the uploaded addresses (see bulk.py), answers with what happened to the rows
+    def post(self, request, *args, **kwargs):
+        return Response(data=import_addresses(request).as_dict())
+
+
+class MyAddressBulkDeleteView(APIView):
+    # Removes the uploaded addresses, same uploads as MyAddressBulkView
+    def post(self, request, *args, **kwargs):
+        return Response(data=delete_addresses(request).as_dict())
+
+
+def mark_balances_queried(user):
+    # Lets refresh_balances prioritize addresses whose owners look at them
+    now = timezone.now()
+    Address.objects.filter(owner=user).exclude(
+        balance_queried__gt=now - timedelta(seconds=settings.BALANCE_QUERIED_RESOLUTION)
+    ).update(balance_queried=now)
+
+
+class MyNewTransactionsView(APIView):
+    # Transactions of my addresses newer than the ones I have seen, as far as sync_addresses has indexed them.
+    # Paginated like /my/balances/ (MY_BALANCES_PAGE_SIZE). POST marks them as seen, on all my addresses.
+
+    def addresses(self):
+        return Address.objects.filter(owner=self.request.user).order_by('pk').only('crypto', 'address', 'seen_hash')
+
+    def get(self, *args, **kwargs):
+        paginator, addresses = addresses_page(self.request, self.addresses().exclude(seen_hash=None))
+        new = BlockchainClient.new_transactions(
+            [(address.crypto, address.address, address.seen_hash) for address in addresses],
+            settings.MY_NEW_TRANSACTIONS_LIMIT)
+        result = [{'crypto': address.crypto, 'address': address.address, 'since': address.seen_hash,
+                   'transactions': new[(address.crypto, address.address)]}
+                  for address in addresses if (address.crypto, address.address) in new]
+        return Response(data=paginated(paginator, result))
+
+    def post(self, *args, **kwargs):
+        addresses = list(self.addresses())
+        newest = BlockchainClient.newest_transactions([(address.crypto, address.address) for address in addresses])
+        changed = []
+        for address in addresses:
+            hash = newest.get((address.crypto, address.address))
+            if hash is not None and hash != address.seen_hash:
+                address.seen_hash = hash
+                changed.append(address)
+        Address.objects.bulk_update(changed, ['seen_hash'], batch_size=settings.BULK_ADDRESSES_BATCH_SIZE)
+        return Response(status=HTTP_204_NO_CONTENT)
+
+
+def addresses_page(request, addresses):
+    # (pagination or None, addresses of the page) of my addresses, all of them without MY_BALANCES_PAGE_SIZE
+    if not settings.MY_BALANCES_PAGE_SIZE:
+        return None, list(addresses)
+    paginator = BalanceCursorPagination()
+    return paginator, paginator.paginate_queryset(addresses, request)
+
+
+def balances_page(request, addresses):
+    # addresses_page as (crypto, address)
+    paginator, page = addresses_page(request, addresses.only('crypto', 'address'))
+    return paginator, [(address.crypto, address.address) for address in page]
+
+
+def paginated(paginator, data):
+    return data if paginator is None else paginator.get_paginated_response(data).data
+
 
 class MyBalanceView(APIView):
-    # Should be paginated
+    # Cursor paginated with MY_BALANCES_PAGE_SIZE, MyBalanceTotalsView has the totals of all of them
+    def get(self, *args, **kwargs):
+        mark_balances_queried(self.request.user)
+        # Could have this in custom object manager
+        addresses = Address.objects.filter(owner=self.request.user).order_by('pk')
+        paginator, addresses = balances_page(self.request, addresses)
+        balances = BlockchainClient.balances(addresses)
+        record_balances(balances)
+        # The ETag is the hash of the balances, so they are looked up for a 304 as well
+        return conditional_response(self.request, paginated(paginator, balances), RenderedResponse)
+
+
+class MyBalanceTotalsView(ListAPIView):
+    # Totals per cryptocurrency of the last fetched balances of my addresses, as of 'updated'
+    queryset = BalanceTotal.objects.all()
+    serializer_class = BalanceTotalSerializer
+
+    def filter_queryset(self, queryset):
+        return queryset.filter(owner=self.request.user).order_by('crypto')
+
+
+class MyBalanceHistoryView(APIView):
+    # Balances of my addresses over time (see history.py), ?since=&until= (the last BALANCE_HISTORY_DEFAULT_DAYS days
+    # by default), optionally of one ?crypto= and ?address= and downsampled with ?interval=hour|day|week
     def get(self, *args, **kwargs):
-        result = []
-        for address in Address.objects.filter(owner=self.request.user):  # Could have this in custom object manager
-            logging.info(f'{address.address} {address.crypto}')
-            result.append(BlockchainClient.address_balance(crypto=address.crypto, address=address.address))
-        return Response(data=result)
+        return Response(data=balance_history(self.request.user, self.request.query_params))
@@ -0,0 +1,151 @@
+# Local stand-in for the blockchain.info / haskoin-store endpoints the handlers use, for load tests.
+#   python -m benchmarks.fake_upstream [--port 8001] [--latency 50] [--jitter 20] [--error-rate 0.01] [--inputs 1000]
+# and run the API with BLOCKCHAIN_INFO_URL=http://localhost:8001
+# Responses are generated from the requested address / hash, so repeated requests get the same data.
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TIME = 1620513287
+
+
+def number(text, modulo):
+    return int(hashlib.sha1(text.encode()).hexdigest(), 16) % modulo
+
+
+def haskoin_io(tx, index):
+    return {
+        'address': f'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph{number(f"{tx}:{index}", 10 ** 6):06d}',
+        'value': number(f'{tx}:{index}', 10 ** 8),
+        'txid': hashlib.sha256(f'{tx}:{index}'.encode()).hexdigest(),
+        'output': index,
+        'sigscript': 'ab' * 53,
+        'sequence': 4294967295,
+        'pkscript': '0014' + 'cd' * 20,
+        'witness': ['ef' * 36, '01' * 33],
+    }
+
+
+class Upstream:
+    def __init__(self, inputs, outputs, history):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.history = history
+
+    def haskoin_balance(self, address):
+        return {'address': address, 'confirmed': number(address, 10 ** 10), 'unconfirmed': 0, 'utxo': 1, 'txs': 2,
+                'received': number(address, 10 ** 11)}
+
+    def haskoin_transaction(self, tx):
+        return {
+            'txid': tx,
+            'size': 250 * self.inputs,
+            'version': 2,
+            'locktime': 0,
+            'fee': 1000,
+            'inputs': [haskoin_io(tx, i) for i in range(self.inputs)],
+            'outputs': [haskoin_io(tx, -i - 1) for i in range(self.outputs)],
+            'block': {'height': 682000 + number(tx, 1000), 'position': 1},
+            'time': TIME + number(tx, 10 ** 6),
+        }
+
+    def eth_transaction(self, tx):
+        return {
+            'hash': tx,
+            'from': '0x' + hashlib.sha1(f'{tx}:from'.encode()).hexdigest(),
+            'to': '0x' + hashlib.sha1(f'{tx}:to'.encode()).hexdigest(),
+            'value': str(number(tx, 10 ** 20)),
+            'state': 'CONFIRMED',
+            'timestamp': str(TIME + number(tx, 10 ** 6)),
+        }
+
+    def history_page(self, address, offset, limit):
+        return [f'{address}:{i}' for i in range(offset, min(offset + limit, self.history))]
+
+    def route(self, path, query):
+        # Returns (status, data), None when nothing matches
+        match = re.fullmatch(r'/haskoin-store/(btc|bch)/address/balances', path)
+        if match:
+            return 200, [self.haskoin_balance(address) for address in query.get('addresses', '').split(',')]
+        match = re.fullmatch(r'/haskoin-store/(btc|bch)/address/([^/]+)/balance', path)
+        if match:
+            return 200, self.haskoin_balance(match.group(2))
+        match = re.fullmatch(r'/haskoin-store/(btc|bch)/address/([^/]+)/transactions/full', path)
+        if match:
+            hashes = self.history_page(match.group(2), int(query.get('offset', 0)), int(query.get('limit', 100)))
+            return 200, [self.haskoin_transaction(hashlib.sha256(h.encode()).hexdigest()) for h in hashes]
+        match = re.fullmatch(r'/haskoin-store/(btc|bch)/transaction/([^/]+)', path)
+        if match:
+            return 200, self.haskoin_transaction(match.group(2))
+        match = re.fullmatch(r'/eth/account/([^/]+)/balance', path)
+        if match:
+            return 200, {address: {'balance': str(number(address, 10 ** 20)), 'nonce': 1}
+                         for address in match.group(1).split(',')}
+        match = re.fullmatch(r'/v2/eth/data/account/([^/]+)/transactions', path)
+        if match:
+            size = int(query.get('size', 100))
+            hashes = self.history_page(match.group(1), int(query.get('page', 0)) * size, size)
+            return 200, {'transactions': [self.eth_transaction('0x' + hashlib.sha256(h.encode()).hexdigest())
+                                          for h in hashes]}
+        match = re.fullmatch(r'/v2/eth/data/transaction/([^/]+)', path)
+        if match:
+            return 200, self.eth_transaction(match.group(1))
+        return None
+
+
+def handler_class(upstream, latency, jitter, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            time.sleep(max(0, random.gauss(latency, jitter)) / 1000)
+            if random.random() < error_rate:
+                self.respond(500, {'error': 'server-error'})
+                return
+            routed = upstream.route(url.path, query)
+            self.respond(*(routed or (404, {'error': 'not-found'})))
+
+        def respond(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=50, help='mean response latency in ms')
+    parser.add_argument('--jitter', type=float, default=10, help='standard deviation of the latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with a 500')
+    parser.add_argument('--inputs', type=int, default=2, help='inputs per BTC/BCH transaction')
+    parser.add_argument('--outputs', type=int, default=2, help='outputs per BTC/BCH transaction')
+    parser.add_argument('--history', type=int, default=200, help='transactions per address')
+    args = parser.parse_args()
+
+    upstream = Upstream(inputs=args.inputs, outputs=args.outputs, history=args.history)
+    server = ThreadingHTTPServer(('', args.port), handler_class(upstream, args.latency, args.jitter, args.error_rate))
+    server.daemon_threads = True
+    print(f'Fake upstream listening on http://localhost:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# Drives the API at a fixed concurrency and reports latency percentiles, throughput and server CPU per request.
+#   python -m benchmarks.load --setup 100                     # creates the benchmark user with 100 watched addresses
+#   python -m benchmarks.load --scenario my-balances --concurrency 16 --duration 30 --pid <gunicorn master pid>
+# Run the API against benchmarks/fake_upstream.py (BLOCKCHAIN_INFO_URL=http://localhost:8001) for stable numbers.
+# --keys is the number of distinct addresses / transactions requested, fewer keys mean more cache hits.
+import argparse
+import os
+import random
+import threading
+import time
+
+import requests
+
+SCENARIOS = ['address-transactions', 'transaction', 'my-balances', 'balances']
+CRYPTOS = ['btc', 'bch', 'eth']
+USERNAME = 'benchmark'
+
+
+def address(crypto, key):
+    if crypto == 'eth':
+        return f'0x{key:040x}'
+    return f'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5p{key:07d}'
+
+
+def transaction(crypto, key):
+    return f'0x{key:064x}' if crypto == 'eth' else f'{key:064x}'
+
+
+def request_for(scenario, keys):
+    # Returns (method, path, json body)
+    crypto = random.choice(CRYPTOS)
+    key = random.randrange(keys)
+    if scenario == 'address-transactions':
+        return 'GET', f'/crypto/{crypto}/addresses/{address(crypto, key)}/transactions/?page={key % 3}', None
+    if scenario == 'transaction':
+        return 'GET', f'/crypto/{crypto}/transactions/{transaction(crypto, key)}/', None
+    if scenario == 'my-balances':
+        return 'GET', '/my/balances/', None
+    addresses = [address(crypto, (key + i) % keys) for i in range(20)]
+    return 'POST', f'/crypto/{crypto}/balances/', {'addresses': addresses}
+
+
+def benchmark_token(watched=None):
+    # Uses the same database as the API server, so has to run from the same checkout and environment.
+    # Replaces the watched addresses of the benchmark user when watched is given.
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    django.setup()
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+    from api.crypto.models import Address
+
+    user, _ = get_user_model().objects.get_or_create(username=USERNAME)
+    if watched is not None:
+        Address.objects.filter(owner=user).delete()
+        Address.objects.bulk_create([
+            Address(crypto=CRYPTOS[i % len(CRYPTOS)], address=address(CRYPTOS[i % len(CRYPTOS)], i), owner=user)
+            for i in range(watched)
+        ])
+    token, _ = Token.objects.get_or_create(user=user)
+    return token.key
+
+
+def process_tree(pid):
+    # pid and all of its descendants, e.g. a gunicorn master and its workers
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def cpu_seconds(pid):
+    # user + system time of the process tree, from /proc/<pid>/stat (Linux only)
+    ticks = 0
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run(url, token, scenario, concurrency, duration, keys, timeout):
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        session = requests.Session()
+        session.headers['Authorization'] = f'Token {token}'
+        while time.monotonic() < deadline:
+            method, path, body = request_for(scenario, keys)
+            started = time.monotonic()
+            try:
+                status = session.request(method, url + path, json=body, timeout=timeout).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.monotonic() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--token', help='API token, defaults to the one of the benchmark user')
+    parser.add_argument('--setup', type=int, metavar='ADDRESSES',
+                        help='(re)create the benchmark user with this many watched addresses and exit')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='address-transactions')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--keys', type=int, default=1000, help='distinct addresses / transactions to request')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per request')
+    parser.add_argument('--pid', type=int, help='API server pid, its process tree is measured for CPU time')
+    args = parser.parse_args()
+
+    if args.setup is not None:
+        print(f'Token of {USERNAME}: {benchmark_token(args.setup)}')
+        return
+    token = args.token or benchmark_token()
+    if args.warmup:
+        run(args.url, token, args.scenario, args.concurrency, args.warmup, args.keys, args.timeout)
+
+    cpu = cpu_seconds(args.pid) if args.pid else None
+    started = time.monotonic()
+    latencies, statuses = run(args.url, token, args.scenario, args.concurrency, args.duration, args.keys, args.timeout)
+    elapsed = time.monotonic() - started
+    if cpu is not None:
+        cpu = cpu_seconds(args.pid) - cpu
+
+    print(f'{args.scenario}: {len(latencies)} requests in {elapsed:.1f}s at concurrency {args.concurrency}')
+    print(f'  throughput: {len(latencies) / elapsed:9.1f} requests/s')
+    for p in (50, 95, 99):
+        print(f'  p{p}:        {percentile(latencies, p) * 1000:9.1f} ms')
+    print(f'  max:        {(latencies[-1] if latencies else 0) * 1000:9.1f} ms')
+    if cpu is not None and latencies:
+        print(f'  server cpu: {cpu / len(latencies) * 1000:9.2f} ms per request')
+    print(f'  statuses:   {", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str))}')
+
+
+if __name__ == '__main__':
+    main()
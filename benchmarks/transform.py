@@ -0,0 +1,51 @@
+# Compares the fast path transaction transformer with the DRF serializers it replaces.
+#   python -m benchmarks.transform [--transactions 50] [--inputs 300] [--repeat 20]
+import argparse
+import os
+import timeit
+from datetime import datetime
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+django.setup()
+
+from api.blockchain_client.serializers import TransactionsSerializer  # noqa: E402
+from api.blockchain_client.transformers import serialize_transactions  # noqa: E402
+
+
+def page(transactions, inputs):
+    def io(i):
+        return {'address': f'bc1q8c0wvzxjfeuzr6xhp7xyxjxjh8r0dsc5ph{i:06d}', 'value': 135974 + i, 'txid': 'ab' * 32}
+
+    return [{
+        'inputs': [io(i) for i in range(inputs)],
+        'outputs': [io(i) for i in range(2)],
+        'timestamp': datetime.fromtimestamp(1620513287 + t),
+    } for t in range(transactions)]
+
+
+def serializer(data):
+    serializer = TransactionsSerializer(data={'transactions': data})
+    serializer.is_valid(raise_exception=True)
+    return serializer.data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=50)
+    parser.add_argument('--inputs', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    data = page(args.transactions, args.inputs)
+    results = {}
+    for name, fn in [('serializer', serializer), ('fast path', lambda d: serialize_transactions(d, strict=False))]:
+        results[name] = min(timeit.repeat(lambda: fn(data), number=1, repeat=args.repeat))
+        print(f'{name:>10}: {results[name] * 1000:9.2f} ms per page')
+    print(f'   speedup: {results["serializer"] / results["fast path"]:9.1f}x '
+          f'({args.transactions} transactions, {args.inputs} inputs each)')
+
+
+if __name__ == '__main__':
+    main()
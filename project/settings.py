@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import json
 import os
 import logging
 from pathlib import Path
@@ -50,9 +51,11 @@ INSTALLED_APPS = [
     'api.authentication',
     'api.crypto',
     'api.personal',
+    'api.metrics',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +85,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'project.wsgi.application'
 
+# Serve the upstream bound views (address transactions, transaction detail, my balances) as async views.
+# Only useful when running under ASGI, e.g. gunicorn -k uvicorn.workers.UvicornWorker project.asgi:application
+ASYNC_VIEWS = bool(os.getenv('ASYNC_VIEWS'))
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -131,6 +138,21 @@ REST_FRAMEWORK = {
 }
 
 
+# Caches
+# 'shared' is visible to every worker on the host, point BLOCKCHAIN_CLIENT_SHARED_CACHE at it to share upstream results
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_LOCATION', '/tmp/cryptosearch-cache'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 100000))},
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -154,3 +176,146 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Search log (AddressSearch/TransactionSearch) durability mode, 'sync' unless set:
+#   'sync'     - every search is written on the request path, nothing is lost.
+#   'buffered' - searches are written in batches by a background thread, off the request path. They are flushed on
+#                graceful worker shutdown, but up to SEARCH_LOG_FLUSH_INTERVAL seconds of searches are lost on a crash.
+SEARCH_LOG_MODE = os.getenv('SEARCH_LOG_MODE', 'sync')
+SEARCH_LOG_BATCH_SIZE = int(os.getenv('SEARCH_LOG_BATCH_SIZE', 200))
+SEARCH_LOG_FLUSH_INTERVAL = float(os.getenv('SEARCH_LOG_FLUSH_INTERVAL', 2))
+SEARCH_LOG_PAGE_SIZE = int(os.getenv('SEARCH_LOG_PAGE_SIZE', 100))
+
+
+# Metrics
+# Share of requests whose stages (upstream, json decode, transform, serializer, search log) are timed
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+# Directory where every worker dumps its metrics (from a background thread, every METRICS_DUMP_INTERVAL seconds),
+# so /metrics and `manage.py metrics` cover all workers. Only the serving worker is reported when not set.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_DUMP_INTERVAL = int(os.getenv('METRICS_DUMP_INTERVAL', 10))
+# /metrics/ answers scrapers from these networks (comma separated addresses or CIDRs) without a token,
+# anyone else needs an admin user's token
+METRICS_ALLOWED_NETWORKS = os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.1,::1').split(',')
+
+# Blockchain client
+# Upstream API, e.g. http://localhost:8001 for benchmarks/fake_upstream.py
+BLOCKCHAIN_INFO_URL = os.getenv('BLOCKCHAIN_INFO_URL', 'https://api.blockchain.info')
+# Connection pool size per upstream host (per worker process) and connect/read timeouts in seconds
+BLOCKCHAIN_CLIENT_POOL_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_POOL_SIZE', 10))
+BLOCKCHAIN_CLIENT_CONNECT_TIMEOUT = float(os.getenv('BLOCKCHAIN_CLIENT_CONNECT_TIMEOUT', 3.05))
+BLOCKCHAIN_CLIENT_READ_TIMEOUT = float(os.getenv('BLOCKCHAIN_CLIENT_READ_TIMEOUT', 10))
+# In-flight requests per upstream host (per worker process) and per single fan-out request (e.g. /my/balances/)
+BLOCKCHAIN_CLIENT_MAX_CONCURRENCY = int(os.getenv('BLOCKCHAIN_CLIENT_MAX_CONCURRENCY', 10))
+BLOCKCHAIN_CLIENT_FAN_OUT = int(os.getenv('BLOCKCHAIN_CLIENT_FAN_OUT', 8))
+# Read timeouts follow the upstream's latency (TIMEOUT_FACTOR times its TIMEOUT_PERCENTILE latency),
+# between MIN_READ_TIMEOUT and READ_TIMEOUT
+BLOCKCHAIN_CLIENT_ADAPTIVE_TIMEOUT = os.getenv('BLOCKCHAIN_CLIENT_ADAPTIVE_TIMEOUT') != 'False'
+BLOCKCHAIN_CLIENT_MIN_READ_TIMEOUT = float(os.getenv('BLOCKCHAIN_CLIENT_MIN_READ_TIMEOUT', 1))
+BLOCKCHAIN_CLIENT_TIMEOUT_PERCENTILE = float(os.getenv('BLOCKCHAIN_CLIENT_TIMEOUT_PERCENTILE', 99))
+BLOCKCHAIN_CLIENT_TIMEOUT_FACTOR = float(os.getenv('BLOCKCHAIN_CLIENT_TIMEOUT_FACTOR', 3))
+# Circuit breaker per (upstream host, crypto): opens for BREAKER_OPEN_SECONDS when, out of the last BREAKER_WINDOW
+# calls (at least BREAKER_MIN_CALLS), the share of failures reaches BREAKER_FAILURE_RATE or the share of calls
+# slower than BREAKER_SLOW_CALL seconds reaches BREAKER_SLOW_RATE
+BLOCKCHAIN_CLIENT_BREAKER_WINDOW = int(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_WINDOW', 20))
+BLOCKCHAIN_CLIENT_BREAKER_MIN_CALLS = int(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_MIN_CALLS', 10))
+BLOCKCHAIN_CLIENT_BREAKER_FAILURE_RATE = float(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_FAILURE_RATE', 0.5))
+BLOCKCHAIN_CLIENT_BREAKER_SLOW_CALL = float(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_SLOW_CALL', 5))
+BLOCKCHAIN_CLIENT_BREAKER_SLOW_RATE = float(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_SLOW_RATE', 0.8))
+BLOCKCHAIN_CLIENT_BREAKER_OPEN_SECONDS = float(os.getenv('BLOCKCHAIN_CLIENT_BREAKER_OPEN_SECONDS', 30))
+# Retries of failed upstream calls, RETRY_ON lists the retried status classes (5xx, 429, timeout, connection).
+# Waits between retries grow exponentially from RETRY_BACKOFF up to RETRY_MAX_BACKOFF seconds (with full jitter),
+# no retry starts after RETRY_DEADLINE seconds. RETRY_POLICIES overrides these per crypto as JSON,
+# e.g. {"eth": {"retries": 0}} (keys: retries, backoff, max_backoff, deadline, retry_on).
+BLOCKCHAIN_CLIENT_RETRIES = int(os.getenv('BLOCKCHAIN_CLIENT_RETRIES', 2))
+BLOCKCHAIN_CLIENT_RETRY_BACKOFF = float(os.getenv('BLOCKCHAIN_CLIENT_RETRY_BACKOFF', 0.1))
+BLOCKCHAIN_CLIENT_RETRY_MAX_BACKOFF = float(os.getenv('BLOCKCHAIN_CLIENT_RETRY_MAX_BACKOFF', 2))
+BLOCKCHAIN_CLIENT_RETRY_DEADLINE = float(os.getenv('BLOCKCHAIN_CLIENT_RETRY_DEADLINE', 8))
+BLOCKCHAIN_CLIENT_RETRY_ON = os.getenv('BLOCKCHAIN_CLIENT_RETRY_ON', '5xx,429,timeout,connection').split(',')
+BLOCKCHAIN_CLIENT_RETRY_POLICIES = json.loads(os.getenv('BLOCKCHAIN_CLIENT_RETRY_POLICIES', '{}'))
+# Retries and hedges of an upstream may add RETRY_BUDGET_RATIO extra requests per call (plus
+# RETRY_BUDGET_MIN_PER_SECOND), so they cannot multiply the load of a failing upstream
+BLOCKCHAIN_CLIENT_RETRY_BUDGET_RATIO = float(os.getenv('BLOCKCHAIN_CLIENT_RETRY_BUDGET_RATIO', 0.2))
+BLOCKCHAIN_CLIENT_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('BLOCKCHAIN_CLIENT_RETRY_BUDGET_MIN_PER_SECOND', 1))
+# Transaction lookups send a second request once the first is slower than the HEDGE_PERCENTILE latency
+BLOCKCHAIN_CLIENT_HEDGE_TRANSACTIONS = bool(os.getenv('BLOCKCHAIN_CLIENT_HEDGE_TRANSACTIONS'))
+BLOCKCHAIN_CLIENT_HEDGE_PERCENTILE = float(os.getenv('BLOCKCHAIN_CLIENT_HEDGE_PERCENTILE', 95))
+BLOCKCHAIN_CLIENT_HEDGE_WORKERS = int(os.getenv('BLOCKCHAIN_CLIENT_HEDGE_WORKERS', 16))
+# Requests per second to an upstream host (unlimited when not set), with bursts of up to RATE_LIMIT_BURST requests.
+# Calls queue for a token for up to RATE_LIMIT_WAIT seconds (RATE_LIMIT_BACKGROUND_WAIT for background refreshes,
+# which leave a RATE_LIMIT_RESERVE share of the burst to interactive calls). The budget is per worker, unless
+# RATE_LIMIT_DIR is set: all processes using the directory then share it.
+BLOCKCHAIN_CLIENT_RATE_LIMIT = float(os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT', 0)) or None
+BLOCKCHAIN_CLIENT_RATE_LIMIT_BURST = float(os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT_BURST', 0)) or None
+BLOCKCHAIN_CLIENT_RATE_LIMIT_RESERVE = float(os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT_RESERVE', 0.5))
+BLOCKCHAIN_CLIENT_RATE_LIMIT_WAIT = float(os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT_WAIT', 2))
+BLOCKCHAIN_CLIENT_RATE_LIMIT_BACKGROUND_WAIT = float(os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT_BACKGROUND_WAIT', 30))
+BLOCKCHAIN_CLIENT_RATE_LIMIT_DIR = os.getenv('BLOCKCHAIN_CLIENT_RATE_LIMIT_DIR')
+# In-flight requests per upstream host of one worker with ASYNC_VIEWS
+BLOCKCHAIN_CLIENT_ASYNC_MAX_CONNECTIONS = int(os.getenv('BLOCKCHAIN_CLIENT_ASYNC_MAX_CONNECTIONS', 200))
+# Addresses per upstream multi-address balance query, and the limit of addresses per /crypto/<crypto>/balances/ request
+BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_BALANCE_BATCH_SIZE', 50))
+ADDRESS_BALANCES_MAX_ADDRESSES = int(os.getenv('ADDRESS_BALANCES_MAX_ADDRESSES', 1000))
+# Cache alias (see CACHES) used as the tier shared between workers, disabled when not set
+BLOCKCHAIN_CLIENT_SHARED_CACHE = os.getenv('BLOCKCHAIN_CLIENT_SHARED_CACHE')
+# Directory for lock files that collapse identical upstream calls across workers (needs the shared cache as well),
+# calls are only collapsed within a worker when not set
+BLOCKCHAIN_CLIENT_SINGLE_FLIGHT_LOCK_DIR = os.getenv('BLOCKCHAIN_CLIENT_SINGLE_FLIGHT_LOCK_DIR')
+# Transactions kept per worker. Confirmed transactions never expire, unconfirmed ones expire after the ttl (seconds)
+BLOCKCHAIN_CLIENT_TX_CACHE_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_TX_CACHE_SIZE', 10000))
+BLOCKCHAIN_CLIENT_UNCONFIRMED_TX_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_UNCONFIRMED_TX_TTL', 15))
+# Balances are fresh for BALANCE_FRESH_TTL seconds, then served stale for up to BALANCE_STALE_TTL more seconds
+# while they are refreshed in the background by one of REFRESH_WORKERS threads
+BLOCKCHAIN_CLIENT_BALANCE_CACHE_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_BALANCE_CACHE_SIZE', 50000))
+BLOCKCHAIN_CLIENT_BALANCE_FRESH_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_BALANCE_FRESH_TTL', 30))
+BLOCKCHAIN_CLIENT_BALANCE_STALE_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_BALANCE_STALE_TTL', 300))
+BLOCKCHAIN_CLIENT_REFRESH_WORKERS = int(os.getenv('BLOCKCHAIN_CLIENT_REFRESH_WORKERS', 2))
+# Seconds between updates of Address.balance_queried, so /my/balances/ writes at most once per user in that time
+BALANCE_QUERIED_RESOLUTION = int(os.getenv('BALANCE_QUERIED_RESOLUTION', 60))
+# Address transactions are fetched from upstream in pages of TX_CHUNK transactions (0: in pages of the requested size),
+# kept for TX_PAGE_TTL seconds (0 disables the cache, and prefetching with it). The next page is prefetched when a
+# user asked for the previous one within ADDRESS_TRANSACTIONS_PREFETCH_WINDOW seconds (0 disables prefetching), the
+# last page of up to ADDRESS_TRANSACTIONS_PREFETCH_USERS users is remembered per worker.
+ADDRESS_TRANSACTIONS_MAX_PAGE_SIZE = int(os.getenv('ADDRESS_TRANSACTIONS_MAX_PAGE_SIZE', 500))
+ADDRESS_TRANSACTIONS_PREFETCH_WINDOW = int(os.getenv('ADDRESS_TRANSACTIONS_PREFETCH_WINDOW', 60))
+ADDRESS_TRANSACTIONS_PREFETCH_USERS = int(os.getenv('ADDRESS_TRANSACTIONS_PREFETCH_USERS', 10000))
+BLOCKCHAIN_CLIENT_TX_CHUNK = int(os.getenv('BLOCKCHAIN_CLIENT_TX_CHUNK', 0))
+BLOCKCHAIN_CLIENT_TX_PAGE_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_TX_PAGE_TTL', 10))
+BLOCKCHAIN_CLIENT_TX_PAGE_CACHE_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_TX_PAGE_CACHE_SIZE', 1000))
+# Addresses and transactions upstream does not know fail without asking it again for NOT_FOUND_TTL seconds
+# (0 disables). Up to NOT_FOUND_CACHE_SIZE of them are remembered per worker, apart from the other caches.
+BLOCKCHAIN_CLIENT_NOT_FOUND_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_NOT_FOUND_TTL', 15))
+BLOCKCHAIN_CLIENT_NOT_FOUND_CACHE_SIZE = int(os.getenv('BLOCKCHAIN_CLIENT_NOT_FOUND_CACHE_SIZE', 10000))
+# Keep address histories in the database and serve repeated pages from there, fetching only new transactions
+# (at most every TX_INDEX_SYNC_TTL seconds) and older ones not indexed yet, TX_INDEX_CHUNK per upstream request
+BLOCKCHAIN_CLIENT_TX_INDEX = bool(os.getenv('BLOCKCHAIN_CLIENT_TX_INDEX'))
+BLOCKCHAIN_CLIENT_TX_INDEX_CHUNK = int(os.getenv('BLOCKCHAIN_CLIENT_TX_INDEX_CHUNK', 100))
+BLOCKCHAIN_CLIENT_TX_INDEX_SYNC_TTL = int(os.getenv('BLOCKCHAIN_CLIENT_TX_INDEX_SYNC_TTL', 30))
+# Stream /crypto/<crypto>/addresses/<address>/transactions/ (sync views, without BLOCKCHAIN_CLIENT_TX_INDEX):
+# upstream transactions are decoded, transformed and rendered one at a time from STREAM_CHUNK_SIZE byte chunks
+STREAM_ADDRESS_TRANSACTIONS = bool(os.getenv('STREAM_ADDRESS_TRANSACTIONS'))
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 65536))
+# Check addresses (down to their checksums) and transaction hashes before looking them up, and addresses added to
+# /my/addresses/. Lookups of malformed ones fail with 400 without reaching upstream or the search log. On by default,
+# VALIDATE_LOOKUPS=0 turns it off.
+VALIDATE_LOOKUPS = bool(int(os.getenv('VALIDATE_LOOKUPS', 1)))
+# Transaction details, address transaction pages and my balances carry ETags and answer If-None-Match with 304.
+# Confirmed transactions can be kept by the client for CONFIRMED_TRANSACTION_MAX_AGE seconds (private, never by shared
+# caches since the responses are per user).
+CONFIRMED_TRANSACTION_MAX_AGE = int(os.getenv('CONFIRMED_TRANSACTION_MAX_AGE', 31536000))
+# /my/balances/ lists MY_BALANCES_PAGE_SIZE addresses per page (cursor paginated, up to MY_BALANCES_MAX_PAGE_SIZE
+# with ?size=), only their balances are fetched. 0 lists all of them at once.
+MY_BALANCES_PAGE_SIZE = int(os.getenv('MY_BALANCES_PAGE_SIZE', 0))
+MY_BALANCES_MAX_PAGE_SIZE = int(os.getenv('MY_BALANCES_MAX_PAGE_SIZE', 500))
+# /my/balances/history/ covers the last BALANCE_HISTORY_DEFAULT_DAYS days unless asked for another range
+BALANCE_HISTORY_DEFAULT_DAYS = int(os.getenv('BALANCE_HISTORY_DEFAULT_DAYS', 30))
+# Bulk uploads to /my/addresses/bulk/ are written BULK_ADDRESSES_BATCH_SIZE rows at a time, up to
+# BULK_ADDRESSES_MAX_ROWS rows per upload. The first BULK_ADDRESSES_MAX_ERRORS rejected rows are reported.
+BULK_ADDRESSES_BATCH_SIZE = int(os.getenv('BULK_ADDRESSES_BATCH_SIZE', 1000))
+BULK_ADDRESSES_MAX_ROWS = int(os.getenv('BULK_ADDRESSES_MAX_ROWS', 100000))
+BULK_ADDRESSES_MAX_ERRORS = int(os.getenv('BULK_ADDRESSES_MAX_ERRORS', 100))
+# New transactions listed per address by /my/transactions/new/
+MY_NEW_TRANSACTIONS_LIMIT = int(os.getenv('MY_NEW_TRANSACTIONS_LIMIT', 50))
+# Cross-check the fast transaction transformer against the DRF serializers on every call (slow, meant for tests)
+BLOCKCHAIN_CLIENT_STRICT_TRANSFORM = bool(os.getenv('BLOCKCHAIN_CLIENT_STRICT_TRANSFORM'))
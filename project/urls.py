@@ -22,4 +22,5 @@ urlpatterns = [
   path(r'auth/', include('api.authentication.urls')),
   path(r'crypto/', include('api.crypto.urls')),
   path(r'my/', include('api.personal.urls')),
+  path(r'metrics/', include('api.metrics.urls')),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)